@@ -0,0 +1,85 @@
+"""Benchmark tag cache insert throughput for different DB settings.
+
+Usage: python benchmarks/bench_db.py [NUMBER_OF_FILES]
+
+Each setting saves the same tags for NUMBER_OF_FILES files (default 5000) in
+a fresh DB, created in the current directory so the benchmark hits the same
+kind of storage as the real genplis DB would.
+
+"""
+
+import contextlib
+import io
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+from genplis import db
+
+TAGS = {
+    "artist": ["Test Artist"],
+    "album": ["Test Album"],
+    "bitrate": 127.488,
+    "channels": 2,
+    "duration": 3.2653061224489797,
+    "genre": ["Synthwave; Retrowave; Electronic"],
+    "samplerate": 44100,
+    "title": ["Test"],
+}
+
+# (name, configure_connection kwargs or None for SQLite defaults, batch size)
+SETTINGS = [
+    ("commit per file, SQLite defaults", None, 1),
+    ("commit per file, mmap, WAL", {"wal": True}, 1),
+    ("batched, SQLite defaults", None, db.BATCH_SIZE),
+    ("batched, mmap", {}, db.BATCH_SIZE),
+    ("batched, mmap, WAL", {"wal": True}, db.BATCH_SIZE),
+    (
+        "batched, mmap, WAL, 16 KiB pages",
+        {"wal": True, "page_size": 16384},
+        db.BATCH_SIZE,
+    ),
+]
+
+
+def bench(files, config, batch_size):
+    with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+        conn = sqlite3.connect(Path(tmp_dir) / db.DB_NAME)
+        if config is not None:
+            db.configure_connection(conn, **config)
+        # same tables as genplis.core.main
+        cursor = conn.cursor()
+        db.create_files_table(cursor)
+        db.create_directories_table(cursor)
+        db.create_failed_files_table(cursor)
+        db.create_tags_tables(cursor)
+        db.migrate_db(cursor)
+        conn.commit()
+
+        start = timer()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with db.BatchWriter(conn, batch_size=batch_size) as writer:
+                for file in files:
+                    writer.add(file, TAGS)
+        elapsed = timer() - start
+        conn.close()
+    return elapsed
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as music_dir:
+        files = [Path(music_dir) / f"{n}.mp3" for n in range(n_files)]
+        for file in files:
+            file.touch()
+
+        print(f"Saving tags of {n_files} files")
+        for name, config, batch_size in SETTINGS:
+            elapsed = bench(files, config, batch_size)
+            print(f"{name:>36}: {elapsed:7.3f} s, {n_files / elapsed:9.1f} files/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark matching filters with index.TagIndex against a scan of all songs.
+
+Usage: python benchmarks/bench_index.py [NUMBER_OF_FILES]
+
+Tags of NUMBER_OF_FILES songs (default 100000) are generated in memory, with
+a few hundred genres and artists, as found in a real collection.
+
+"""
+
+import sys
+from pathlib import Path
+from timeit import default_timer as timer
+
+from genplis.index import TagIndex
+from genplis.m3ug import parse_m3ug
+
+FILTERS = [
+    "genre = Genre 7",
+    "genre ~= Metal",
+    "artist ~= Artist 12\nduration > 200",
+    "duration > 200",
+]
+
+
+def make_tags(n: int):
+    genre = f"Genre {n % 300}"
+    if n % 50 == 0:
+        genre = f"Heavy Metal; {genre}"
+    return {
+        "artist": [f"Artist {n % 1000}"],
+        "title": [f"Song {n}"],
+        "genre": [genre],
+        "duration": 120 + n % 240,
+    }
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    all_tags = {Path(f"{n}.mp3"): make_tags(n) for n in range(n_files)}
+    index = TagIndex(all_tags)
+    print(f"Matching filters over {n_files} songs")
+    for content in FILTERS:
+        rules = parse_m3ug(content)
+        start = timer()
+        expected = {
+            file
+            for file, tags in all_tags.items()
+            if all(rule.apply(tags) for rule in rules)
+        }
+        scan = timer() - start
+
+        start = timer()
+        index.match(rules)
+        first = timer() - start
+        start = timer()
+        songs = index.match(rules)
+        indexed = timer() - start
+        if songs != expected:
+            raise RuntimeError(f"Index and scan results differ for {content!r}")
+
+        name = content.replace("\n", ", ")
+        print(
+            f"{name:>36}: scan {scan * 1000:8.2f} ms, index {indexed * 1000:8.2f} ms "
+            f"({first * 1000:.2f} ms the first time), {len(songs)} songs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark applying M3UG rules with RuleNode.apply and compiled predicates.
+
+Usage: python benchmarks/bench_m3ug.py [NUMBER_OF_SONGS]
+
+Each filter is applied to the tags of NUMBER_OF_SONGS songs (default 100000),
+rule by rule like core.filter_songs, and with m3ug.compile_rules.
+
+"""
+
+import sys
+from timeit import default_timer as timer
+
+from genplis.m3ug import compile_rules, parse_m3ug
+
+FILTERS = [
+    "genre ~= Synthwave",
+    "genre = Synthwave",
+    "rating >= 4",
+    "year >= 1980\nyear < 1990\ngenre ~= Rock",
+]
+
+
+def make_tags(n: int):
+    tags = {
+        "artist": ["Test Artist"],
+        "title": [f"Song {n}"],
+        "genre": ["Synthwave; Retrowave; Electronic" if n % 3 else "Rock"],
+        "year": [str(1970 + n % 50)],
+        "duration": 3.2653061224489797,
+    }
+    if n % 2:
+        tags["fmps_rating"] = ["0.8"]
+    return tags
+
+
+def main():
+    n_songs = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    songs = [make_tags(n) for n in range(n_songs)]
+    print(f"Applying filters to {n_songs} songs")
+    for content in FILTERS:
+        rules = parse_m3ug(content)
+        start = timer()
+        expected = [all(rule.apply(tags) for rule in rules) for tags in songs]
+        tree = timer() - start
+
+        predicate = compile_rules(rules)
+        start = timer()
+        results = [predicate(tags) for tags in songs]
+        compiled = timer() - start
+        if results != expected:
+            raise RuntimeError(f"Compiled results differ for {content!r}")
+
+        name = content.replace("\n", ", ")
+        print(
+            f"{name:>44}: apply {tree / n_songs * 1e9:6.0f} ns/song, "
+            f"compiled {compiled / n_songs * 1e9:6.0f} ns/song "
+            f"({tree / compiled:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
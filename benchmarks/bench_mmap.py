@@ -0,0 +1,98 @@
+"""Benchmark parsing files with tinytag through a memory map and with reads.
+
+Usage: python benchmarks/bench_mmap.py [RUNS]
+
+Every file is parsed RUNS times (default 200) with TinyTag.get, with and
+without memory_map. Files are the test MP3 and Ogg files, and MP3 (see
+bench_tags.py), FLAC and WAV files generated in a temporary directory with a
+few dozen tags each.
+
+"""
+
+import struct
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+from bench_tags import VBR_BITRATES, make_mp3
+from tinytag import TinyTag
+
+TEST_FILES = Path(__file__).parent.parent / "tests" / "files"
+TAGS = {f"TAG{n}": f"Value {n}" for n in range(40)} | {
+    "TITLE": "Song",
+    "ARTIST": "Artist",
+    "GENRE": "Synthwave",
+}
+
+
+def make_flac(path: Path, size: int):
+    samplerate, channels, bitdepth, samples = 44100, 2, 16, 44100 * 60
+    streaminfo = struct.pack(">HH3s3s", 4096, 4096, b"\0\0\0", b"\0\0\0")
+    packed = samplerate << 44 | (channels - 1) << 41 | (bitdepth - 1) << 36 | samples
+    streaminfo += packed.to_bytes(8, "big") + bytes(16)
+    vendor = b"genplis"
+    comments = [f"{key}={value}".encode() for key, value in TAGS.items()]
+    vorbis_comment = struct.pack("<I", len(vendor)) + vendor
+    vorbis_comment += struct.pack("<I", len(comments))
+    for comment in comments:
+        vorbis_comment += struct.pack("<I", len(comment)) + comment
+    blocks = b""
+    for block_type, data, last in ((0, streaminfo, 0), (4, vorbis_comment, 0x80)):
+        blocks += bytes([block_type | last]) + len(data).to_bytes(3, "big") + data
+    path.write_bytes(b"fLaC" + blocks + bytes(size))
+
+
+def make_wav(path: Path, size: int):
+    fmt = struct.pack("<HHIIHH", 1, 2, 44100, 44100 * 4, 4, 16)
+    info = b"INFO"
+    for field, value in (
+        (b"INAM", "Song"),
+        (b"IART", "Artist"),
+        (b"IGNR", "Synthwave"),
+    ):
+        data = value.encode() + b"\0"
+        data += b"\0" * (len(data) % 2)
+        info += field + struct.pack("<I", len(data)) + data
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    chunks += b"data" + struct.pack("<I", size) + bytes(size)
+    chunks += b"LIST" + struct.pack("<I", len(info)) + info
+    path.write_bytes(b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks)
+
+
+def bench(file: Path, runs: int, memory_map: bool) -> float:
+    start = timer()
+    for _ in range(runs):
+        TinyTag.get(file, memory_map=memory_map)
+    return (timer() - start) / runs
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        files = {
+            "MP3 (test file)": TEST_FILES / "test.mp3",
+            "Ogg (test file)": TEST_FILES / "test.ogg",
+            "MP3 (5 MB VBR)": directory / "vbr.mp3",
+            "FLAC (5 MB)": directory / "test.flac",
+            "WAV (5 MB)": directory / "test.wav",
+        }
+        make_mp3(files["MP3 (5 MB VBR)"], 5 * 1024 * 1024, VBR_BITRATES)
+        make_flac(files["FLAC (5 MB)"], 5 * 1024 * 1024)
+        make_wav(files["WAV (5 MB)"], 5 * 1024 * 1024)
+        print(f"Parsing every file {runs} times")
+        for name, file in files.items():
+            expected = TinyTag.get(file).as_dict()
+            if TinyTag.get(file, memory_map=True).as_dict() != expected:
+                raise RuntimeError(f"Tags of {name} differ with memory_map")
+            reads = bench(file, runs, False)
+            mapped = bench(file, runs, True)
+            print(
+                f"{name:>16}: reads {reads * 1e6:7.1f} µs, "
+                f"memory map {mapped * 1e6:7.1f} µs ({reads / mapped:.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark parsing the tags of Ogg Vorbis files with cover art.
+
+Usage: python benchmarks/bench_ogg.py [KILOBYTES]
+
+Generates an Ogg Vorbis file in a temporary directory, with a picture of
+KILOBYTES (default 1024) in the comment header, which then continues over
+many pages, followed by a few megabytes of audio pages. It is parsed with
+tags only, and with tags and duration. Bytes read from the file are
+reported for both.
+
+"""
+
+import base64
+import io
+import struct
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+from bench_tags import CountingFileIO
+from tinytag import TinyTag
+
+RUNS = 5
+SAMPLE_RATE = 44100
+AUDIO_SIZE = 4 * 1024 * 1024
+SETUP_SIZE = 4000
+AUDIO_PACKET_SIZE = 400
+AUDIO_PACKETS_PER_PAGE = 10
+
+
+def make_pages(packets, position: int, sequence: int) -> list[bytes]:
+    """Return pages with the packets one after another, as encoders lay them out."""
+    segments = []
+    for packet in packets:
+        laces = [255] * (len(packet) // 255) + [len(packet) % 255]
+        offset = 0
+        for lace in laces:
+            segments.append(packet[offset : offset + lace])
+            offset += lace
+    pages = []
+    continued = False
+    for start in range(0, len(segments), 255):
+        page_segments = segments[start : start + 255]
+        header = struct.pack(
+            "<4sBBqIIiB",
+            b"OggS",
+            0,
+            int(continued),
+            position,
+            1,
+            sequence + len(pages),
+            0,
+            len(page_segments),
+        )
+        laces = bytes(len(segment) for segment in page_segments)
+        pages.append(header + laces + b"".join(page_segments))
+        continued = len(page_segments[-1]) == 255
+    return pages
+
+
+def make_picture(size: int) -> bytes:
+    mime, description = b"image/jpeg", b"Cover"
+    picture = struct.pack(">II", 3, len(mime)) + mime
+    picture += struct.pack(">I", len(description)) + description
+    picture += struct.pack(">IIIII", 500, 500, 24, 0, size) + bytes(size)
+    return picture
+
+
+def make_ogg(path: Path, picture_size: int):
+    ident = b"\x01vorbis" + struct.pack("<IBIiiiB", 0, 2, SAMPLE_RATE, 0, 128000, 0, 0)
+    ident += b"\x01"
+    vendor = b"genplis"
+    comments = [b"TITLE=Song", b"ARTIST=Artist", b"GENRE=Synthwave"]
+    comments.append(
+        b"METADATA_BLOCK_PICTURE=" + base64.b64encode(make_picture(picture_size))
+    )
+    comment = b"\x03vorbis" + struct.pack("<I", len(vendor)) + vendor
+    comment += struct.pack("<I", len(comments))
+    for item in comments:
+        comment += struct.pack("<I", len(item)) + item
+    comment += b"\x01"
+    setup = b"\x05vorbis" + bytes(SETUP_SIZE)
+    pages = make_pages([ident], 0, 0)
+    pages += make_pages([comment, setup], 0, len(pages))
+    audio = [bytes(AUDIO_PACKET_SIZE)] * AUDIO_PACKETS_PER_PAGE
+    count = AUDIO_SIZE // (AUDIO_PACKET_SIZE * AUDIO_PACKETS_PER_PAGE)
+    for n in range(count):
+        position = (n + 1) * SAMPLE_RATE * 60 // count
+        pages += make_pages(audio, position, len(pages))
+    path.write_bytes(b"".join(pages))
+
+
+def get_bytes_read(file: Path, duration: bool) -> int:
+    """Return the bytes read from file to parse its tags, and duration."""
+    with CountingFileIO(file) as raw:
+        TinyTag.get(file, file_obj=io.BufferedReader(raw), duration=duration)
+        return raw.bytes_read
+
+
+def main():
+    picture_size = int(float(sys.argv[1]) * 1024) if len(sys.argv) > 1 else 1024**2
+    with tempfile.TemporaryDirectory() as directory:
+        file = Path(directory) / "test.ogg"
+        make_ogg(file, picture_size)
+        tags = TinyTag.get(file, image=True)
+        if tags.duration != 60 or not tags.images.front_cover:
+            raise RuntimeError("Generated file is not parsed as expected")
+        print(
+            f"Parsing {file.stat().st_size / 1024**2:.1f} MB Ogg file, best of {RUNS}"
+        )
+        for name, duration in (("tags", False), ("tags and duration", True)):
+            times = []
+            for _ in range(RUNS):
+                start = timer()
+                TinyTag.get(file, duration=duration)
+                times.append(timer() - start)
+            size = get_bytes_read(file, duration)
+            print(
+                f"{name:>17}: {min(times) * 1000:7.2f} ms, "
+                f"read {size / 1024:.0f} KiB ({size / file.stat().st_size:.1%})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark memory usage and matching of store.TagStore against a dict per song.
+
+Usage: python benchmarks/bench_store.py [NUMBER_OF_FILES]
+
+Tags of NUMBER_OF_FILES songs (default 100000) are generated like
+tags.get_tags returns them, with a few hundred artists, albums and genres.
+Memory is measured with tracemalloc, so file paths are left out of both.
+
+"""
+
+import sys
+import tracemalloc
+from pathlib import Path
+from timeit import default_timer as timer
+
+from genplis.m3ug import parse_m3ug
+from genplis.store import TagStore
+
+FILTERS = [
+    "genre = Genre 7",
+    "genre ~= Metal",
+    "year >= 1980\nyear < 1990",
+    "rating >= 4",
+]
+
+
+def make_tags(n: int):
+    genre = f"Genre {n % 300}"
+    if n % 50 == 0:
+        genre = f"Heavy Metal; {genre}"
+    tags = {
+        "album": f"Album {n % 5000}",
+        "albumartist": f"Artist {n % 1000}",
+        "artist": f"Artist {n % 1000}",
+        "title": f"Song {n}",
+        "genre": genre,
+        "year": 1970 + n % 50,
+        "track": 1 + n % 12,
+        "track_total": 12,
+        "disc": 1,
+        "duration": 120.5 + n % 240,
+        "bitrate": 320.0,
+        "samplerate": 44100,
+        "channels": 2,
+        "filesize": 5_000_000 + n,
+    }
+    if n % 2:
+        tags["fmps_rating"] = 0.8
+    return tags
+
+
+def measure(build):
+    """Return what build returns and the memory it allocated, in bytes."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    files = [Path(f"{n}.mp3") for n in range(n_files)]
+    # paths cache their string and hash when first used, outside of measure
+    {file: None for file in files}
+
+    def build_dicts():
+        return {file: make_tags(n) for n, file in enumerate(files)}
+
+    def build_store():
+        store = TagStore()
+        for n, file in enumerate(files):
+            store.add(file, make_tags(n))
+        return store
+
+    all_tags, dict_size = measure(build_dicts)
+    store, store_size = measure(build_store)
+    print(f"Tags of {n_files} songs:")
+    print(f"{'dicts':>12}: {dict_size / 2**20:8.1f} MiB")
+    print(
+        f"{'TagStore':>12}: {store_size / 2**20:8.1f} MiB "
+        f"({dict_size / store_size:.1f}x smaller)"
+    )
+
+    for content in FILTERS:
+        rules = parse_m3ug(content)
+        start = timer()
+        expected = [
+            file
+            for file, tags in all_tags.items()
+            if all(rule.apply(tags) for rule in rules)
+        ]
+        dicts = timer() - start
+        start = timer()
+        songs = store.match(rules)
+        columnar = timer() - start
+        if songs != expected:
+            raise RuntimeError(f"TagStore and dict results differ for {content!r}")
+
+        name = content.replace("\n", ", ")
+        print(
+            f"{name:>26}: dicts {dicts * 1000:8.2f} ms, "
+            f"TagStore {columnar * 1000:8.2f} ms, {len(songs)} songs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark parsing the tags of MP3 files with and without audio properties.
+
+Usage: python benchmarks/bench_tags.py [MEGABYTES]
+
+Generates MP3 files of MEGABYTES of audio frames (default 20) in a temporary
+directory: constant bitrate (CBR), variable bitrate with a Xing header, and
+variable bitrate without it, which tinytag must walk frame by frame to find
+the duration. Each one is parsed with all tags, with the tags used by a
+genre filter, and with those tags plus duration. Bytes read from the file
+are reported for the last one.
+
+"""
+
+import io
+import struct
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+from tinytag import TinyTag
+
+from genplis.tags import get_tags
+
+RUNS = 5
+# bitrate ids of MPEG-1 Layer III: 9 is 128 kbps, 11 is 192 kbps, 14 is 320 kbps
+CBR_BITRATES = [9]
+VBR_BITRATES = [9, 11, 14, 11]
+KBPS = {9: 128, 11: 192, 14: 320}
+SAMPLE_RATE = 44100
+FIELDS = {
+    "all tags": None,
+    "genre": frozenset({"genre"}),
+    "genre, duration": frozenset({"genre", "duration"}),
+}
+
+
+def make_id3v2(tags: dict[str, str]) -> bytes:
+    frames = b""
+    for frame_id, text in tags.items():
+        content = b"\x00" + text.encode("latin1")
+        frames += frame_id.encode() + struct.pack(">I", len(content)) + b"\0\0"
+        frames += content
+    size = len(frames)
+    synchsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x03\x00\x00" + synchsafe + frames
+
+
+def make_frame(bitrate_id: int, xing: tuple[int, int] | None = None) -> bytes:
+    header = bytes((0xFF, 0xFB, bitrate_id << 4, 0x00))
+    length = 144000 * KBPS[bitrate_id] // SAMPLE_RATE
+    body = bytearray(length - len(header))
+    if xing is not None:
+        # frames and bytes flags, after the side information of a stereo frame
+        body[32:48] = b"Xing" + struct.pack(">III", 3, *xing)
+    return header + bytes(body)
+
+
+def make_mp3(path: Path, size: int, bitrates, xing: bool = False):
+    frames = [make_frame(bitrate_id) for bitrate_id in bitrates]
+    count = size // sum(len(frame) for frame in frames) * len(frames)
+    audio = b"".join(frames) * (count // len(frames))
+    if xing:
+        audio = make_frame(CBR_BITRATES[0], (count, len(audio))) + audio
+    tags = {"TIT2": "Song", "TPE1": "Artist", "TCON": "Synthwave"}
+    path.write_bytes(make_id3v2(tags) + audio)
+
+
+class CountingFileIO(io.FileIO):
+    """Raw file that counts the bytes read from it."""
+
+    bytes_read = 0
+
+    def readinto(self, buffer):
+        size = super().readinto(buffer)
+        self.bytes_read += size or 0
+        return size
+
+    def readall(self):
+        data = super().readall()
+        self.bytes_read += len(data)
+        return data
+
+
+def get_bytes_read(file: Path) -> int:
+    """Return the bytes read from file to parse its tags and duration."""
+    with CountingFileIO(file) as raw:
+        TinyTag.get(file, file_obj=io.BufferedReader(raw))
+        return raw.bytes_read
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size = int(megabytes * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as directory:
+        samples = {
+            "CBR": (CBR_BITRATES, False),
+            "VBR with Xing": (VBR_BITRATES, True),
+            "VBR without Xing": (VBR_BITRATES, False),
+        }
+        print(f"Parsing {megabytes} MB MP3 files, best of {RUNS} runs")
+        for name, (bitrates, xing) in samples.items():
+            file = Path(directory) / f"{name.replace(' ', '_')}.mp3"
+            make_mp3(file, size, bitrates, xing)
+            results = []
+            for fields_name, fields in FIELDS.items():
+                best = float("inf")
+                for _ in range(RUNS):
+                    start = timer()
+                    tags = get_tags(file, fields=fields)
+                    best = min(best, timer() - start)
+                if tags.get("genre") != "Synthwave":
+                    raise RuntimeError(f"Wrong tags for {name}: {tags}")
+                results.append(f"{fields_name} {best * 1000:7.2f} ms")
+            read = get_bytes_read(file)
+            print(
+                f"{name:>17}: {', '.join(results)}, read {read / 1024:.0f} KiB "
+                f"({read / file.stat().st_size:.1%})"
+            )
+
+
+if __name__ == "__main__":
+    main()
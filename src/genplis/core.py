@@ -1,17 +1,54 @@
 import argparse
+import os
+import queue
 import re
 import sqlite3
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 from timeit import default_timer as timer
+from typing import NamedTuple
 
 import psutil
+from tinytag import ParseError
 
-from . import db
+from . import db, sql
 from .exceptions import GenplisError
+from .files import (
+    DirectoryListing,
+    FileEntry,
+    get_fingerprint,
+    get_stat_calls,
+    walk,
+)
 from .m3u import create_m3u
 from .m3ug import parse_m3ug
-from .tags import get_tags
+from .store import TagStore
+from .tags import get_tags, is_music_file
+
+# Commands that can be given before PATH, see parse_args
+COMMANDS = {
+    ("watch",): "scan PATH, then keep its playlists updated as files change",
+    ("db", "gc"): "remove cached files no longer in PATH and compact the DB",
+}
+# Maximum number of items waiting between two pipeline stages
+PIPELINE_QUEUE_SIZE = 1000
+# Number of files sent at once to a parsing process
+PARSE_CHUNK_SIZE = 32
+# Marks the end of the items produced by a pipeline stage
+PIPELINE_DONE = object()
+# Files that failed to parse are only parsed again if they change, or after
+# this many seconds (e.g. in case a newer tinytag can parse them)
+FAILED_RETRY_SECONDS = 30 * 24 * 60 * 60
+# Cached files whose tags are loaded at once while walking, and paths saved at
+# once for args.gc, with args.streaming and args.columnar
+LOW_MEMORY_BATCH_SIZE = 500
+# Numbered backreferences, like \1 or (?(1)...), which would refer to another
+# group once patterns are combined, see combine_regexes
+NUMBERED_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?\(\d)")
 
 
 def regex_type(arg_value):
@@ -19,9 +56,23 @@ def regex_type(arg_value):
     return re.compile(arg_value)
 
 
+def positive_int_type(arg_value):
+    """"""
+    value = int(arg_value)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return value
+
+
 def setup_argparse():
+    commands = "\n".join(
+        f"  {' '.join(words):<12}{help}" for words, help in COMMANDS.items()
+    )
     parser = argparse.ArgumentParser(
-        description="Generate music playlists from your own filters."
+        description="Generate music playlists from your own filters.",
+        usage="%(prog)s [COMMAND] [options] PATH",
+        epilog=f"commands:\n{commands}",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument(
         "path",
@@ -32,11 +83,107 @@ def setup_argparse():
     parser.add_argument(
         "-e",
         "--exclude",
-        help="Exclude files matching this regex",
+        help=(
+            "Exclude files matching this regex, directories are matched with a "
+            "trailing slash and skipped entirely"
+        ),
         action="append",
         default=[],
         type=regex_type,
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes used to parse music files (default: 1)",
+        default=1,
+        type=positive_int_type,
+    )
+    parser.add_argument(
+        "--trust-dirs",
+        help=(
+            "Don't check files for modifications if their directory didn't change, "
+            "faster but misses files modified in place"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fingerprint",
+        help=(
+            "Recognize moved and renamed music files by a hash of the "
+            "start and end of their contents, instead of parsing them again"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        help="Parse again the files that failed to parse in previous runs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--wal",
+        help="Use write-ahead logging in the genplis DB (faster, stays enabled)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--gc",
+        help=(
+            "After scanning a directory, remove cached files that are no longer "
+            "in it (or are excluded) and compact the DB"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--filter-backend",
+        help=(
+            "Evaluate M3UG filters in Python, or as SQL queries over the cached "
+            "tags (default: python)"
+        ),
+        choices=["python", "sql"],
+        default="python",
+    )
+    parser.add_argument(
+        "--streaming",
+        help=(
+            "Find M3UG files first and match every song against them as it's "
+            "scanned, without keeping all tags in memory (filters are evaluated "
+            "in Python)"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--columnar",
+        help=(
+            "Keep tags in a compact columnar store instead of a dictionary per "
+            "file, using several times less memory (filters are evaluated in Python)"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--narrow-tags",
+        help=(
+            "Only parse the tags used by M3UG filters, and those given with "
+            "--keep-tag, faster and saves less data in the DB"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--keep-tag",
+        help="With --narrow-tags, also parse this tag",
+        action="append",
+        default=[],
+        metavar="TAG",
+    )
+    parser.add_argument(
+        "--poll",
+        help="In watch mode, check for changes periodically instead of using inotify",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        help="In watch mode, seconds between polling checks (default: 60)",
+        default=60.0,
+        type=float,
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -46,11 +193,43 @@ def setup_argparse():
     return parser
 
 
-def is_excluded(path: Path, args) -> bool:
-    for pattern in args.exclude:
-        if pattern.search(str(path)):
-            return True
-    return False
+def combine_regexes(patterns) -> re.Pattern | None:
+    """Combine a list of compiled regexes in one that matches if any of them do.
+
+    A single regex is much faster to apply to every path than a list of them.
+    Returns None if patterns is empty. Patterns with numbered backreferences
+    are matched separately, as combining them renumbers their groups.
+
+    """
+    if not patterns:
+        return None
+    if len(patterns) == 1:
+        return patterns[0]
+    if any(NUMBERED_REFERENCE.search(pattern.pattern) for pattern in patterns):
+        return AnyRegex(patterns)
+    try:
+        return re.compile("|".join(f"(?:{pattern.pattern})" for pattern in patterns))
+    except re.error:
+        # e.g. global inline flags like (?i) only work at the start of a regex
+        return AnyRegex(patterns)
+
+
+class AnyRegex:
+    """Fallback for combine_regexes when patterns can't be joined in one regex."""
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+
+    def search(self, string):
+        for pattern in self.patterns:
+            if match := pattern.search(string):
+                return match
+        return None
+
+
+def is_excluded(path: Path, exclude) -> bool:
+    """True if path matches exclude, a regex from combine_regexes or None."""
+    return exclude is not None and exclude.search(str(path)) is not None
 
 
 def process_path(conn, cursor, args):
@@ -83,16 +262,59 @@ def process_path(conn, cursor, args):
             print("Parsed filters:")
             for f in filters:
                 print(f"    {f}")
-        if is_excluded(args.path, args):
+        if is_excluded(args.path, combine_regexes(args.exclude)):
             print("WARNING: This file is excluded by current configuration.")
     else:
         print(f"{args.path} must be either a directory or a file. Exiting...")
         sys.exit(1)
 
 
-def process_directory(conn, cursor, directory, args):
+def process_directory(conn, cursor, directory, args, on_entry=None):
     """Traverse the directory and process all files.
 
+    Work is split in a pipeline of stages connected by bounded queues, so
+    directory traversal, tag parsing and DB writes overlap:
+
+    1. walk_stage lists the directory and queues the candidate files.
+    2. parse_stage parses M3UG files and music files with a stale cache.
+    3. The DB stage, run by the calling thread as it owns the connection,
+       saves freshly parsed tags with a db.BatchWriter.
+
+    Cache validity is checked against a snapshot of the cache keys, and
+    valid cached tags are read in a single query after the walk. Files that
+    are not music files are recognized by their extension alone, and files
+    that failed to parse are skipped until they should be retried, see
+    should_retry.
+
+    With args.fingerprint, music files without a valid cache entry are looked
+    up by their content fingerprint among other cached files, so files that
+    were moved reuse the cached tags instead of being parsed again.
+
+    With args.gc, cache entries in directory that the walk didn't find are
+    removed at the end, see collect_garbage.
+
+    on_entry, if given, is called with the files.FileEntry of every file and
+    directory found by the walk, as they are handled by the DB stage.
+
+    With args.columnar, tags are kept in a TagStore instead, which takes much
+    less memory, and the returned all_tags is empty too.
+
+    With args.narrow_tags, M3UG files are found before the music files too,
+    and only the tags used by their filters are parsed, see
+    get_tag_projection. Cached files are parsed again if they were saved
+    without some of those tags.
+
+    With args.streaming, M3UG files are found before the music files, so
+    every song is matched against the filters as soon as its tags are
+    available, and its tags are discarded right after, see PlaylistMatcher.
+    Only the songs of each playlist are kept in memory, and the returned
+    all_tags is empty.
+
+    With args.streaming and args.columnar, tags of cached files are loaded in
+    batches of LOW_MEMORY_BATCH_SIZE files while walking, instead of after the
+    walk, and the paths seen for args.gc are saved in DB in batches too, so
+    memory doesn't grow with the number of cached files.
+
     See process_file for how each file is handled.
 
     """
@@ -102,40 +324,633 @@ def process_directory(conn, cursor, directory, args):
         )
 
     start_time = timer()
+    start_stat_calls = get_stat_calls()
 
-    all_tags = {}
+    cached_keys = db.get_cached_keys(cursor, directory)
+    failed_files = db.get_failed_files(cursor, directory)
+    fingerprints = db.get_fingerprints(cursor) if args.fingerprint else {}
+    directory_cache = db.DirectoryCache(cursor, directory)
     all_filters = {}
-    for file in directory.rglob("*"):
-        if is_excluded(file, args):
-            if args.verbose:
-                print(f"Skipping {file} because of exclude pattern.")
-            continue
+    matcher = None
+    store = TagStore() if args.columnar else None
+    if args.streaming or args.narrow_tags:
+        all_filters = find_filters(directory, directory_cache, args)
+    if args.streaming:
+        matcher = PlaylistMatcher(all_filters)
+    projection = get_tag_projection(all_filters, args)
+    if projection is not None:
+        print(f"Parsing only tags used by filters: {', '.join(sorted(projection))}")
+    stats = ParseStats()
+    stop = threading.Event()
+    candidates = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    results = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stages = [
+        PipelineStage(
+            walk_stage,
+            directory,
+            directory_cache,
+            args,
+            candidates,
+            stop,
+            args.gc or on_entry is not None,
+        ),
+        PipelineStage(
+            parse_stage,
+            candidates,
+            results,
+            cached_keys,
+            failed_files,
+            fingerprints,
+            projection,
+            args,
+            stats,
+            stop,
+        ),
+    ]
+    for stage in stages:
+        stage.start()
 
-        if file.is_file():
-            tags, filters = process_file(conn, cursor, file, args)
-            if tags:
-                all_tags[file] = tags
-            if filters:
-                all_filters[file] = filters
+    all_tags = {}
+    # absolute path -> file for files whose tags will be loaded from cache
+    cached_files = {}
+    # absolute path -> traversal position of cached files, or their id in
+    # store, for args.streaming and args.columnar
+    cached_positions = {}
+    position = 0
+    # absolute paths of all files and directories found, for args.gc
+    seen_paths = set()
+    low_memory = args.streaming or args.columnar
+    if args.gc:
+        db.clear_seen_paths(cursor)
+    moved_files = 0
+
+    def load_cached_tags():
+        if low_memory:
+            rows = db.iter_tags_by_path(conn.cursor(), cached_files)
+        else:
+            rows = db.iter_cached_tags(conn.cursor(), directory, cached_files)
+        for path, tags in rows:
+            if store is not None:
+                store.set_tags(cached_positions[path], cached_files[path], tags)
+            elif matcher is not None:
+                if tags:
+                    matcher.add(cached_positions[path], cached_files[path], tags)
+            else:
+                all_tags[cached_files[path]] = tags
+        cached_files.clear()
+        cached_positions.clear()
+
+    try:
+        with db.BatchWriter(conn) as writer:
+            on_idle = writer.commit_if_due
+            while (item := get_item(results, stop, on_idle)) is not PIPELINE_DONE:
+                if isinstance(item, DirectoryListing):
+                    writer.add_directory_listing(item)
+                    continue
+                if isinstance(item, FileEntry):
+                    # directories are only queued to be seen
+                    if args.gc:
+                        seen_paths.add(str(item.path.absolute()))
+                    if on_entry is not None:
+                        on_entry(item)
+                    continue
+                entry = item.entry
+                file = entry.path
+                if on_entry is not None:
+                    on_entry(entry)
+                if args.gc:
+                    seen_paths.add(str(file.absolute()))
+                if item.moved_from is not None and not writer.copy(
+                    item.moved_from, entry, item.fingerprint
+                ):
+                    # the entry it matched changed in this run, e.g. files
+                    # swapped names, so the file is parsed after all
+                    tags, error, pid, elapsed = parse_music_file(
+                        file, args.verbose, projection
+                    )
+                    stats.add(pid, elapsed, failed=error is not None)
+                    item = item._replace(
+                        tags=tags, error=error, cached=False, moved_from=None
+                    )
+                if item.filters:
+                    # with a matcher, filters were already found
+                    if matcher is None:
+                        all_filters[file] = item.filters
+                elif item.cached:
+                    # reserve the slot to keep the traversal order, cached
+                    # tags are loaded all at once when the walk is complete
+                    path = str(file.absolute())
+                    cached_files[path] = file
+                    if store is not None:
+                        cached_positions[path] = store.reserve()
+                    elif matcher is not None:
+                        cached_positions[path] = position
+                        position += 1
+                    else:
+                        all_tags[file] = None
+                    if item.moved_from is not None:
+                        moved_files += 1
+                    elif item.fingerprint is not None:
+                        writer.update_key(entry, item.fingerprint)
+                    elif cached_keys[path][1] is None:
+                        writer.update_key(entry)
+                elif item.error:
+                    writer.add_failure(entry, item.error)
+                elif item.tags:
+                    if store is not None:
+                        store.add(file, item.tags)
+                    elif matcher is not None:
+                        matcher.add(position, file, item.tags)
+                        position += 1
+                    else:
+                        all_tags[file] = item.tags
+                    writer.add(file, item.tags, entry, item.fingerprint, projection)
+                    if str(file.absolute()) in failed_files:
+                        writer.remove_failure(file)
+                if low_memory and len(cached_files) >= LOW_MEMORY_BATCH_SIZE:
+                    load_cached_tags()
+                if low_memory and len(seen_paths) >= LOW_MEMORY_BATCH_SIZE:
+                    db.save_seen_paths(writer.cursor, seen_paths)
+                    seen_paths.clear()
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+    for stage in stages:
+        stage.raise_error()
+
+    load_cached_tags()
+    # empty tags mean the file is not a supported music file
+    all_tags = {file: tags for file, tags in all_tags.items() if tags}
 
     # Apply each filter to all songs to generate playlists
+    if matcher is None and store is None and args.filter_backend == "python":
+        matcher = PlaylistMatcher(all_filters)
+        for position, (file, tags) in enumerate(all_tags.items()):
+            matcher.add(position, file, tags)
+    elif args.filter_backend == "sql":
+        # absolute path -> file, in traversal order
+        paths = {str(file.absolute()): file for file in all_tags}
     for filter_file, rules in all_filters.items():
-        files = filter_songs(all_tags, filter_file, rules, args.verbose)
+        if store is not None:
+            files = store.match(rules)
+            if args.verbose:
+                print_songs(filter_file, files)
+        elif matcher is None:
+            files = filter_songs_sql(
+                conn.cursor(), directory, paths, filter_file, rules, args.verbose
+            )
+        else:
+            files = matcher.get_songs(filter_file)
+            if args.verbose:
+                print_songs(filter_file, files)
         print(f"Filter file {filter_file} matched {len(files)} songs")
         if len(files) > 0:
             playlist_file = filter_file.with_suffix(".m3u")
             print(f"Creating playlist {playlist_file}")
             create_m3u(playlist_file, files, overwrite=True)
 
+    if args.gc:
+        collect_garbage(conn, directory, seen_paths)
+
     end_time = timer()
     process_time = end_time - start_time
     used_memory = psutil.Process().memory_info().rss / (1024 * 1024)
-    print(f"Processed {len(all_tags)} files in {process_time:.3f} seconds")
+    if store is not None:
+        processed = len(store)
+    elif args.streaming:
+        processed = matcher.files
+    else:
+        processed = len(all_tags)
+    print(f"Processed {processed} files in {process_time:.3f} seconds")
+    print(f"Made {get_stat_calls() - start_stat_calls} stat calls")
+    if moved_files:
+        print(f"Reused cached tags of {moved_files} moved files")
+    stats.print_summary()
+    if matcher is not None:
+        matcher.print_summary()
+    if store is not None:
+        print(f"Tags take {store.get_size() / (1024 * 1024):.1f} MiB in columnar store")
     print(f"Total RAM usage: {used_memory} MiB")
 
     return all_tags, all_filters
 
 
+def get_tag_projection(all_filters, args) -> frozenset[str] | None:
+    """Return the names of the tags to parse with args.narrow_tags, else None.
+
+    Those are the tags used by the rules of all_filters, and args.keep_tag.
+    Ratings may come from fmps_rating, see m3ug.NameNode.find. Audio
+    properties like duration are only parsed if one of them is used, see
+    tags.get_tags, as playlists are written without them.
+
+    """
+    if not args.narrow_tags:
+        return None
+    fields = {name.lower() for name in args.keep_tag}
+    for rules in all_filters.values():
+        fields.update(rule.name_node.name.lower() for rule in rules)
+    if "rating" in fields:
+        fields.add("fmps_rating")
+    return frozenset(fields)
+
+
+def find_filters(directory, directory_cache, args):
+    """Return {M3UG file: rules} for the M3UG files in directory.
+
+    Directories whose cached listing is still valid are not listed again, nor
+    are their files stat'ed, so finding the filters before the actual scan is
+    cheap for a mostly-static collection.
+
+    """
+    exclude = combine_regexes(args.exclude)
+    return {
+        entry.path: parse_m3ug(entry.path.read_text(), entry.path, args.verbose)
+        for entry in walk(directory, exclude, False, directory_cache, trust_dirs=True)
+        if isinstance(entry, FileEntry)
+        and not entry.is_dir
+        and entry.path.suffix.lower() == ".m3ug"
+    }
+
+
+class PlaylistMatcher:
+    """Build the playlists of some filters one song at a time.
+
+    Songs are matched against every filter as soon as their tags are added,
+    so tags don't need to be kept, only the songs in each playlist. All
+    playlists are built in a single pass over the songs, and rules shared by
+    several filters (see RuleNode.key) are applied once per song.
+
+    """
+
+    def __init__(self, all_filters):
+        self.all_filters = all_filters
+        # filter file -> [(key, check)] of its rules, see RuleNode.compile
+        self.checks = {}
+        checks_by_key = {}
+        for filter_file, rules in all_filters.items():
+            self.checks[filter_file] = [
+                (rule.key, checks_by_key.setdefault(rule.key, rule.compile()))
+                for rule in rules
+            ]
+        # filter file -> [(position, file)] of the songs that matched
+        self.songs = {filter_file: [] for filter_file in all_filters}
+        self.files = 0
+        # rules applied, and not applied because another filter shared them
+        self.evaluations = 0
+        self.deduplicated = 0
+
+    def add(self, position: int, file: Path, tags):
+        """Match a song against every filter.
+
+        position is used to sort the songs, songs can be added in any order.
+
+        """
+        self.files += 1
+        # rule key -> result for this song
+        results = {}
+        for filter_file, checks in self.checks.items():
+            for key, check in checks:
+                if (passed := results.get(key)) is None:
+                    passed = results[key] = bool(check(tags))
+                    self.evaluations += 1
+                else:
+                    self.deduplicated += 1
+                if not passed:
+                    break
+            else:
+                # only executed if all rules pass
+                self.songs[filter_file].append((position, file))
+
+    def get_songs(self, filter_file) -> list[Path]:
+        """Return the songs that matched the filters of filter_file, in order."""
+        return [file for _, file in sorted(self.songs[filter_file])]
+
+    def print_summary(self):
+        if not self.all_filters:
+            return
+        print(
+            f"Matched {self.files} songs against {len(self.all_filters)} filters "
+            f"in a single pass, saving {len(self.all_filters) - 1} passes"
+        )
+        print(
+            f"Applied {self.evaluations} rules, {self.deduplicated} more were "
+            "shared by several filters and deduplicated"
+        )
+
+
+def gc_directory(conn, directory, args):
+    """Remove cache entries of the files no longer in directory.
+
+    Like the end of process_directory with args.gc, but only walking the
+    directory, without parsing any file.
+
+    """
+    exclude = combine_regexes(args.exclude)
+    seen_paths = {
+        str(entry.path.absolute()) for entry in walk(directory, exclude, args.verbose)
+    }
+    collect_garbage(conn, directory, seen_paths)
+
+
+def collect_garbage(conn, directory, seen_paths):
+    """Remove cache entries in directory not in seen_paths and compact the DB.
+
+    seen_paths are the absolute path strings of every file and directory found
+    in directory, see db.delete_stale_entries.
+
+    """
+    deleted_files, deleted_directories = db.delete_stale_entries(
+        conn.cursor(), directory, seen_paths
+    )
+    reclaimed = db.compact(conn)
+    print(
+        f"Removed {deleted_files} files and {deleted_directories} directories "
+        f"no longer in {directory} from cache"
+    )
+    print(f"Reclaimed {reclaimed / (1024 * 1024):.2f} MiB of DB space")
+
+
+class PipelineStage(threading.Thread):
+    """Run a pipeline stage function in a thread.
+
+    The stage function must put PIPELINE_DONE in its output queue when it
+    finishes, even on error, so the following stage doesn't wait forever. Any
+    exception is kept and raised again in the caller thread with raise_error.
+
+    """
+
+    def __init__(self, func, *args):
+        super().__init__(name=func.__name__, daemon=True)
+        self.func = func
+        self.args = args
+        self.error = None
+
+    def run(self):
+        try:
+            self.func(*self.args)
+        except BaseException as e:
+            self.error = e
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+
+def put_item(output, item, stop):
+    """Put item in the bounded output queue, giving up if stop is set.
+
+    Returns False if the pipeline was stopped before the item could be queued.
+
+    """
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get_item(source, stop, on_idle=None):
+    """Get the next item from the source queue, PIPELINE_DONE if stop is set.
+
+    on_idle is called periodically while waiting for an item.
+
+    """
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            if on_idle:
+                on_idle()
+    return PIPELINE_DONE
+
+
+def walk_stage(directory, directory_cache, args, output, stop, directories=False):
+    """Pipeline stage that puts every non-excluded file in directory in output.
+
+    Items are files.FileEntry tuples, so later stages don't need to stat the
+    file again, and files.DirectoryListing tuples to update directory_cache.
+    Directories are only put in output if directories is True.
+
+    """
+    exclude = combine_regexes(args.exclude)
+    try:
+        for entry in walk(
+            directory, exclude, args.verbose, directory_cache, args.trust_dirs
+        ):
+            if isinstance(entry, FileEntry) and entry.is_dir and not directories:
+                continue
+            if not put_item(output, entry, stop):
+                return
+    finally:
+        put_item(output, PIPELINE_DONE, stop)
+
+
+class PipelineItem(NamedTuple):
+    """A file handled by parse_stage, see there for the meaning of fields."""
+
+    entry: FileEntry
+    tags: dict | None = None
+    filters: list | None = None
+    cached: bool = False
+    error: tuple[str, str] | None = None
+    fingerprint: str | None = None
+    moved_from: str | None = None
+
+
+def parse_stage(
+    candidates,
+    output,
+    cached_keys,
+    failed_files,
+    fingerprints,
+    projection,
+    args,
+    stats,
+    stop,
+):
+    """Pipeline stage that parses the files coming from walk_stage.
+
+    Puts a PipelineItem for every file in output, in the same order the files
+    were received, and passes directories and their listings through:
+
+    - M3UG files are parsed and returned with their filters.
+    - Files that are not music files, or that failed to parse before and
+      shouldn't be retried yet, are returned without tags.
+    - Music files with a valid cache entry, saved with all the tags in
+      projection, are only flagged as cached, it's up to the DB stage to load
+      their tags.
+    - With args.fingerprint, other music files whose fingerprint matches
+      another cached file, saved with all the tags in projection, are flagged
+      as cached too, with the path of the cached file in moved_from. Cached
+      files missing from fingerprints (a snapshot from db.get_fingerprints)
+      get their fingerprint, to save it.
+    - Everything else is parsed, in a pool of args.jobs processes if > 1,
+      only for the tags in projection if not None, see get_tag_projection.
+      Files that fail to parse are returned with their error, see
+      parse_music_file.
+
+    """
+    # fingerprint -> (path, projection) of the cached files with that fingerprint
+    fingerprint_paths = {}
+    for path, (fingerprint, source_projection) in fingerprints.items():
+        fingerprint_paths.setdefault(fingerprint, []).append((path, source_projection))
+    executor = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    # files are sent to worker processes in chunks to amortize the IPC cost
+    chunk_size = PARSE_CHUNK_SIZE if executor else 1
+    # keep every worker busy while bounding the files parsed ahead of the DB stage
+    max_in_flight = args.jobs * 4
+    # (future, items) in the order files were received, items is None when
+    # the future result is a ready pipeline item instead of a parsed chunk
+    in_flight = deque()
+    chunk = []
+
+    def submit_chunk():
+        if not chunk:
+            return
+        items = chunk.copy()
+        chunk.clear()
+        files = [item.entry.path for item in items]
+        if executor:
+            future = executor.submit(parse_music_files, files, args.verbose, projection)
+        else:
+            future = done_future(parse_music_files(files, args.verbose, projection))
+        in_flight.append((future, items))
+
+    def emit(future, items):
+        if items is None:
+            return put_item(output, future.result(), stop)
+        results = future.result()
+        for item, (tags, error, pid, elapsed) in zip(items, results, strict=True):
+            stats.add(pid, elapsed, failed=error is not None)
+            if not put_item(output, item._replace(tags=tags, error=error), stop):
+                return False
+        return True
+
+    try:
+        while (item := get_item(candidates, stop, submit_chunk)) is not PIPELINE_DONE:
+            if isinstance(item, DirectoryListing) or item.is_dir:
+                # directories don't need to keep the order with files
+                if not put_item(output, item, stop):
+                    return
+                continue
+
+            file = item.path
+            fingerprint = None
+            if file.suffix.lower() == ".m3ug":
+                rules = parse_m3ug(file.read_text(), file, args.verbose)
+                ready_item = PipelineItem(item, filters=rules)
+            elif not is_music_file(file):
+                ready_item = PipelineItem(item)
+            elif is_cached(item, cached_keys, projection):
+                if args.fingerprint and str(file.absolute()) not in fingerprints:
+                    fingerprint = get_fingerprint(item)
+                ready_item = PipelineItem(item, cached=True, fingerprint=fingerprint)
+            elif not should_retry(item, failed_files, args):
+                stats.skipped += 1
+                ready_item = PipelineItem(item)
+            else:
+                if args.fingerprint:
+                    fingerprint = get_fingerprint(item)
+                moved_from = find_moved_from(
+                    str(file.absolute()),
+                    fingerprint_paths.get(fingerprint, ()),
+                    projection,
+                )
+                if moved_from is not None:
+                    ready_item = PipelineItem(
+                        item,
+                        cached=True,
+                        fingerprint=fingerprint,
+                        moved_from=moved_from,
+                    )
+                else:
+                    ready_item = None
+                    chunk.append(PipelineItem(item, fingerprint=fingerprint))
+                    if len(chunk) >= chunk_size:
+                        submit_chunk()
+            if ready_item:
+                # files waiting in chunk were received before this one
+                submit_chunk()
+                in_flight.append((done_future(ready_item), None))
+
+            while in_flight and (
+                len(in_flight) >= max_in_flight or in_flight[0][0].done()
+            ):
+                if not emit(*in_flight.popleft()):
+                    return
+        submit_chunk()
+        while in_flight:
+            if not emit(*in_flight.popleft()):
+                return
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        put_item(output, PIPELINE_DONE, stop)
+
+
+def find_moved_from(path: str, sources, projection) -> str | None:
+    """Return the first path a file at path could have been moved from.
+
+    sources are the (path, projection) of the cached files with the same
+    fingerprint. Only the ones saved with all the tags in projection can be
+    reused, see db.is_projection_valid. A file never matches its own stale
+    cache entry, its contents may have changed beyond the bytes hashed by
+    files.get_fingerprint.
+
+    """
+    return next(
+        (
+            source
+            for source, source_projection in sources
+            if source != path and db.is_projection_valid(source_projection, projection)
+        ),
+        None,
+    )
+
+
+def done_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def is_cached(entry: FileEntry, cached_keys, projection=None) -> bool:
+    """True if file has a valid entry in the cached_keys snapshot.
+
+    The entry must have been saved with all the tags in projection, see
+    db.get_cached_keys, db.is_cache_valid and db.is_projection_valid.
+
+    """
+    cached = cached_keys.get(str(entry.path.absolute()))
+    if cached is None:
+        return False
+    last_modified, key, cached_projection = cached
+    return db.is_entry_valid(entry, last_modified, key) and db.is_projection_valid(
+        cached_projection, projection
+    )
+
+
+def should_retry(entry: FileEntry, failed_files, args) -> bool:
+    """True unless the file failed to parse before and should still be skipped.
+
+    Failed files are parsed again when their size or modification time
+    changes, FAILED_RETRY_SECONDS after the last failure, or always with
+    args.retry_failed. See db.get_failed_files.
+
+    """
+    failure = failed_files.get(str(entry.path.absolute()))
+    if failure is None or args.retry_failed:
+        return True
+    mtime_ns, size, failed_at = failure
+    return (entry.mtime_ns, entry.size) != (
+        mtime_ns,
+        size,
+    ) or time.time() - failed_at >= FAILED_RETRY_SECONDS
+
+
 def process_file(conn, cursor, file, args):
     """Process a single file.
 
@@ -169,6 +984,76 @@ def process_file(conn, cursor, file, args):
     return tags, {}
 
 
+def parse_music_files(files, verbose: bool = False, fields=None):
+    """Parse the tags of a list of music files, see parse_music_file."""
+    return [parse_music_file(file, verbose, fields) for file in files]
+
+
+def parse_music_file(file: Path, verbose: bool = False, fields=None):
+    """Parse the tags of a single music file.
+
+    Meant to be run in a worker process, so it doesn't touch the DB. See
+    tags.get_tags for fields.
+
+    Returns a tuple in the form (tags, error, pid, elapsed_seconds). If the
+    file can't be parsed, tags is None and error is a tuple (error class name,
+    message) to save with db.cache_failure. Errors reading the file are only
+    reported, as they may not happen again.
+
+    """
+    start_time = timer()
+    tags = error = None
+    try:
+        tags = get_tags(file, verbose, fields)
+    except ParseError as e:
+        cause = e.__cause__ or e
+        if isinstance(cause, OSError):
+            print(f"Can't read {file}: {cause}")
+        else:
+            error = (type(cause).__name__, str(cause))
+    except OSError as e:
+        print(f"Can't read {file}: {e}")
+    return tags, error, os.getpid(), timer() - start_time
+
+
+class ParseStats:
+    """Number of files parsed and time spent by each worker process."""
+
+    def __init__(self):
+        self.workers = {}
+        # files that failed to parse in this run
+        self.failed = 0
+        # files not parsed because they failed in a previous run
+        self.skipped = 0
+
+    def add(self, pid: int, elapsed: float, failed: bool = False):
+        files, total_time = self.workers.get(pid, (0, 0.0))
+        self.workers[pid] = (files + 1, total_time + elapsed)
+        self.failed += failed
+
+    @property
+    def files(self) -> int:
+        return sum(files for files, _ in self.workers.values())
+
+    def print_summary(self):
+        if self.skipped:
+            print(
+                f"Skipped {self.skipped} files that failed to parse before, "
+                "use --retry-failed to parse them again"
+            )
+        if not self.workers:
+            return
+        if self.failed:
+            print(f"{self.failed} files failed to parse")
+        print(f"Parsed {self.files} files using {len(self.workers)} worker(s)")
+        for pid, (files, total_time) in sorted(self.workers.items()):
+            rate = files / total_time if total_time else float("inf")
+            print(
+                f"    worker {pid}: {files} files in {total_time:.3f} seconds "
+                f"({rate:.1f} files/s)"
+            )
+
+
 def filter_songs(files_and_tags, filter_file, rules, verbose: bool = False):
     if verbose:
         print(f"\nFiltering songs and generating playlist for {filter_file}")
@@ -183,30 +1068,104 @@ def filter_songs(files_and_tags, filter_file, rules, verbose: bool = False):
             filtered_songs.append(file)
 
     if verbose:
-        print(f"Files that match the filter {filter_file}:")
-        for song in filtered_songs:
-            print(f"  {song}")
+        print_songs(filter_file, filtered_songs)
 
     return filtered_songs
 
 
-def main():
-    # Set up argparse
+def print_songs(filter_file, songs):
+    print(f"Files that match the filter {filter_file}:")
+    for song in songs:
+        print(f"  {song}")
+
+
+def filter_songs_sql(cursor, directory, paths, filter_file, rules, verbose=False):
+    """Like filter_songs, but evaluating rules over the cache, see sql.filter_paths.
+
+    paths maps the absolute paths of the files to filter to their Path, and
+    must be in the cache. Songs are returned in the order of paths.
+
+    """
+    if verbose:
+        print(f"\nFiltering songs in SQL and generating playlist for {filter_file}")
+
+    matched = sql.filter_paths(cursor, directory, rules)
+    # stale cache entries of files no longer in directory may match too
+    filtered_songs = [file for path, file in paths.items() if path in matched]
+
+    if verbose:
+        print_songs(filter_file, filtered_songs)
+
+    return filtered_songs
+
+
+def parse_args(argv=None):
+    """Parse command line arguments.
+
+    The command line is either `genplis [options] PATH`, or a command from
+    COMMANDS followed by the same options, saved in args.command.
+
+    """
+    if argv is None:
+        argv = sys.argv[1:]
     parser = setup_argparse()
-    args = parser.parse_args()
+    command = None
+    for words in COMMANDS:
+        if tuple(argv[: len(words)]) == words:
+            command = " ".join(words)
+            argv = argv[len(words) :]
+            break
+    args = parser.parse_args(argv)
+    args.command = command
+    for option in ("streaming", "columnar"):
+        if not getattr(args, option):
+            continue
+        if command == "watch":
+            parser.error(f"--{option} can't be used in watch mode, it needs all tags")
+        if args.filter_backend == "sql":
+            parser.error(f"--{option} can't be used with --filter-backend sql")
+    if args.streaming and args.columnar:
+        parser.error("--streaming and --columnar can't be used together")
+    if args.narrow_tags and command == "watch":
+        parser.error("--narrow-tags can't be used in watch mode, filters may change")
+    if args.keep_tag and not args.narrow_tags:
+        parser.error("--keep-tag can only be used with --narrow-tags")
+    return args
+
+
+def main():
+    args = parse_args()
 
     db_path = db.get_db_path()
     if args.verbose:
         print(f"Using {db_path} for genplis DB")
 
     with sqlite3.connect(db_path) as conn:
+        db.configure_connection(conn, wal=args.wal)
         cursor = conn.cursor()
 
         # Create a DB for caching results if it doesn't exist
         db.create_files_table(cursor)
+        db.create_directories_table(cursor)
+        db.create_failed_files_table(cursor)
+        db.create_tags_tables(cursor)
+        db.migrate_db(cursor)
         conn.commit()
 
-        process_path(conn, cursor, args)
+        if args.command == "watch":
+            from .watch import watch
+
+            if not args.path.is_dir():
+                print(f"{args.path} must be a directory. Exiting...")
+                sys.exit(1)
+            watch(conn, args.path, args)
+        elif args.command == "db gc":
+            if not args.path.is_dir():
+                print(f"{args.path} must be a directory. Exiting...")
+                sys.exit(1)
+            gc_directory(conn, args.path, args)
+        else:
+            process_path(conn, cursor, args)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,29 @@
 import json
+import os
 import sqlite3
+import time
 from datetime import datetime
 from pathlib import Path
+from timeit import default_timer as timer
 
 from xdg_base_dirs import xdg_cache_home
 
 from .exceptions import GenplisDBError
-from .files import get_last_modified
+from .files import DirectoryListing, FileEntry, stat
 from .json import GenplisJSONEncoder
+from .tags import normalize_tags
 
 DB_NAME = "genplis.db"
+# Memory-map up to this many bytes of the DB file, reads skip a copy per page
+MMAP_SIZE = 256 * 1024 * 1024
+# Files saved in the same transaction by BatchWriter
+BATCH_SIZE = 500
+# Maximum seconds BatchWriter keeps saved files uncommitted
+BATCH_SECONDS = 5.0
+# Version of the DB schema, saved as PRAGMA user_version, see migrate_db
+SCHEMA_VERSION = 5
+# Oldest SQLite library supported, for INSERT ... RETURNING
+MIN_SQLITE_VERSION = (3, 35, 0)
 
 
 def get_db_path():
@@ -35,67 +49,797 @@ def setup_database_connection(conn_path):
     return conn, cursor
 
 
-def create_files_table(cursor):
+def configure_connection(conn, wal: bool = False, page_size: int | None = None):
+    """Tune the SQLite connection for genplis workload.
+
+    With wal=True the DB is switched to write-ahead logging, which is
+    persistent, and synchronous=NORMAL is used so commits don't need an fsync.
+    WAL guarantees the DB can't get corrupted even on power loss, at worst the
+    last committed transactions are lost. Rollback journal mode keeps SQLite
+    default synchronous=FULL as NORMAL is not corruption-safe there.
+
+    page_size only takes effect on new DBs, before any table is created.
+
+    Raises GenplisDBError if the SQLite library is older than
+    MIN_SQLITE_VERSION.
+
+    """
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise GenplisDBError(
+            f"SQLite {sqlite3.sqlite_version} is not supported, genplis needs "
+            f"SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} or newer"
+        )
+    if page_size is not None:
+        conn.execute(f"PRAGMA page_size = {int(page_size)}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    if wal:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+
+def create_files_table(cursor, name: str = "files"):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            last_modified TIMESTAMP,
+            tags JSONB,
+            mtime_ns INTEGER,
+            size INTEGER,
+            inode INTEGER,
+            device INTEGER,
+            fingerprint TEXT,
+            projection TEXT
+        )
+    """)
+
+
+def create_directories_table(cursor):
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS files (
+        CREATE TABLE IF NOT EXISTS directories (
             path TEXT PRIMARY KEY,
-            last_modified TIMESTAMP,
-            tags JSONB
+            mtime_ns INTEGER,
+            entries JSONB
+        )
+    """)
+
+
+def create_tags_tables(cursor):
+    """Create the tables of the normalized tags of the files table.
+
+    Every tag value of a file is a row of file_tags, numbers in the number
+    column and anything else as text in the value column, so the whole
+    collection can be queried with the indexes instead of decoding the tags of
+    every file. Tag names are stored once in tag_keys. See index_tags.
+
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tag_keys (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS file_tags (
+            file_id INTEGER NOT NULL REFERENCES files(id),
+            key_id INTEGER NOT NULL REFERENCES tag_keys(id),
+            value TEXT,
+            number REAL
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS file_tags_value ON file_tags(key_id, value)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS file_tags_number ON file_tags(key_id, number)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS file_tags_file ON file_tags(file_id)")
+
+
+def create_failed_files_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS failed_files (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            size INTEGER,
+            error TEXT,
+            message TEXT,
+            failed_at INTEGER
         )
     """)
 
 
+def migrate_db(cursor):
+    """Upgrade a DB created by an older version of genplis to SCHEMA_VERSION.
+
+    Call it after creating the tables. Caller is responsible for calling
+    commit on the DB connection.
+
+    Raises GenplisDBError if the DB was created by a newer version.
+
+    """
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise GenplisDBError(
+            f"DB schema version {version} is newer than the supported "
+            f"{SCHEMA_VERSION}, please update genplis"
+        )
+    if version < 1:
+        # files are keyed by their stat data, see FileEntry.cache_key. Existing
+        # rows have no key until they are saved again, see is_entry_valid
+        cursor.execute("PRAGMA table_info(files)")
+        columns = {row[1] for row in cursor.fetchall()}
+        for column in ("mtime_ns", "size", "inode", "device"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE files ADD COLUMN {column} INTEGER")
+        # listing entries have more stat data now, they'll be listed again
+        cursor.execute("DELETE FROM directories")
+    if version < 2:
+        # content fingerprints, see files.get_fingerprint
+        cursor.execute("PRAGMA table_info(files)")
+        if "fingerprint" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE files ADD COLUMN fingerprint TEXT")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS files_fingerprint ON files(fingerprint)"
+        )
+    if version < 3:
+        # files have an explicit id, as rowids may change on VACUUM, so the
+        # table is rebuilt, and their tags are normalized, see index_tags
+        cursor.execute("PRAGMA table_info(files)")
+        if "id" not in {row[1] for row in cursor.fetchall()}:
+            create_files_table(cursor, "files_new")
+            cursor.execute("""
+                INSERT INTO files_new(
+                    path, last_modified, tags, mtime_ns, size, inode, device,
+                    fingerprint
+                )
+                SELECT path, last_modified, tags, mtime_ns, size, inode, device,
+                fingerprint FROM files
+            """)
+            cursor.execute("DROP TABLE files")
+            cursor.execute("ALTER TABLE files_new RENAME TO files")
+            cursor.execute("CREATE INDEX files_fingerprint ON files(fingerprint)")
+        create_tags_tables(cursor)
+        cursor.execute("DELETE FROM file_tags")
+        cursor.execute("SELECT id, tags FROM files")
+        for file_id, tags in cursor.fetchall():
+            index_tags(cursor, file_id, json.loads(tags))
+    if version < 4:
+        # tags are typed when parsed, see tags.normalize_tags
+        cursor.execute("SELECT id, tags FROM files")
+        for file_id, tags in cursor.fetchall():
+            tags = normalize_tags(json.loads(tags))
+            cursor.execute(
+                "UPDATE files SET tags = ? WHERE id = ?",
+                (json.dumps(tags, cls=GenplisJSONEncoder), file_id),
+            )
+            index_tags(cursor, file_id, tags)
+    if version < 5:
+        # tags may be saved for only some tag names, see is_projection_valid
+        cursor.execute("PRAGMA table_info(files)")
+        if "projection" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE files ADD COLUMN projection TEXT")
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def is_entry_valid(entry: FileEntry, last_modified: int, key) -> bool:
+    """True if a cache entry saved for entry is not stale.
+
+    key is the FileEntry.cache_key the entry was saved with, which must be
+    equal to the current one. It is None for entries saved by older versions
+    of genplis, those are valid if the file timestamp is not newer than
+    last_modified.
+
+    """
+    if key is None:
+        return entry.last_modified <= last_modified
+    return key == entry.cache_key
+
+
+def is_projection_valid(projection, fields) -> bool:
+    """True if tags saved with projection have all the tags in fields.
+
+    Both are frozensets of tag names, or None for all tags, see
+    tags.get_tags.
+
+    """
+    return projection is None or (fields is not None and fields <= projection)
+
+
+def dump_projection(projection) -> str | None:
+    return None if projection is None else json.dumps(sorted(projection))
+
+
+def load_projection(value: str | None) -> frozenset[str] | None:
+    return None if value is None else frozenset(json.loads(value))
+
+
 def is_cache_valid(cursor, file_path: Path) -> bool | None:
     """True if the file is cached in DB and the entry is not stale.
 
-    False if file_path is in DB but the timestamp of the file is
-    more recent (i.e. cache is stale and shouldn't be used).
+    False if file_path is in DB but the file changed since it was cached
+    (i.e. cache is stale and shouldn't be used), see is_entry_valid, or if
+    only some of its tags were saved, see is_projection_valid.
 
     None if file_path is not in DB.
 
     Cached tags can then be retrieved with get_cached_tags.
 
     """
-    abs_file_path = file_path.absolute()
-    file_last_modified = get_last_modified(file_path)
+    entry = FileEntry.from_stat(file_path, stat(file_path))
 
     # Check if the file path already exists in the database
     cursor.execute(
-        """SELECT last_modified FROM files WHERE path = ?""",
-        (str(abs_file_path),),
+        """SELECT last_modified, mtime_ns, size, inode, device, projection
+        FROM files WHERE path = ?""",
+        (str(file_path.absolute()),),
     )
     row = cursor.fetchone()
     if row is None:
         return None
 
-    cached_timestamp = row[0]  # int, UNIX timestamp
-    return file_last_modified <= cached_timestamp
+    last_modified, *key, projection = row
+    return is_entry_valid(
+        entry, last_modified, get_cache_key(key)
+    ) and is_projection_valid(load_projection(projection), None)
+
 
+def get_cache_key(columns) -> tuple[int, int, int, int] | None:
+    """Return the cache key from the (mtime_ns, size, inode, device) columns."""
+    return None if columns[0] is None else tuple(columns)
 
-def cache_tags_for_file(cursor, file_path: Path, tags):
+
+def cache_tags_for_file(
+    cursor,
+    file_path: Path,
+    tags,
+    entry: FileEntry | None = None,
+    fingerprint: str | None = None,
+    projection: frozenset[str] | None = None,
+):
     """Save given tags for a music file in DB.
 
+    entry is the FileEntry of file_path, pass it if already known to avoid a
+    stat call. fingerprint is the content fingerprint of the file, if known,
+    see files.get_fingerprint. projection are the tag names tags were parsed
+    for, None if all, see is_projection_valid.
+
     Caller is responsible for calling commit on the DB connection.
 
     """
     file_path = file_path.absolute()
-    last_modified = get_last_modified(file_path)
+    if entry is None:
+        entry = FileEntry.from_stat(file_path, stat(file_path))
     json_tags = json.dumps(tags, cls=GenplisJSONEncoder)
 
     # UPSERT: https://www.sqlite.org/lang_upsert.html
     # Attempt to insert entry on DB, if path already exists then update tags and
-    # last_modified
+    # the cache key
     cursor.execute(
-        """INSERT INTO files(path, last_modified, tags)
-        VALUES (?, ?, ?)
+        """INSERT INTO files(
+            path, last_modified, tags, mtime_ns, size, inode, device, fingerprint,
+            projection
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(path) DO
-        UPDATE SET last_modified=?, tags=?
+        UPDATE SET last_modified=excluded.last_modified, tags=excluded.tags,
+        mtime_ns=excluded.mtime_ns, size=excluded.size, inode=excluded.inode,
+        device=excluded.device, fingerprint=excluded.fingerprint,
+        projection=excluded.projection
+        RETURNING id
         """,
-        (str(file_path), last_modified, json_tags, last_modified, json_tags),
+        (
+            str(file_path),
+            entry.last_modified,
+            json_tags,
+            *entry.cache_key,
+            fingerprint,
+            dump_projection(projection),
+        ),
     )
+    file_id = cursor.fetchone()[0]
+    index_tags(cursor, file_id, tags)
     print(f"Updated cache for file: {file_path}")
 
 
+def index_tags(cursor, file_id: int, tags):
+    """Save the normalized tags of a cached file, see create_tags_tables.
+
+    Lists are saved as a row per item, and dictionaries (e.g. images) are not
+    saved. Caller is responsible for calling commit on the DB connection.
+
+    """
+    rows = []
+    for key, value in tags.items():
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, bool) or not isinstance(item, int | float | str):
+                continue
+            if isinstance(item, str):
+                rows.append((file_id, item, None, key))
+            else:
+                rows.append((file_id, None, item, key))
+    cursor.execute("DELETE FROM file_tags WHERE file_id = ?", (file_id,))
+    cursor.executemany(
+        "INSERT INTO tag_keys(key) VALUES (?) ON CONFLICT DO NOTHING",
+        ((key,) for key in tags),
+    )
+    cursor.executemany(
+        """INSERT INTO file_tags(file_id, key_id, value, number)
+        SELECT ?, id, ?, ? FROM tag_keys WHERE key = ?""",
+        rows,
+    )
+
+
+def update_cache_key(cursor, entry: FileEntry, fingerprint: str | None = None):
+    """Save the cache key of a file with a valid cache entry.
+
+    Used for entries cached without a key, see is_entry_valid, or without a
+    fingerprint, which is saved too if given.
+
+    Caller is responsible for calling commit on the DB connection.
+
+    """
+    cursor.execute(
+        """UPDATE files SET mtime_ns=?, size=?, inode=?, device=?,
+        fingerprint=COALESCE(?, fingerprint)
+        WHERE path = ?""",
+        (*entry.cache_key, fingerprint, str(entry.path.absolute())),
+    )
+
+
+def copy_cache_entry(
+    cursor, source_path: str, entry: FileEntry, fingerprint: str
+) -> bool:
+    """Save the cached tags of source_path for the file of entry.
+
+    Used for files moved from source_path, or with the same contents. The
+    filename tag is changed to the new path, and the cache key and the
+    fingerprint (and projection) are taken from entry and source_path
+    respectively.
+
+    Tags are only copied if source_path is still cached with fingerprint, as
+    its entry may have changed since the fingerprint was looked up. Returns
+    True if they were copied.
+
+    Caller is responsible for calling commit on the DB connection.
+
+    """
+    cursor.execute(
+        """INSERT INTO files(
+            path, last_modified, tags, mtime_ns, size, inode, device, fingerprint,
+            projection
+        )
+        SELECT ?, ?, json_set(tags, '$.filename', ?), ?, ?, ?, ?, fingerprint,
+        projection
+        FROM files WHERE path = ? AND fingerprint = ?
+        ON CONFLICT(path) DO
+        UPDATE SET last_modified=excluded.last_modified, tags=excluded.tags,
+        mtime_ns=excluded.mtime_ns, size=excluded.size, inode=excluded.inode,
+        device=excluded.device, fingerprint=excluded.fingerprint,
+        projection=excluded.projection
+        RETURNING id, tags
+        """,
+        (
+            str(entry.path.absolute()),
+            entry.last_modified,
+            str(entry.path),
+            *entry.cache_key,
+            source_path,
+            fingerprint,
+        ),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    file_id, tags = row
+    index_tags(cursor, file_id, json.loads(tags))
+    print(f"Reused cache of {source_path} for file: {entry.path}")
+    return True
+
+
+class BatchWriter:
+    """Save tags for many music files in DB using batched transactions.
+
+    Files are committed every batch_size files or batch_seconds seconds,
+    whatever happens first, instead of paying an fsync per file. As every batch
+    is its own transaction a crash loses at most the last uncommitted batch,
+    the cache is never left half-written.
+
+    Use as a context manager, so the last batch is committed on exit, or
+    rolled back if the block raised:
+
+        with BatchWriter(conn) as writer:
+            writer.add(file_path, tags)
+
+    """
+
+    def __init__(
+        self,
+        conn,
+        batch_size: int = BATCH_SIZE,
+        batch_seconds: float = BATCH_SECONDS,
+    ):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.pending = 0
+        self.batch_start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            # don't save a batch left half-finished by the error
+            self.conn.rollback()
+            self.pending = 0
+
+    def add(
+        self,
+        file_path: Path,
+        tags,
+        entry: FileEntry | None = None,
+        fingerprint: str | None = None,
+        projection: frozenset[str] | None = None,
+    ):
+        """Save tags for file_path, committing if the batch is due.
+
+        See cache_tags_for_file.
+
+        """
+        cache_tags_for_file(
+            self.cursor, file_path, tags, entry, fingerprint, projection
+        )
+        self._added()
+
+    def update_key(self, entry: FileEntry, fingerprint: str | None = None):
+        """Save the cache key of a cached file, see update_cache_key."""
+        update_cache_key(self.cursor, entry, fingerprint)
+        self._added()
+
+    def copy(self, source_path: str, entry: FileEntry, fingerprint: str) -> bool:
+        """Save the cached tags of another file, see copy_cache_entry."""
+        if not copy_cache_entry(self.cursor, source_path, entry, fingerprint):
+            return False
+        self._added()
+        return True
+
+    def _added(self):
+        if self.pending == 0:
+            self.batch_start = timer()
+        self.pending += 1
+        self.commit_if_due()
+
+    def add_failure(self, entry: FileEntry, error: tuple[str, str]):
+        """Save a file that failed to parse, committing if the batch is due.
+
+        See cache_failure.
+
+        """
+        cache_failure(self.cursor, entry, error)
+        self._added()
+
+    def remove_failure(self, file_path: Path):
+        """Forget a file that failed to parse before, see delete_failure."""
+        delete_failure(self.cursor, file_path)
+        self._added()
+
+    def add_directory_listing(self, listing: DirectoryListing):
+        """Save a directory listing, committing if the batch is due.
+
+        See cache_directory_listing.
+
+        """
+        cache_directory_listing(self.cursor, listing)
+        self._added()
+
+    def commit_if_due(self):
+        """Commit if the batch is full or was started batch_seconds ago.
+
+        Call it periodically if there may be no new files to add for a while.
+
+        """
+        if self.pending and (
+            self.pending >= self.batch_size
+            or timer() - self.batch_start >= self.batch_seconds
+        ):
+            self.commit()
+
+    def commit(self):
+        if self.pending:
+            self.conn.commit()
+            self.pending = 0
+
+
+def cache_failure(cursor, entry: FileEntry, error: tuple[str, str]):
+    """Save a music file that failed to parse, so it's not parsed every run.
+
+    error is a tuple (error class name, message). The file is identified by
+    its size and modification time, see get_failed_files.
+
+    Caller is responsible for calling commit on the DB connection.
+
+    """
+    error_class, message = error
+    cursor.execute(
+        """INSERT INTO failed_files(path, mtime_ns, size, error, message, failed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO
+        UPDATE SET mtime_ns=excluded.mtime_ns, size=excluded.size,
+        error=excluded.error, message=excluded.message, failed_at=excluded.failed_at
+        """,
+        (
+            str(entry.path.absolute()),
+            entry.mtime_ns,
+            entry.size,
+            error_class,
+            message,
+            int(time.time()),
+        ),
+    )
+    print(f"Failed to parse {entry.path}: {error_class}: {message}")
+
+
+def delete_failure(cursor, file_path: Path):
+    """Forget a file saved by cache_failure, e.g. once it's parsed successfully.
+
+    Caller is responsible for calling commit on the DB connection.
+
+    """
+    cursor.execute(
+        """DELETE FROM failed_files WHERE path = ?""", (str(file_path.absolute()),)
+    )
+
+
+def get_path_range(directory: Path) -> tuple[str, str]:
+    """Return the (lower, upper) bounds of the paths inside directory.
+
+    Every path inside directory p satisfies lower <= p < upper when compared
+    as strings, which lets SQLite use the primary key index on files.path.
+
+    """
+    prefix = str(directory.absolute()).rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def get_cached_keys(cursor, directory: Path) -> dict[str, tuple]:
+    """Return a {path: (last_modified, key, projection)} snapshot of directory.
+
+    Used to check the cache validity of many files without a query per file,
+    see is_entry_valid and is_projection_valid.
+
+    """
+    cursor.execute(
+        """SELECT path, last_modified, mtime_ns, size, inode, device, projection
+        FROM files WHERE path >= ? AND path < ?""",
+        get_path_range(directory),
+    )
+    # files share a few projections, each one is loaded once
+    projections = {None: None}
+    cached_keys = {}
+    for path, last_modified, *key, projection in cursor:
+        if projection not in projections:
+            projections[projection] = load_projection(projection)
+        cached_keys[path] = (
+            last_modified,
+            get_cache_key(key),
+            projections[projection],
+        )
+    return cached_keys
+
+
+def get_failed_files(cursor, directory: Path) -> dict[str, tuple[int, int, int]]:
+    """Return a {path: (mtime_ns, size, failed_at)} snapshot of failed files.
+
+    Covers the files in directory saved by cache_failure. failed_at is the
+    UNIX timestamp of the last failure.
+
+    """
+    cursor.execute(
+        """SELECT path, mtime_ns, size, failed_at FROM failed_files
+        WHERE path >= ? AND path < ?""",
+        get_path_range(directory),
+    )
+    return {
+        path: (mtime_ns, size, failed_at) for path, mtime_ns, size, failed_at in cursor
+    }
+
+
+def get_fingerprints(cursor) -> dict[str, tuple]:
+    """Return a {path: (fingerprint, projection)} snapshot of cached files.
+
+    Covers all cached files with a fingerprint. Unlike other snapshots it's
+    not limited to a directory, so files moved from anywhere are found. See
+    files.get_fingerprint and is_projection_valid.
+
+    """
+    cursor.execute(
+        """SELECT path, fingerprint, projection FROM files
+        WHERE fingerprint IS NOT NULL"""
+    )
+    # files share a few projections, each one is loaded once
+    projections = {None: None}
+    fingerprints = {}
+    for path, fingerprint, projection in cursor:
+        if projection not in projections:
+            projections[projection] = load_projection(projection)
+        fingerprints[path] = (fingerprint, projections[projection])
+    return fingerprints
+
+
+def iter_cached_tags(cursor, directory: Path, paths):
+    """Yield (path, tags) for the files in paths that are cached in directory.
+
+    All cached entries in directory are read in a single query, but only the
+    tags of the entries in paths (a set of absolute path strings) are decoded.
+    The cursor must not be used for anything else until the iteration ends.
+
+    Like get_cached_tags, validity of the cache entries is not checked.
+
+    """
+    cursor.execute(
+        """SELECT path, tags FROM files WHERE path >= ? AND path < ?""",
+        get_path_range(directory),
+    )
+    for path, tags in cursor:
+        if path in paths:
+            yield path, json.loads(tags)
+
+
+def iter_tags_by_path(cursor, paths):
+    """Yield (path, tags) for the files in paths that are cached.
+
+    Unlike iter_cached_tags, only the entries in paths are read, so it suits
+    small batches of paths, which are looked up in a single query.
+
+    """
+    cursor.execute(
+        """SELECT path, tags FROM files
+        WHERE path IN (SELECT value FROM json_each(?))""",
+        (json.dumps(list(paths)),),
+    )
+    for path, tags in cursor:
+        yield path, json.loads(tags)
+
+
+def cache_directory_listing(cursor, listing: DirectoryListing):
+    """Save the listing of a directory in DB, see files.walk.
+
+    Caller is responsible for calling commit on the DB connection.
+
+    """
+    cursor.execute(
+        """INSERT INTO directories(path, mtime_ns, entries)
+        VALUES (?, ?, ?)
+        ON CONFLICT(path) DO
+        UPDATE SET mtime_ns=excluded.mtime_ns, entries=excluded.entries
+        """,
+        (str(listing.path.absolute()), listing.mtime_ns, json.dumps(listing.entries)),
+    )
+
+
+def clear_seen_paths(cursor):
+    """Forget the paths saved with save_seen_paths, call it before a walk."""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS seen_paths (path TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM seen_paths")
+
+
+def save_seen_paths(cursor, seen_paths):
+    """Save paths found by a walk for delete_stale_entries.
+
+    Lets a walk keep only a batch of paths in memory at a time.
+
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS seen_paths (path TEXT PRIMARY KEY)")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO seen_paths(path) VALUES (?)",
+        ((path,) for path in seen_paths),
+    )
+
+
+def delete_stale_entries(cursor, directory: Path, seen_paths) -> tuple[int, int]:
+    """Delete cached files and directory listings in directory not in seen_paths.
+
+    seen_paths are the absolute path strings of every file and directory found
+    in directory, other than the ones already saved with save_seen_paths. They
+    are loaded in a temporary table, so stale entries are found with a single
+    query instead of checking each cached path. directory itself is never
+    deleted.
+
+    Files that failed to parse are deleted too, see cache_failure.
+
+    Returns the number of deleted (files, directories). Caller is responsible
+    for calling commit on the DB connection.
+
+    """
+    save_seen_paths(cursor, seen_paths)
+    cursor.execute(
+        """DELETE FROM file_tags WHERE file_id IN (
+            SELECT id FROM files WHERE path >= ? AND path < ?
+            AND path NOT IN (SELECT path FROM seen_paths)
+        )""",
+        get_path_range(directory),
+    )
+    cursor.execute(
+        """DELETE FROM files WHERE path >= ? AND path < ?
+        AND path NOT IN (SELECT path FROM seen_paths)""",
+        get_path_range(directory),
+    )
+    deleted_files = cursor.rowcount
+    cursor.execute(
+        """DELETE FROM directories WHERE path >= ? AND path < ?
+        AND path NOT IN (SELECT path FROM seen_paths)""",
+        get_path_range(directory),
+    )
+    deleted_directories = cursor.rowcount
+    cursor.execute(
+        """DELETE FROM failed_files WHERE path >= ? AND path < ?
+        AND path NOT IN (SELECT path FROM seen_paths)""",
+        get_path_range(directory),
+    )
+    deleted_files += cursor.rowcount
+    cursor.execute("DELETE FROM seen_paths")
+    return deleted_files, deleted_directories
+
+
+def get_db_size(conn) -> int:
+    """Return the size in bytes of the DB pages, including free ones."""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def compact(conn) -> int:
+    """Rebuild the DB to release free pages, and update the query statistics.
+
+    Pending changes are committed first, as VACUUM can't run in a transaction.
+    Returns the number of bytes reclaimed.
+
+    """
+    conn.commit()
+    size_before = get_db_size(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("VACUUM")
+    # the first ANALYZE adds a table, which may not be offset on tiny DBs
+    return max(0, size_before - get_db_size(conn))
+
+
+class DirectoryCache:
+    """Snapshot of the cached listings of a directory and its subdirectories.
+
+    Lets files.walk skip listing directories that didn't change since the
+    last run.
+
+    """
+
+    def __init__(self, cursor, directory: Path):
+        lower, upper = get_path_range(directory)
+        cursor.execute(
+            """SELECT path, mtime_ns, entries FROM directories
+            WHERE path = ? OR (path >= ? AND path < ?)""",
+            (str(directory.absolute()), lower, upper),
+        )
+        self.directories = {
+            path: (mtime_ns, entries) for path, mtime_ns, entries in cursor
+        }
+
+    def get_entries(self, directory: Path, mtime_ns: int):
+        """Return the cached entries of directory, see files.DirectoryListing.
+
+        Returns None if directory is not cached or its mtime_ns changed.
+
+        """
+        cached = self.directories.get(str(directory.absolute()))
+        if cached is None or cached[0] != mtime_ns:
+            return None
+        return [tuple(entry) for entry in json.loads(cached[1])]
+
+
 def get_cached_tags(cursor, file_path: Path):
     """Retrieve cached tags for the given file.
 
@@ -1,7 +1,235 @@
+import hashlib
+import os
+import re
+import time
 from pathlib import Path
+from stat import S_ISREG
+from typing import NamedTuple
+
+# Number of stat calls done through this module, see stat
+_stat_calls = 0
+# Directories modified less than this many nanoseconds ago are not cached
+RACY_MTIME_NS = 2_000_000_000
+# Bytes hashed from the start and from the end of a file, see get_fingerprint
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+# Stat data of the DirectoryListing entries that were not stat'ed
+NO_STAT = (None, None, None, None)
+
+
+class FileEntry(NamedTuple):
+    """A path found by walk, with the data of its stat call.
+
+    Directories have no size, inode or device, and their mtime_ns is None
+    unless walk was given a directory cache.
+
+    """
+
+    path: Path
+    is_dir: bool
+    size: int | None
+    mtime_ns: int | None
+    inode: int | None = None
+    device: int | None = None
+
+    @classmethod
+    def from_stat(cls, path: Path, stat_result: os.stat_result) -> "FileEntry":
+        """Return the FileEntry of a regular file from its stat data."""
+        return cls(
+            path,
+            False,
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+            stat_result.st_ino,
+            stat_result.st_dev,
+        )
+
+    @property
+    def last_modified(self) -> int:
+        """Time of last modification as UNIX timestamp, see get_last_modified."""
+        return self.mtime_ns // 1_000_000_000
+
+    @property
+    def cache_key(self) -> tuple[int, int, int, int]:
+        """Stat data that changes whenever the file may have changed.
+
+        Comparing the whole (mtime_ns, size, inode, device) tuple for equality
+        also detects files replaced by older copies, e.g. restored from a
+        backup, which a newer-than check on the mtime would miss.
+
+        """
+        return (self.mtime_ns, self.size, self.inode, self.device)
+
+
+def stat(path: Path | str) -> os.stat_result:
+    """Like os.stat, but keeping count of the calls, see get_stat_calls."""
+    global _stat_calls
+    _stat_calls += 1
+    return os.stat(path)
+
+
+def get_stat_calls() -> int:
+    """Return the number of stat calls done by genplis so far."""
+    return _stat_calls
+
+
+class DirectoryListing(NamedTuple):
+    """Contents of a directory as listed by walk, to be cached between runs.
+
+    entries is a list of (name, is_dir, size, mtime_ns, inode, device) tuples,
+    in the order os.scandir returned them. The stat data is None for
+    directories and for entries that are not regular files or were not
+    stat'ed.
+
+    """
+
+    path: Path
+    mtime_ns: int
+    entries: list[tuple[str, bool, int | None, int | None, int | None, int | None]]
+
+
+def walk(
+    directory: Path,
+    exclude: re.Pattern | None = None,
+    verbose: bool = False,
+    directory_cache=None,
+    trust_dirs: bool = False,
+):
+    """Yield a FileEntry for every directory and regular file inside directory.
+
+    Entries are yielded in the same order as Path.rglob("*"): every entry of a
+    directory, then the contents of its subdirectories. Like rglob, symbolic
+    links to directories are not followed, and unreadable directories are
+    skipped.
+
+    Directory types come from os.scandir, usually without a stat call. Files
+    are stat'ed exactly once, so later stages can reuse their FileEntry data.
+
+    Paths matching the exclude regex are skipped without being stat'ed.
+    Directories are matched with a trailing separator (e.g. "/music/.git/"),
+    and excluded directories are not descended into.
+
+    With a directory_cache (see db.DirectoryCache) directories are stat'ed too,
+    and the ones whose mtime didn't change since they were cached are not
+    listed again. Their files are still stat'ed to detect modifications, unless
+    trust_dirs is True, then the cached stat data is used as well. Adding or
+    removing files changes the mtime of a directory, but modifying a file
+    doesn't, so trust_dirs misses files modified in place.
+    A DirectoryListing is yielded for every directory whose cached listing
+    needs to be updated, unless it was modified in the last RACY_MTIME_NS.
+
+    """
+    mtime_ns = None
+    if directory_cache is not None:
+        try:
+            mtime_ns = stat(directory).st_mtime_ns
+        except OSError:
+            return
+    yield from _walk(directory, mtime_ns, exclude, verbose, directory_cache, trust_dirs)
+
+
+def _walk(directory, mtime_ns, exclude, verbose, directory_cache, trust_dirs):
+    cached_entries = None
+    if directory_cache is not None:
+        cached_entries = directory_cache.get_entries(directory, mtime_ns)
+    if cached_entries is None:
+        try:
+            with os.scandir(directory) as it:
+                entries = [
+                    (entry.name, entry.is_dir(follow_symlinks=False), *NO_STAT)
+                    for entry in it
+                ]
+        except PermissionError:
+            return
+    else:
+        entries = cached_entries
+
+    listing = []
+    subdirectories = []
+    for name, is_dir, *stat_data in entries:
+        path = directory / name
+        path_str = os.path.join(directory, name)
+        if is_dir:
+            listing.append((name, True, *NO_STAT))
+            if exclude and exclude.search(path_str + os.sep):
+                if verbose:
+                    print(f"Skipping directory {path} because of exclude pattern.")
+                continue
+            entry_mtime_ns = None
+            if directory_cache is not None:
+                try:
+                    entry_mtime_ns = stat(path_str).st_mtime_ns
+                except OSError:
+                    continue
+            subdirectories.append((path, entry_mtime_ns))
+            yield FileEntry(path, True, None, entry_mtime_ns)
+            continue
+
+        if exclude and exclude.search(path_str):
+            listing.append((name, False, *NO_STAT))
+            if verbose:
+                print(f"Skipping {path} because of exclude pattern.")
+            continue
+        if trust_dirs and cached_entries is not None and stat_data[0] is not None:
+            # stat data in the order of FileEntry fields
+            entry = FileEntry(path, False, *stat_data)
+        else:
+            try:
+                stat_result = stat(path_str)
+            except OSError:
+                # broken symlink or deleted since the directory was listed
+                listing.append((name, False, *NO_STAT))
+                continue
+            if not S_ISREG(stat_result.st_mode):
+                listing.append((name, False, *NO_STAT))
+                continue
+            entry = FileEntry.from_stat(path, stat_result)
+        listing.append(
+            (name, False, entry.size, entry.mtime_ns, entry.inode, entry.device)
+        )
+        yield entry
+
+    if (
+        directory_cache is not None
+        and listing != cached_entries
+        # a directory modified again within its mtime granularity would keep
+        # the same mtime, so recently modified ones can't be trusted yet
+        and time.time_ns() - mtime_ns > RACY_MTIME_NS
+    ):
+        yield DirectoryListing(directory, mtime_ns, listing)
+
+    for subdirectory, subdirectory_mtime_ns in subdirectories:
+        yield from _walk(
+            subdirectory,
+            subdirectory_mtime_ns,
+            exclude,
+            verbose,
+            directory_cache,
+            trust_dirs,
+        )
+
+
+def get_fingerprint(entry: FileEntry) -> str | None:
+    """Return a fingerprint of the contents of a file, to recognize it if moved.
+
+    It's a hash of the file size and of its first and last
+    FINGERPRINT_BLOCK_SIZE bytes, where music formats keep their tags, so it's
+    much cheaper than parsing the whole file. Returns None if the file can't be
+    read.
+
+    """
+    digest = hashlib.blake2b(entry.size.to_bytes(8, "little"), digest_size=16)
+    try:
+        with open(entry.path, "rb") as f:
+            digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+            if entry.size > FINGERPRINT_BLOCK_SIZE:
+                f.seek(max(FINGERPRINT_BLOCK_SIZE, entry.size - FINGERPRINT_BLOCK_SIZE))
+                digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    except OSError:
+        return None
+    return digest.hexdigest()
 
 
 def get_last_modified(path: Path) -> int:
     """Return time of last modification as UNIX timestamp"""
     # return datetime.fromtimestamp(path.stat().st_mtime)
-    return int(path.stat().st_mtime)
+    return stat(path).st_mtime_ns // 1_000_000_000
@@ -0,0 +1,175 @@
+"""Inverted index over the tags of songs kept in memory, see TagIndex."""
+
+from pathlib import Path
+
+from .m3ug import ContainsRuleNode, EqualRuleNode, compile_rules, normalize
+
+# Length of the substrings indexed to find values containing a string
+NGRAM_SIZE = 3
+
+
+def get_ngrams(value: str) -> set[str]:
+    return {value[n : n + NGRAM_SIZE] for n in range(len(value) - NGRAM_SIZE + 1)}
+
+
+class KeyIndex:
+    """Songs by the value of a tag, as seen by the rules through NameNode.find.
+
+    - values maps the strings and numbers to the songs with that value.
+    - items maps the strings in lists, and the keys of dictionaries, to the
+      songs whose value contains them.
+    - ngrams maps every NGRAM_SIZE substring of the strings in values to the
+      strings containing it.
+    - fallback has the songs that must be checked in Python, e.g. a rating
+      coming from fmps_rating.
+
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.values = {}
+        self.items = {}
+        self.ngrams = {}
+        self.fallback = set()
+
+    def add(self, file: Path, tags):
+        value = self.get_value(tags)
+        if value is None:
+            return
+        if value is self.fallback:
+            self.fallback.add(file)
+        elif isinstance(value, list | dict):
+            for item in value:
+                if isinstance(item, str):
+                    self.items.setdefault(item, set()).add(file)
+        else:
+            if value not in self.values:
+                self.values[value] = set()
+                if isinstance(value, str):
+                    for ngram in get_ngrams(value):
+                        self.ngrams.setdefault(ngram, set()).add(value)
+            self.values[value].add(file)
+
+    def remove(self, file: Path, tags):
+        """Remove a song, tags must be the ones it was added with."""
+        value = self.get_value(tags)
+        if value is None:
+            return
+        if value is self.fallback:
+            self.fallback.discard(file)
+        elif isinstance(value, list | dict):
+            for item in value:
+                if isinstance(item, str):
+                    discard(self.items, item, file)
+        elif discard(self.values, value, file) and isinstance(value, str):
+            for ngram in get_ngrams(value):
+                discard(self.ngrams, ngram, value)
+
+    def get_value(self, tags):
+        """Return the normalized value of the tag, or self.fallback.
+
+        None means no rule can match the song on this tag.
+
+        """
+        raw = tags.get(self.key)
+        if not raw:
+            if self.key == "rating" and normalize(tags.get("fmps_rating")) is not None:
+                return self.fallback
+            return None
+        value = normalize(raw)
+        if value is None or isinstance(value, str | int | float | list | dict):
+            return value
+        # types not seen in tags, better leave them to rule.apply
+        return self.fallback
+
+    def equal(self, value) -> set[Path]:
+        """Return the songs a EqualRuleNode may match, see TagIndex.match."""
+        return self.values.get(value, set())
+
+    def contains(self, value: str) -> set[Path]:
+        """Return the songs a ContainsRuleNode may match, see TagIndex.match."""
+        songs = set(self.items.get(value, ()))
+        if len(value) >= NGRAM_SIZE:
+            strings = set.intersection(
+                *(self.ngrams.get(ngram, set()) for ngram in get_ngrams(value))
+            )
+        else:
+            strings = (string for string in self.values if isinstance(string, str))
+        for string in strings:
+            if value in string:
+                songs.update(self.values[string])
+        return songs
+
+
+def discard(postings: dict, value, file) -> bool:
+    """Remove file from the postings of value, True if they became empty."""
+    files = postings.get(value)
+    if files is None:
+        return False
+    files.discard(file)
+    if files:
+        return False
+    del postings[value]
+    return True
+
+
+class TagIndex:
+    """Inverted index over all_tags to match = and ~= rules without a scan.
+
+    Tags are indexed on demand, the first time a rule needs them, so only
+    the tags used in filters take memory. Songs added to or removed from
+    all_tags must be added to or removed from the index too.
+
+    """
+
+    def __init__(self, all_tags):
+        self.all_tags = all_tags
+        # lowercase tag name -> KeyIndex
+        self.keys = {}
+
+    def add(self, file: Path, tags):
+        for key_index in self.keys.values():
+            key_index.add(file, tags)
+
+    def remove(self, file: Path, tags):
+        for key_index in self.keys.values():
+            key_index.remove(file, tags)
+
+    def get_key_index(self, key: str) -> KeyIndex:
+        key_index = self.keys.get(key)
+        if key_index is None:
+            key_index = self.keys[key] = KeyIndex(key)
+            for file, tags in self.all_tags.items():
+                key_index.add(file, tags)
+        return key_index
+
+    def match(self, rules) -> set[Path]:
+        """Return the songs in all_tags for which all rules pass.
+
+        Songs for = and ~= rules are looked up in the index and intersected,
+        the other rules are applied only to the songs found. Without such
+        rules every song is checked.
+
+        """
+        songs = None
+        python_rules = []
+        for rule in rules:
+            if not isinstance(rule, EqualRuleNode | ContainsRuleNode):
+                python_rules.append(rule)
+                continue
+            key_index = self.get_key_index(rule.name_node.name.lower())
+            value = rule.value_node.value
+            if isinstance(rule, EqualRuleNode):
+                found = key_index.equal(value)
+            else:
+                found = key_index.contains(value)
+            found = found | {
+                file for file in key_index.fallback if rule.apply(self.all_tags[file])
+            }
+            songs = found if songs is None else songs & found
+        if songs is None:
+            songs = self.all_tags
+        if not python_rules:
+            return set(songs)
+        predicate = compile_rules(python_rules)
+        return {file for file in songs if predicate(self.all_tags[file])}
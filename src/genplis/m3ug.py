@@ -1,5 +1,7 @@
 import logging
+import operator
 import re
+from collections.abc import Callable
 
 from .exceptions import GenplisM3UGException
 
@@ -69,6 +71,37 @@ class NameNode:
         # default case is no match, no value found
         return normalized_name, None
 
+    def compile(self) -> Callable:
+        """Return a function taking tags and returning the normalized value.
+
+        Same as normalize(self.find(tags)[1]), but with the name lowercased
+        and the rating special case resolved ahead of time.
+
+        """
+        name = self.name.lower()
+
+        def get_value(tags):
+            raw = tags.get(name)
+            if not raw:
+                return None
+            if isinstance(raw, list):
+                # empty lists are falsy, handled above
+                return raw[0] if len(raw) == 1 else raw
+            return raw
+
+        if name != "rating":
+            return get_value
+
+        def get_rating(tags):
+            if tags.get(name):
+                return get_value(tags)
+            fmps_rating = normalize(tags.get("fmps_rating"))
+            if fmps_rating is not None:
+                return float(fmps_rating) * 5
+            return None
+
+        return get_rating
+
 
 class ValueNode:
     def __init__(self, value: Value, verbose: bool = False):
@@ -108,6 +141,15 @@ class RuleNode:
     def __eq__(self, other):
         return self.name_node == other.name_node and self.value_node == other.value_node
 
+    @property
+    def key(self) -> tuple:
+        """Hashable key, the same for rules that always give the same result.
+
+        Tag names are case-insensitive, see NameNode.find.
+
+        """
+        return (type(self), self.name_node.name.lower(), self.value_node.value)
+
     def __repr__(self):
         return f"Rule=<{self.name_node}, {self.OPERATOR_NAME}, {self.value_node}>"
 
@@ -159,6 +201,15 @@ class RuleNode:
         """
         raise NotImplementedError()
 
+    def compile(self) -> Callable:
+        """Return a function taking tags, true if the rule passes.
+
+        Same as apply, with the tag lookup and the comparison specialized for
+        this rule, see compile_rules.
+
+        """
+        raise NotImplementedError()
+
     @classmethod
     def check_params(cls, name: NameNode, value: ValueNode, filename: str, line: int):
         """Raise GenplisM3UGException if something is wrong with the rule."""
@@ -174,6 +225,17 @@ class EqualRuleNode(RuleNode):
         else:
             return tag_value == self.value_node.value
 
+    def compile(self) -> Callable:
+        get_value = self.name_node.compile()
+        expected = self.value_node.value
+
+        def equal(tags):
+            value = get_value(tags)
+            # like check, lists never pass
+            return not isinstance(value, list) and value == expected
+
+        return equal
+
 
 class NotEqualRuleNode(RuleNode):
     OPERATOR_NAME = "not equal"
@@ -184,6 +246,17 @@ class NotEqualRuleNode(RuleNode):
         else:
             return tag_value != self.value_node.value
 
+    def compile(self) -> Callable:
+        get_value = self.name_node.compile()
+        expected = self.value_node.value
+
+        def not_equal(tags):
+            value = get_value(tags)
+            # like check, lists never pass
+            return not isinstance(value, list) and value != expected
+
+        return not_equal
+
 
 class ContainsRuleNode(RuleNode):
     OPERATOR_NAME = "contains"
@@ -193,6 +266,18 @@ class ContainsRuleNode(RuleNode):
             return False
         return self.value_node.value in tag_value
 
+    def compile(self) -> Callable:
+        get_value = self.name_node.compile()
+        expected = self.value_node.value
+
+        def contains(tags):
+            value = get_value(tags)
+            if value is None or isinstance(value, int | float):
+                return False
+            return expected in value
+
+        return contains
+
     @classmethod
     def check_params(cls, name: NameNode, value: ValueNode, filename: str, line: int):
         if is_number(value.value):
@@ -216,6 +301,9 @@ class LesserRuleNode(RuleNode):
                 return float(tag_value) < self.value_node.value
         return False
 
+    def compile(self) -> Callable:
+        return compile_comparison(self, operator.lt)
+
     @classmethod
     def check_params(cls, name: NameNode, value: ValueNode, filename: str, line: int):
         if not is_number(value.value):
@@ -241,6 +329,9 @@ class LesserOrEqualRuleNode(RuleNode):
                 return float(tag_value) <= self.value_node.value
         return False
 
+    def compile(self) -> Callable:
+        return compile_comparison(self, operator.le)
+
     @classmethod
     def check_params(cls, name: NameNode, value: ValueNode, filename: str, line: int):
         if not is_number(value.value):
@@ -266,6 +357,9 @@ class GreaterRuleNode(RuleNode):
                 return float(tag_value) > self.value_node.value
         return False
 
+    def compile(self) -> Callable:
+        return compile_comparison(self, operator.gt)
+
     @classmethod
     def check_params(cls, name: NameNode, value: ValueNode, filename: str, line: int):
         if not is_number(value.value):
@@ -291,6 +385,9 @@ class GreaterOrEqualRuleNode(RuleNode):
                 return float(tag_value) >= self.value_node.value
         return False
 
+    def compile(self) -> Callable:
+        return compile_comparison(self, operator.ge)
+
     @classmethod
     def check_params(cls, name: NameNode, value: ValueNode, filename: str, line: int):
         if not is_number(value.value):
@@ -301,6 +398,52 @@ class GreaterOrEqualRuleNode(RuleNode):
             )
 
 
+def compile_comparison(rule: RuleNode, compare: Callable) -> Callable:
+    """Compile the check of a comparison rule, compare is e.g. operator.lt."""
+    get_value = rule.name_node.compile()
+    expected = rule.value_node.value
+
+    def check(value):
+        if isinstance(value, int | float):
+            return compare(value, expected)
+        if isinstance(value, str):
+            # isdecimal is true for the same digits as \d, but skips the regex
+            # in the usual case
+            if value.isdecimal() or INT_RE.match(value):
+                return compare(int(value), expected)
+            if FLOAT_RE.match(value):
+                return compare(float(value), expected)
+            return False
+        if isinstance(value, list):
+            return any(check(item) for item in value)
+        return False
+
+    def comparison(tags):
+        return check(get_value(tags))
+
+    return comparison
+
+
+def compile_rules(rules) -> Callable:
+    """Return a function taking tags, true if all rules pass.
+
+    It gives the same results as applying each rule, but is faster, see
+    RuleNode.compile.
+
+    """
+    checks = [rule.compile() for rule in rules]
+    if len(checks) == 1:
+        return checks[0]
+
+    def predicate(tags):
+        for check in checks:
+            if not check(tags):
+                return False
+        return True
+
+    return predicate
+
+
 def parse_m3ug(content: str, filename: str = "N/A", verbose: bool = False):
     rules = []
     if verbose:
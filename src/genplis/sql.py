@@ -0,0 +1,211 @@
+"""Evaluate M3UG rules inside SQLite, over the JSON tags of the files table.
+
+Every rule is compiled to a SQL expression that is 1 if the rule passes, 0 if
+it fails, and NULL if SQL can't tell exactly how RuleNode.apply would behave
+(e.g. numbers in strings with non-ASCII digits, or the rating alias). Files
+where all rules are 1 match directly, files where a rule is NULL and none is 0
+are checked again in Python. So results are exactly the ones of
+core.filter_songs, but Python only decodes the tags of a few files.
+
+"""
+
+# Queries are built from fixed fragments and parameter names, values are
+# always passed as parameters
+# ruff: noqa: S608
+
+import json
+from pathlib import Path
+
+from . import db
+from .m3ug import (
+    ContainsRuleNode,
+    EqualRuleNode,
+    GreaterOrEqualRuleNode,
+    GreaterRuleNode,
+    LesserOrEqualRuleNode,
+    LesserRuleNode,
+    NotEqualRuleNode,
+    is_number,
+)
+
+# JSON types that Python sees as numbers, as bool is a subclass of int
+NUMBER_TYPES = "('integer', 'real', 'true', 'false')"
+COMPARISON_OPERATORS = {
+    LesserRuleNode: "<",
+    LesserOrEqualRuleNode: "<=",
+    GreaterRuleNode: ">",
+    GreaterOrEqualRuleNode: ">=",
+}
+# Longest string of digits that always fits in a SQLite integer
+MAX_INT_DIGITS = 18
+
+# Type (vt) and value (vx) of the tag after m3ug.normalize, computed from the
+# JSON type (t), value (x) and array length (n) of the raw tag. Falsy raw values
+# are normalized to null, like NameNode.find does.
+NORMALIZED_VALUE = """
+    SELECT
+        CASE
+            WHEN t IS NULL OR t IN ('null', 'false')
+                OR (t IN ('integer', 'real') AND x = 0)
+                OR (t = 'text' AND x = '')
+                OR (t = 'array' AND n = 0)
+                OR (t = 'object' AND x = '{{}}')
+            THEN 'null'
+            WHEN t = 'array' AND n = 1 THEN json_type(x, '$[0]')
+            ELSE t
+        END AS vt,
+        CASE
+            WHEN t = 'array' AND n = 1 THEN json_extract(x, '$[0]')
+            ELSE x
+        END AS vx
+    FROM (
+        SELECT
+            json_type(tags, :{path}) AS t,
+            json_extract(tags, :{path}) AS x,
+            json_array_length(tags, :{path}) AS n
+    )
+"""
+
+
+def compile_rules(rules) -> tuple[list[str], dict]:
+    """Compile rules to SQL expressions over the tags column of files.
+
+    Returns the list of expressions, one per rule, and a dictionary with the
+    named parameters they use.
+
+    """
+    params = {}
+    expressions = []
+    for n, rule in enumerate(rules):
+        expressions.append(compile_rule(rule, f"r{n}", params))
+    return expressions, params
+
+
+def compile_rule(rule, prefix: str, params: dict) -> str:
+    """Compile a single rule, see compile_rules.
+
+    Parameters are added to params with names starting with prefix.
+
+    """
+    name = rule.name_node.name.lower()
+    if '"' in name:
+        # can't be used in a JSON path
+        return "NULL"
+    path, value = f"{prefix}_path", f"{prefix}_value"
+    params[path] = f'$."{name}"'
+    params[value] = rule.value_node.value
+
+    check = compile_check(rule, value)
+    if check is None:
+        return "NULL"
+    expression = f"(SELECT {check} FROM ({NORMALIZED_VALUE.format(path=path)}))"
+    if name == "rating":
+        # without a rating tag fmps_rating is used, see NameNode.find
+        fmps_path = f"{prefix}_fmps_path"
+        params[fmps_path] = '$."fmps_rating"'
+        expression = f"""CASE
+            WHEN json_type(tags, :{fmps_path}) IS NOT NULL
+                AND (SELECT vt = 'null' FROM ({NORMALIZED_VALUE.format(path=path)}))
+            THEN NULL
+            ELSE {expression}
+        END"""
+    return expression
+
+
+def compile_check(rule, value: str) -> str | None:
+    """Compile rule.check over the normalized tag type vt and value vx.
+
+    value is the name of the parameter with the rule value. Returns None if
+    the rule type is not supported.
+
+    """
+    rule_value = rule.value_node.value
+    if isinstance(rule, EqualRuleNode | NotEqualRuleNode):
+        if is_number(rule_value):
+            equal = f"vt IN {NUMBER_TYPES} AND vx = :{value}"
+        else:
+            equal = f"vt = 'text' AND vx = :{value}"
+        if isinstance(rule, EqualRuleNode):
+            # lists never pass, check doesn't return for them
+            return f"CASE WHEN {equal} THEN 1 ELSE 0 END"
+        return f"CASE WHEN vt = 'array' THEN 0 WHEN {equal} THEN 0 ELSE 1 END"
+
+    if isinstance(rule, ContainsRuleNode):
+        # substring for strings, item for lists and key for dictionaries
+        return f"""CASE
+            WHEN vt = 'text' THEN instr(vx, :{value}) > 0
+            WHEN vt = 'array' THEN EXISTS (
+                SELECT 1 FROM json_each(vx) WHERE type = 'text' AND value = :{value}
+            )
+            WHEN vt = 'object' THEN EXISTS (
+                SELECT 1 FROM json_each(vx) WHERE key = :{value}
+            )
+            ELSE 0
+        END"""
+
+    operator = COMPARISON_OPERATORS.get(type(rule))
+    if operator is None:
+        return None
+    # lists pass if any item passes
+    item_check = compile_comparison("type", "value", operator, value)
+    return f"""CASE
+        WHEN vt = 'array' THEN CASE
+            WHEN EXISTS (
+                SELECT 1 FROM json_each(vx) WHERE ({item_check}) = 1
+            ) THEN 1
+            WHEN EXISTS (
+                SELECT 1 FROM json_each(vx) WHERE ({item_check}) IS NULL
+            ) THEN NULL
+            ELSE 0
+        END
+        ELSE {compile_comparison("vt", "vx", operator, value)}
+    END"""
+
+
+def compile_comparison(vt: str, vx: str, operator: str, value: str) -> str:
+    """Compile a comparison of a value that is not a list.
+
+    Strings are compared as numbers if they match m3ug.INT_RE or
+    m3ug.FLOAT_RE. Only integers made of ASCII digits are compared in SQL.
+    Other strings that may match are left to Python, as they may have
+    non-ASCII digits or a trailing newline, and SQLite may round floats
+    differently. Nested lists are left to Python too.
+
+    """
+    return f"""CASE
+        WHEN {vt} IN {NUMBER_TYPES} THEN {vx} {operator} :{value}
+        WHEN {vt} = 'array' THEN NULL
+        WHEN {vt} != 'text' THEN 0
+        WHEN {vx} GLOB '[0-9]*' AND {vx} NOT GLOB '*[^0-9]*'
+            AND length({vx}) <= {MAX_INT_DIGITS}
+        THEN CAST({vx} AS INTEGER) {operator} :{value}
+        WHEN {vx} GLOB '*[^ -~]*' THEN NULL
+        WHEN {vx} GLOB '*[0-9]*' AND {vx} NOT GLOB '*[^0-9.]*' THEN NULL
+        ELSE 0
+    END"""
+
+
+def filter_paths(cursor, directory: Path, rules) -> set[str]:
+    """Return the absolute paths of the cached files in directory matching rules.
+
+    See core.filter_songs.
+
+    """
+    expressions, params = compile_rules(rules)
+    params["lower"], params["upper"] = db.get_path_range(directory)
+    columns = "".join(f", {expr} AS r{n}" for n, expr in enumerate(expressions))
+    passed = " AND ".join(f"r{n} IS NOT 0" for n in range(len(expressions)))
+    unknown = " OR ".join(f"r{n} IS NULL" for n in range(len(expressions)))
+    cursor.execute(
+        f"""SELECT path, CASE WHEN {unknown or "0"} THEN tags END FROM (
+            SELECT path, tags{columns} FROM files
+            WHERE path >= :lower AND path < :upper
+        ) WHERE {passed or "1"}""",
+        params,
+    )
+    paths = set()
+    for path, tags in cursor:
+        # tags are only selected if SQL can't tell if some rule passes
+        if tags is None or all(rule.apply(json.loads(tags)) for rule in rules):
+            paths.add(path)
+    return paths
@@ -0,0 +1,298 @@
+"""Compact columnar store for the tags of a whole collection, see TagStore."""
+
+import json
+import sys
+from array import array
+from pathlib import Path
+
+from .m3ug import compile_rules, normalize
+
+# Array typecodes from narrowest to widest, arrays start with the narrowest and
+# are widened when a value doesn't fit, see set_item
+CODE_TYPECODES = ("B", "H", "I")
+INT_TYPECODES = ("b", "h", "i", "q")
+
+
+def set_item(numbers: array, index: int, value, typecodes) -> array:
+    """Set numbers[index] to value, return numbers or a wider copy of it."""
+    while True:
+        try:
+            numbers[index] = value
+            return numbers
+        except OverflowError:
+            typecode = typecodes[typecodes.index(numbers.typecode) + 1]
+            numbers = array(typecode, numbers)
+
+
+class DictColumn:
+    """Values of a tag with dictionary encoding.
+
+    Every distinct value is kept once in values, and codes has the index in
+    values of the value of every file, 0 (None) for files without the tag.
+
+    """
+
+    def __init__(self):
+        self.values = [None]
+        # hashable key of a value -> its index in values, see get_value_key
+        self.value_codes = {}
+        self.codes = array(CODE_TYPECODES[0])
+
+    def set(self, file_id: int, value):
+        key = get_value_key(value)
+        code = self.value_codes.get(key)
+        if code is None:
+            code = self.value_codes[key] = len(self.values)
+            self.values.append(value)
+        missing = file_id + 1 - len(self.codes)
+        if missing > 0:
+            self.codes.extend([0] * missing)
+        self.codes = set_item(self.codes, file_id, code, CODE_TYPECODES)
+
+    def get(self, file_id: int):
+        if file_id >= len(self.codes):
+            return None
+        return self.values[self.codes[file_id]]
+
+    def filter(self, check, file_ids) -> list[int]:
+        """Return the file_ids whose value passes check, checking each value once."""
+        passed = [check(value) for value in self.values]
+        codes = self.codes
+        size = len(codes)
+        return [
+            file_id
+            for file_id in file_ids
+            if passed[codes[file_id] if file_id < size else 0]
+        ]
+
+    def get_size(self) -> int:
+        return (
+            sys.getsizeof(self.values)
+            + sum(get_value_size(value) for value in self.values)
+            + sys.getsizeof(self.value_codes)
+            # strings are their own key, see get_value_key
+            + sum(
+                get_value_size(key) for key in self.value_codes if type(key) is not str
+            )
+            + sys.getsizeof(self.codes)
+        )
+
+
+class NumberColumn:
+    """Values of a tag that are all int or all float, in the narrowest array.
+
+    present has a 1 for every file with the tag.
+
+    """
+
+    def __init__(self, value_type: type):
+        self.value_type = value_type
+        self.numbers = array(INT_TYPECODES[0] if value_type is int else "d")
+        self.present = bytearray()
+
+    def accepts(self, value) -> bool:
+        # bool is a subclass of int, but must not become an int
+        if type(value) is not self.value_type:
+            return False
+        return self.value_type is float or -(2**63) <= value < 2**63
+
+    def set(self, file_id: int, value):
+        missing = file_id + 1 - len(self.numbers)
+        if missing > 0:
+            self.numbers.extend([0] * missing)
+            self.present.extend(bytes(missing))
+        self.numbers = set_item(self.numbers, file_id, value, INT_TYPECODES)
+        self.present[file_id] = 1
+
+    def get(self, file_id: int):
+        if file_id >= len(self.present) or not self.present[file_id]:
+            return None
+        return self.numbers[file_id]
+
+    def filter(self, check, file_ids) -> list[int]:
+        """Return the file_ids whose value passes check."""
+        return [file_id for file_id in file_ids if check(self.get(file_id))]
+
+    def to_dict_column(self) -> DictColumn:
+        column = DictColumn()
+        for file_id in range(len(self.numbers)):
+            if self.present[file_id]:
+                column.set(file_id, self.numbers[file_id])
+        return column
+
+    def get_size(self) -> int:
+        return sys.getsizeof(self.numbers) + sys.getsizeof(self.present)
+
+
+def get_value_key(value):
+    """Return a hashable key for a tag value, different for different types.
+
+    Unlike the values themselves, 1, 1.0 and True have different keys, so
+    values keep their type. Strings, the most common values, are their own
+    key to save memory.
+
+    """
+    if type(value) is str:
+        return value
+    if isinstance(value, list | dict):
+        return (type(value), json.dumps(value, sort_keys=True, default=str))
+    return (type(value), value)
+
+
+def get_value_size(value) -> int:
+    if isinstance(value, list | tuple):
+        return sys.getsizeof(value) + sum(get_value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            get_value_size(key) + get_value_size(item) for key, item in value.items()
+        )
+    return sys.getsizeof(value)
+
+
+class Row:
+    """Tags of a file in a TagStore, with the get method rules look tags up with."""
+
+    def __init__(self, store: "TagStore", file_id: int):
+        self.store = store
+        self.file_id = file_id
+
+    def get(self, key, default=None):
+        column = self.store.columns.get(key)
+        if column is None:
+            return default
+        value = column.get(self.file_id)
+        return default if value is None else value
+
+
+class TagStore:
+    """Tags of many files, kept as a column per tag instead of a dict per file.
+
+    Files get consecutive integer ids, in the order they are added. Columns
+    with only ints or only floats are typed arrays, other columns have their
+    values dictionary encoded, see DictColumn. Both take a fraction of the
+    memory of a dictionary per file, as tag names and repeated values are only
+    kept once.
+
+    """
+
+    def __init__(self):
+        # file id -> file
+        self.files = []
+        # tag name -> DictColumn or NumberColumn
+        self.columns = {}
+        # rule key -> result of filter_rows with all files, see match
+        self.cache = {}
+        # values checked by rules, and rules answered from cache
+        self.evaluations = 0
+        self.deduplicated = 0
+
+    def __len__(self):
+        return sum(file is not None for file in self.files)
+
+    def add(self, file: Path, tags) -> int:
+        """Add the tags of a file and return its id."""
+        file_id = self.reserve()
+        self.set_tags(file_id, file, tags)
+        return file_id
+
+    def reserve(self) -> int:
+        """Return the id for a file whose tags will be set later.
+
+        The file is left out of match results until set_tags is called.
+
+        """
+        self.files.append(None)
+        return len(self.files) - 1
+
+    def set_tags(self, file_id: int, file: Path, tags):
+        """Set the tags of a reserved file, empty tags are ignored."""
+        if not tags:
+            return
+        self.files[file_id] = file
+        self.cache.clear()
+        for key, value in tags.items():
+            if value is None:
+                continue
+            column = self.columns.get(key)
+            if column is None:
+                if type(value) in (int, float):
+                    column = NumberColumn(type(value))
+                else:
+                    column = DictColumn()
+                self.columns[sys.intern(key)] = column
+            if isinstance(column, NumberColumn) and not column.accepts(value):
+                column = self.columns[key] = column.to_dict_column()
+            column.set(file_id, value)
+
+    def get_tags(self, file_id: int) -> dict:
+        tags = {}
+        for key, column in self.columns.items():
+            value = column.get(file_id)
+            if value is not None:
+                tags[key] = value
+        return tags
+
+    def filter_rows(self, rule, file_ids) -> list[int]:
+        """Return the file_ids for which rule passes.
+
+        The rule is checked once per distinct value of dictionary encoded
+        columns. Ratings are checked for every file, as they may come from
+        fmps_rating, see m3ug.NameNode.find.
+
+        """
+        name = rule.name_node.name.lower()
+        if name == "rating":
+            predicate = compile_rules([rule])
+            self.evaluations += len(file_ids)
+            return [file_id for file_id in file_ids if predicate(Row(self, file_id))]
+
+        def check(value):
+            self.evaluations += 1
+            # falsy values are not found, see m3ug.NameNode.find
+            return rule.check(normalize(value) if value else None)
+
+        column = self.columns.get(name)
+        if column is None:
+            return list(file_ids) if check(None) else []
+        return column.filter(check, file_ids)
+
+    def match(self, rules) -> list[Path]:
+        """Return the files for which all rules pass, in the order they were added.
+
+        Each rule narrows down the files the next one is checked against.
+        Results of the first rule of every filter are cached, so filters that
+        start with the same rule share it.
+
+        """
+        if not rules:
+            return [file for file in self.files if file is not None]
+        first, *others = rules
+        file_ids = self.cache.get(first.key)
+        if file_ids is None:
+            file_ids = self.cache[first.key] = self.filter_rows(
+                first, range(len(self.files))
+            )
+        else:
+            self.deduplicated += 1
+        for rule in others:
+            file_ids = self.filter_rows(rule, file_ids)
+        files = (self.files[file_id] for file_id in file_ids)
+        return [file for file in files if file is not None]
+
+    def get_size(self) -> int:
+        """Return the approximate memory used by the tags, in bytes."""
+        return sys.getsizeof(self.columns) + sum(
+            sys.getsizeof(key) + column.get_size()
+            for key, column in self.columns.items()
+        )
+
+
+def get_tags_size(all_tags) -> int:
+    """Return the approximate memory used by the tags in a {file: tags} dict.
+
+    Like TagStore.get_size, file paths are not counted.
+
+    """
+    return sys.getsizeof(all_tags) + sum(
+        get_value_size(tags) for tags in all_tags.values()
+    )
@@ -3,17 +3,51 @@ from pathlib import Path
 
 from tinytag import TinyTag
 
+from .m3ug import FLOAT_RE, INT_RE, normalize
+
 LARGE_TAG = 1000
+# Audio properties, only parsed if asked for, as finding the duration may
+# need to read the whole file, see get_tags
+AUDIO_TAGS = frozenset({"duration", "bitrate", "samplerate", "channels", "bitdepth"})
+# Tags saved as numbers when their value is a number, see normalize_tags
+NUMERIC_TAGS = {
+    "year",
+    "original_year",
+    "track",
+    "track_total",
+    "disc",
+    "disc_total",
+    "bpm",
+    "rating",
+    "fmps_rating",
+}
+
+
+def is_music_file(file_path: Path) -> bool:
+    """True if tinytag supports the file, judging only by its extension."""
+    return TinyTag.is_supported(file_path)
+
+
+def get_tags(
+    file_path: Path, verbose: bool = False, fields: frozenset[str] | None = None
+) -> dict | None:
+    """Return music tags as a dictionary, or None if not a music file.
+
+    With fields, a set of lowercase tag names, other tags are skipped by
+    tinytag without decoding them. All AUDIO_TAGS are parsed if any of them
+    is in fields, and none otherwise. File data like filename or filesize is
+    always returned.
 
+    Raises tinytag.ParseError if the file can't be parsed.
 
-def get_tags(file_path: Path, verbose: bool = False) -> dict | None:
-    """Return music tags as a dictionary, or None if not a music file."""
-    if not TinyTag.is_supported(file_path):
+    """
+    if not is_music_file(file_path):
         if verbose:
             print(f"Skipping {file_path}: not supported by tinytag")
         return None
 
-    tag = TinyTag.get(file_path).as_dict()
+    duration = fields is None or not AUDIO_TAGS.isdisjoint(fields)
+    tag = TinyTag.get(file_path, duration=duration, fields=fields).as_dict()
 
     # Sanitize tags:
     # 1. Transform Paths into strings, otherwise m3ug rules would fail
@@ -26,7 +60,50 @@ def get_tags(file_path: Path, verbose: bool = False) -> dict | None:
             if verbose:
                 print(f"Removing tag {key} because it's larger than {LARGE_TAG} bytes")
             del tag[key]
-    return tag
+    return normalize_tags(tag)
+
+
+def normalize_tags(tags: dict) -> dict:
+    """Return tags in the form M3UG rules see them, so they are cheaper to check.
+
+    - Keys are lowercased, as rules look tags up by lowercase name.
+    - Lists with a single item are unwrapped, unless the item is falsy or a
+      list, as m3ug.normalize would do.
+    - NUMERIC_TAGS with a number as string, e.g. year "1990", are saved as
+      numbers, so = and != rules compare them as numbers too.
+    - Without a rating tag, the 0 to 5 rating is computed from fmps_rating,
+      as m3ug.NameNode.find would do.
+
+    It's idempotent, tags normalized by older versions are normalized again
+    by DB migrations.
+
+    """
+    normalized = {}
+    for key, value in tags.items():
+        lowercase_key = key.lower()
+        # a tag with the lowercase name is the one rules found
+        if lowercase_key in normalized and key != lowercase_key:
+            continue
+        key = lowercase_key
+        if isinstance(value, list) and len(value) == 1:
+            item = value[0]
+            if item and not isinstance(item, list):
+                value = item
+        if key in NUMERIC_TAGS and isinstance(value, str):
+            if INT_RE.match(value):
+                value = int(value)
+            elif FLOAT_RE.match(value):
+                value = float(value)
+        normalized[key] = value
+
+    fmps_rating = normalize(normalized.get("fmps_rating"))
+    if not normalized.get("rating") and fmps_rating is not None:
+        try:
+            normalized["rating"] = float(fmps_rating) * 5
+        except (TypeError, ValueError):
+            # left for rules to fail on, like before normalizing
+            pass
+    return normalized
 
 
 def get_tag_size(value) -> int:
@@ -0,0 +1,372 @@
+"""Keep playlists up to date by watching the music collection for changes.
+
+After an initial scan all tags and filters are kept in memory. Filesystem
+events only cause the affected files to be parsed again, and only the
+playlists whose songs changed to be written again.
+
+Events come from inotify on Linux. Elsewhere, or if inotify can't be used,
+the whole collection is checked periodically instead.
+
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from . import db
+from .core import combine_regexes, parse_music_file, process_directory
+from .files import FileEntry, stat, walk
+from .index import TagIndex
+from .m3u import create_m3u
+from .m3ug import compile_rules, parse_m3ug
+from .tags import is_music_file
+
+# Seconds without new events before changes are processed, so a batch of
+# changes (e.g. copying an album) is handled at once
+SETTLE_SECONDS = 1.0
+# Maximum seconds to wait for events to settle
+MAX_SETTLE_SECONDS = 10.0
+
+# See inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyMonitor:
+    """Report changed paths in a directory tree using Linux inotify.
+
+    Raises OSError if inotify is not available or the watch limit is reached,
+    see /proc/sys/fs/inotify/max_user_watches.
+
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or libc_name is None:
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> watched directory
+        self.watches = {}
+        self.add_watch(root)
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, directory: Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Can't watch {directory}: {os.strerror(errno)}")
+        self.watches[wd] = directory
+
+    def wait_changes(self, timeout: float | None = None) -> set[Path]:
+        """Wait for changes and return the changed paths, once they settle.
+
+        Changed directories mean their whole contents must be checked.
+
+        """
+        changes = set()
+        deadline = None
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable:
+                if changes or timeout is not None:
+                    return changes
+                continue
+            self.read_events(changes)
+            if deadline is None:
+                deadline = time.monotonic() + MAX_SETTLE_SECONDS
+            timeout = max(0, min(SETTLE_SECONDS, deadline - time.monotonic()))
+
+    def read_events(self, changes: set[Path]):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, everything must be checked
+                changes.add(self.root)
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif (directory := self.watches.get(wd)) is not None:
+                changes.add(directory / name if name else directory)
+
+
+class PollingMonitor:
+    """Report the whole directory tree as changed every interval seconds.
+
+    Fallback for systems without inotify, the caller then finds the actual
+    changes by comparing file modification times.
+
+    """
+
+    def __init__(self, root: Path, interval: float):
+        self.root = root
+        self.interval = interval
+
+    def add_watch(self, directory: Path):
+        pass
+
+    def close(self):
+        pass
+
+    def wait_changes(self, timeout: float | None = None) -> set[Path]:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        return {self.root}
+
+
+class Watcher:
+    """Incrementally update the playlists of a music collection.
+
+    Tags, filters and the songs in each playlist are kept in memory, so a
+    change only needs the changed files to be parsed again. Tags are also
+    indexed, so new or changed filters don't need to check every song.
+
+    """
+
+    def __init__(self, conn, directory: Path, args, monitor):
+        self.conn = conn
+        self.directory = directory
+        self.args = args
+        self.exclude = combine_regexes(args.exclude)
+        self.monitor = monitor
+        # path -> FileEntry.cache_key of the files known to genplis, taken
+        # by the walk of the initial scan before files are parsed, so changes
+        # during the scan are not missed
+        self.known = {}
+        cursor = conn.cursor()
+        self.all_tags, self.all_filters = process_directory(
+            conn, cursor, directory, args, self.add_known
+        )
+        # failed files stay known too, like in a full scan they are only parsed
+        # again once they change
+        failed_files = db.get_failed_files(cursor, directory)
+        self.known = {
+            path: cache_key
+            for path, cache_key in self.known.items()
+            if path in self.all_tags
+            or path in self.all_filters
+            or str(path.absolute()) in failed_files
+        }
+        # filter file -> predicate, see m3ug.compile_rules
+        self.predicates = {
+            filter_file: compile_rules(rules)
+            for filter_file, rules in self.all_filters.items()
+        }
+        self.index = TagIndex(self.all_tags)
+        # filter file -> set of matching files
+        self.playlists = {
+            filter_file: self.index.match(rules)
+            for filter_file, rules in self.all_filters.items()
+        }
+
+    def add_known(self, entry: FileEntry):
+        if not entry.is_dir:
+            self.known[entry.path] = entry.cache_key
+            return
+        try:
+            self.monitor.add_watch(entry.path)
+        except OSError as e:
+            print(f"Can't watch for changes ({e}), checking periodically instead")
+            self.monitor.close()
+            self.monitor = PollingMonitor(self.directory, self.args.poll_interval)
+
+    def matches(self, filter_file: Path, file: Path) -> bool:
+        tags = self.all_tags.get(file)
+        return tags is not None and self.predicates[filter_file](tags)
+
+    def run(self):
+        print(f"Watching {self.directory} for changes...")
+        while True:
+            if changes := self.monitor.wait_changes():
+                self.process_changes(changes)
+
+    def process_changes(self, paths):
+        """Update tags, filters and playlists for the changed paths.
+
+        Changed directories are checked for new, modified and deleted files.
+
+        Returns the playlists that were written.
+
+        """
+        changed_files = set()
+        changed_filters = set()
+        with db.BatchWriter(self.conn) as writer:
+            for path in sorted(paths):
+                if self.is_excluded(path):
+                    continue
+                if path.is_dir():
+                    self.rescan(path, writer, changed_files, changed_filters)
+                elif path.is_file():
+                    entries = [path_entry(path)]
+                    self.update(entries, writer, changed_files, changed_filters)
+                else:
+                    self.forget(path, changed_files, changed_filters)
+        return self.update_playlists(changed_files, changed_filters)
+
+    def is_excluded(self, path: Path) -> bool:
+        """Like files.walk exclusion, also checking the parent directories."""
+        if self.exclude is None:
+            return False
+        if self.exclude.search(str(path)):
+            return True
+        return any(
+            self.exclude.search(str(parent) + os.sep)
+            for parent in path.parents
+            if parent.is_relative_to(self.directory) and parent != self.directory
+        )
+
+    def rescan(self, directory, writer, changed_files, changed_filters):
+        # it may be a new directory
+        self.add_known(FileEntry(directory, True, None, None))
+        entries = []
+        for entry in walk(directory, self.exclude):
+            if entry.is_dir:
+                self.add_known(entry)
+            else:
+                entries.append(entry)
+        self.update(entries, writer, changed_files, changed_filters)
+        seen = {entry.path for entry in entries}
+        for path in list(self.known):
+            if path not in seen and path.is_relative_to(directory):
+                self.forget(path, changed_files, changed_filters)
+
+    def update(self, entries, writer, changed_files, changed_filters):
+        for entry in entries:
+            file = entry.path
+            if self.known.get(file) == entry.cache_key:
+                continue
+            if file.suffix.lower() == ".m3ug":
+                self.all_filters[file] = parse_m3ug(
+                    file.read_text(), file, self.args.verbose
+                )
+                self.predicates[file] = compile_rules(self.all_filters[file])
+                changed_filters.add(file)
+            elif not is_music_file(file):
+                continue
+            else:
+                tags, error, _, _ = parse_music_file(file, self.args.verbose)
+                if error:
+                    # known, so it's not parsed again until it changes
+                    writer.add_failure(entry, error)
+                    if self.remove_tags(file):
+                        changed_files.add(file)
+                elif tags:
+                    if (old_tags := self.all_tags.get(file)) is not None:
+                        self.index.remove(file, old_tags)
+                    # replaced in place, so playlists keep the walk order
+                    self.all_tags[file] = tags
+                    self.index.add(file, tags)
+                    writer.add(file, tags, entry)
+                    changed_files.add(file)
+                else:
+                    # no longer a supported music file
+                    if self.remove_tags(file):
+                        changed_files.add(file)
+                    continue
+            self.known[file] = entry.cache_key
+
+    def forget(self, path, changed_files, changed_filters):
+        """Forget about a deleted file, or all the files in a deleted directory."""
+        for known_path in list(self.known):
+            if not known_path.is_relative_to(path):
+                continue
+            del self.known[known_path]
+            if self.remove_tags(known_path):
+                changed_files.add(known_path)
+            if self.all_filters.pop(known_path, None) is not None:
+                self.predicates.pop(known_path)
+                self.playlists.pop(known_path, None)
+                changed_filters.discard(known_path)
+
+    def remove_tags(self, file: Path) -> bool:
+        """Forget the tags of file, True if there were any."""
+        tags = self.all_tags.pop(file, None)
+        if tags is None:
+            return False
+        self.index.remove(file, tags)
+        return True
+
+    def update_playlists(self, changed_files, changed_filters):
+        written = []
+        for filter_file, rules in self.all_filters.items():
+            songs = self.playlists.get(filter_file, set())
+            if filter_file in changed_filters:
+                new_songs = self.index.match(rules)
+            else:
+                new_songs = songs - changed_files
+                new_songs.update(
+                    file for file in changed_files if self.matches(filter_file, file)
+                )
+            self.playlists[filter_file] = new_songs
+            if new_songs == songs:
+                continue
+
+            print(f"Filter file {filter_file} matched {len(new_songs)} songs")
+            if not new_songs:
+                continue  # like process_directory, empty playlists are not written
+            playlist_file = filter_file.with_suffix(".m3u")
+            print(f"Updating playlist {playlist_file}")
+            ordered_songs = [file for file in self.all_tags if file in new_songs]
+            create_m3u(playlist_file, ordered_songs, overwrite=True)
+            written.append(playlist_file)
+        return written
+
+
+def path_entry(path: Path) -> FileEntry:
+    return FileEntry.from_stat(path, stat(path))
+
+
+def watch(conn, directory: Path, args):
+    """Scan directory and keep its playlists updated until interrupted."""
+    monitor = None
+    if not args.poll:
+        try:
+            monitor = InotifyMonitor(directory)
+        except OSError as e:
+            print(f"Can't watch for changes ({e}), checking periodically instead")
+    if monitor is None:
+        monitor = PollingMonitor(directory, args.poll_interval)
+
+    watcher = Watcher(conn, directory, args, monitor)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.monitor.close()
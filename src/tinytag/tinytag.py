@@ -36,7 +36,7 @@
 
 
 from __future__ import annotations
-from collections.abc import Callable, Iterator
+from collections.abc import Callable, Iterable, Iterator
 from functools import reduce
 from os import PathLike
 from sys import stderr
@@ -44,7 +44,9 @@ from typing import Any, BinaryIO, Dict, List
 from warnings import warn
 
 import base64
+import errno
 import io
+import mmap
 import os
 import re
 import struct
@@ -76,6 +78,8 @@ class TinyTag:
         '.aiff', '.aifc', '.aif', '.afc'
     )
     _EXTRA_PREFIX = 'extra.'
+    # audio properties are parsed with the duration, whatever the fields argument of get
+    _AUDIO_FIELDS = frozenset(('duration', 'channels', 'bitrate', 'bitdepth', 'samplerate'))
     _file_extension_mapping: dict[tuple[str, ...], type[TinyTag]] | None = None
     _magic_bytes_mapping: dict[bytes, type[TinyTag]] | None = None
 
@@ -106,6 +110,7 @@ class TinyTag:
         self._parse_duration = True
         self._parse_tags = True
         self._load_image = False
+        self._fields: frozenset[str] | None = None
         self._tags_parsed = False
         self.__dict__: dict[str, str | int | float | Extra | Images]
 
@@ -120,8 +125,21 @@ class TinyTag:
             image: bool = False,
             encoding: str | None = None,
             file_obj: BinaryIO | None = None,
+            fields: Iterable[str] | None = None,
+            memory_map: bool = False,
             **kwargs: Any) -> TinyTag:
-        """Return a tag object for an audio file."""
+        """Return a tag object for an audio file.
+
+        fields are the names of the fields to parse, e.g. {'artist', 'genre'}, or
+        None for all of them. Other fields are skipped without decoding them when
+        possible. Names are case-insensitive, and extra fields go without prefix.
+
+        With memory_map, the file is read through a memory map instead of a system
+        call per read, see _MappedFile. Files that can't be mapped, like pipes or
+        in-memory file objects, are read as usual. Setting up the mapping costs more
+        than the few reads most files need, so it's off by default. It pays off when
+        many MPEG frames are walked, as in VBR MP3 files without a Xing header.
+        """
         should_close_file = file_obj is None
         if filename and should_close_file:
             file_obj = open(filename, 'rb')  # pylint: disable=consider-using-with
@@ -130,14 +148,19 @@ class TinyTag:
         if 'ignore_errors' in kwargs:
             warn('ignore_errors argument is obsolete, and will be removed in a future '
                  '2.x release', DeprecationWarning, stacklevel=2)
+        mapped_file = None
         try:
             file_obj.seek(0, os.SEEK_END)
             filesize = file_obj.tell()
             file_obj.seek(0)
             parser_class = cls._get_parser_class(filename, file_obj)
             tag = parser_class()
-            tag._filehandler = file_obj
+            if memory_map and filesize > 0:
+                mapped_file = _MappedFile.open(file_obj)
+            tag._filehandler = mapped_file or file_obj
             tag._default_encoding = encoding
+            if fields is not None:
+                tag._fields = frozenset(field.lower() for field in fields)
             tag.filename = filename
             tag.filesize = filesize
             if filesize > 0:
@@ -147,6 +170,8 @@ class TinyTag:
                     raise ParseError(exc) from exc
             return tag
         finally:
+            if mapped_file is not None:
+                mapped_file.close()
             if should_close_file:
                 file_obj.close()
 
@@ -255,8 +280,18 @@ class TinyTag:
                 self._filehandler.seek(0)
             self._determine_duration(self._filehandler)
 
+    def _wants_field(self, fieldname: str) -> bool:
+        # check if a field is one of the fields passed to get
+        if self._fields is None or fieldname in self._AUDIO_FIELDS:
+            return True
+        if fieldname.startswith(self._EXTRA_PREFIX):
+            fieldname = fieldname[len(self._EXTRA_PREFIX):]
+        return fieldname.lower() in self._fields
+
     def _set_field(self, fieldname: str, value: str | int | float,
                    check_conflict: bool = True) -> None:
+        if not self._wants_field(fieldname):
+            return
         if fieldname.startswith(self._EXTRA_PREFIX):
             fieldname = fieldname[len(self._EXTRA_PREFIX):]
             if check_conflict and fieldname in self.__dict__:
@@ -338,6 +373,53 @@ class TinyTag:
              'removed in a future 2.x release', DeprecationWarning, stacklevel=2)
 
 
+class _MappedFile:
+    """Read-only file object over a memory-mapped file.
+
+    Reads are copies from the mapped pages, without a system call or a second
+    buffer. Like files, it can seek past the end, reading nothing there.
+    """
+
+    def __init__(self, buffer: mmap.mmap) -> None:
+        self._buffer = buffer
+        self._size = len(buffer)
+        self._position = 0
+
+    @classmethod
+    def open(cls, file_obj: BinaryIO) -> _MappedFile | None:
+        """Map the file of file_obj, None if it's not a regular file."""
+        try:
+            buffer = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # no file descriptor (io.UnsupportedOperation is both) or not mappable
+            return None
+        return cls(buffer)
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def read(self, size: int | None = -1) -> bytes:
+        start = self._position
+        if start >= self._size:
+            return b''
+        end = self._size if size is None or size < 0 else min(start + size, self._size)
+        self._position = end
+        return self._buffer[start:end]
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+
 class Extra(Dict[str, List[str]]):
     """A dictionary containing additional fields of an audio file."""
 
@@ -768,6 +850,8 @@ class _ID3(TinyTag):
     _MAX_ESTIMATION_SEC = 30.0
     _CBR_DETECTION_FRAME_COUNT = 5
     _USE_XING_HEADER = True  # much faster, but can be deactivated for testing
+    _XING_HEADER_SIZE = 16  # 'Xing', flags, frames and bytes, see _parse_xing_header
+    _WALKER_WINDOW_SIZE = 16384  # bytes read at once when walking the frames
 
     _ID3V1_GENRES = (
         'Blues', 'Classic Rock', 'Country', 'Dance', 'Disco',
@@ -907,18 +991,33 @@ class _ID3(TinyTag):
         # seek to first position after id3 tag (speedup for large header)
         first_mpeg_id = None
         fh.seek(self._bytepos_after_id3v2)
-        file_offset = fh.tell()
-        walker = io.BytesIO(fh.read())
+        # frames are walked in a window of the audio stream, refilled as needed, so
+        # only the inspected bytes are read. A memory-mapped file is its own window.
+        mapped = isinstance(fh, _MappedFile)
+        window, window_offset = (fh._buffer, 0) if mapped else (b'', fh.tell())
+        pos = fh.tell() - window_offset  # position in window
+
+        def fill(size: int) -> None:
+            # make sure the window has size bytes from pos, unless the file ends before
+            nonlocal window, window_offset, pos
+            if mapped or pos + size <= len(window):
+                return
+            if pos > len(window):  # jumped over the end of the window
+                fh.seek(window_offset + pos)
+            window = window[pos:] + fh.read(max(size, self._WALKER_WINDOW_SIZE))
+            window_offset += pos
+            pos = 0
+
         while True:
             # reading through garbage until 11 '1' sync-bits are found
-            header = walker.read(4)
+            fill(4)
+            header = window[pos:pos + 4]
             header_len = len(header)
-            walker.seek(-header_len, os.SEEK_CUR)
             if header_len < 4:
                 if frames:
                     self.bitrate = bitrate_accu / frames
                 break  # EOF
-            _sync, conf, bitrate_freq, rest = struct.unpack('BBBB', header)
+            _sync, conf, bitrate_freq, rest = header
             br_id = (bitrate_freq >> 4) & 0x0F  # biterate id
             sr_id = (bitrate_freq >> 2) & 0x03  # sample rate id
             padding = 1 if bitrate_freq & 0x02 > 0 else 0
@@ -932,7 +1031,7 @@ class _ID3(TinyTag):
                 idx = header.find(b'\xFF', 1)  # invalid frame, find next sync header
                 if idx == -1:
                     idx = header_len  # not found: jump over the current peek buffer
-                walker.seek(max(idx, 1), os.SEEK_CUR)
+                pos += max(idx, 1)
                 continue
             if first_mpeg_id is None:
                 first_mpeg_id = mpeg_id
@@ -944,24 +1043,24 @@ class _ID3(TinyTag):
             # all the info we need, otherwise parse multiple frames to find the
             # accurate average bitrate
             if frames == 0 and self._USE_XING_HEADER:
-                walker_offset = walker.tell()
-                frame_content = walker.read(frame_length)
+                fill(frame_length + self._XING_HEADER_SIZE)
+                frame_content = window[pos:pos + frame_length]
                 xing_header_offset = frame_content.find(b'Xing')
                 if xing_header_offset != -1:
-                    walker.seek(walker_offset + xing_header_offset)
-                    xframes, byte_count = self._parse_xing_header(walker)
+                    xing_pos = pos + xing_header_offset
+                    xframes, byte_count = self._parse_xing_header(
+                        io.BytesIO(window[xing_pos:xing_pos + self._XING_HEADER_SIZE]))
                     if xframes > 0 and byte_count > 0:
                         # MPEG-2 Audio Layer III uses 576 samples per frame
                         samples_per_frame = 576 if mpeg_id <= 2 else self._SAMPLES_PER_FRAME
                         self.duration = duration = xframes * samples_per_frame / samplerate
                         self.bitrate = byte_count * 8 / duration / 1000
                         return
-                walker.seek(walker_offset)
 
             frames += 1  # it's most probably an mp3 frame
             bitrate_accu += frame_bitrate
             if frames == 1:
-                audio_offset = file_offset + walker.tell()
+                audio_offset = window_offset + pos
             if frames <= self._CBR_DETECTION_FRAME_COUNT:
                 last_bitrates.add(frame_bitrate)
 
@@ -979,7 +1078,7 @@ class _ID3(TinyTag):
                 return
 
             if frame_length > 1:  # jump over current frame body
-                walker.seek(frame_length, os.SEEK_CUR)
+                pos += frame_length
         if self.samplerate:
             self.duration = frames * self._SAMPLES_PER_FRAME / self.samplerate
 
@@ -1097,6 +1196,22 @@ class _ID3(TinyTag):
                 return i
         return -1
 
+    def _wants_frame(self, frame_id: str) -> bool:
+        # check if _parse_frame would keep anything from the frame, before reading it
+        fieldname = self._ID3_MAPPING.get(frame_id)
+        if fieldname:
+            # comments may be custom fields, see __parse_custom_field
+            return self._parse_tags and (
+                fieldname == 'comment'
+                or self._wants_field(fieldname)
+                or fieldname in {'track', 'disc'} and self._wants_field(f'{fieldname}_total'))
+        if frame_id in self._CUSTOM_FRAME_IDS:
+            return self._parse_tags
+        if frame_id in self._IMAGE_FRAME_IDS:
+            return self._load_image
+        return (self._parse_tags and frame_id not in self._DISALLOWED_FRAME_IDS
+                and self._wants_field(self._EXTRA_PREFIX + frame_id.lower()))
+
     def _parse_frame(self, fh: BinaryIO, id3version: int | None = None) -> int:
         # ID3v2.2 especially ugly. see: http://id3.org/id3v2-00
         frame_header_size = 6 if id3version == 2 else 10
@@ -1113,6 +1228,9 @@ class _ID3(TinyTag):
             print(f'Found id3 Frame {frame_id} at {fh.tell()}-{fh.tell() + frame_size} '
                   f'of {self.filesize}')
         if frame_size > 0:
+            if not self._wants_frame(frame_id):
+                fh.seek(frame_size, os.SEEK_CUR)
+                return frame_size
             # flags = frame[1+frame_size_bytes:] # dont care about flags.
             content = fh.read(frame_size)
             fieldname = self._ID3_MAPPING.get(frame_id)
@@ -1319,6 +1437,7 @@ class _Ogg(TinyTag):
                 if self._parse_tags:
                     walker.seek(7, os.SEEK_CUR)  # jump over header name
                     self._parse_vorbis_comment(walker)
+                break  # the setup header and audio packets follow
             elif packet[0:8] == b'OpusHead':
                 if self._parse_duration:  # parse opus header
                     # https://www.videolan.org/developers/vlc/modules/codec/opus_header.c
@@ -1332,6 +1451,7 @@ class _Ogg(TinyTag):
                 if self._parse_tags:  # parse opus metadata:
                     walker.seek(8, os.SEEK_CUR)  # jump over header name
                     self._parse_vorbis_comment(walker)
+                break  # audio packets follow
             elif packet[0:5] == b'\x7fFLAC':
                 # https://xiph.org/flac/ogg_mapping.html
                 walker.seek(9, os.SEEK_CUR)  # jump over header name, version and number of headers
@@ -1349,7 +1469,7 @@ class _Ogg(TinyTag):
                     block_type = meta_header[0] & 0x7f
                     if block_type == _Flac.METADATA_VORBIS_COMMENT:
                         self._parse_vorbis_comment(walker)
-                check_flac_second_packet = False
+                break  # other metadata blocks and audio packets follow
             elif packet[0:8] == b'Speex   ':
                 # https://speex.org/docs/manual/speex-manual/node8.html
                 if self._parse_duration:
@@ -1363,11 +1483,13 @@ class _Ogg(TinyTag):
                     comment = walker.read(length).decode('utf-8', 'replace')
                     self._set_field('comment', comment)
                     self._parse_vorbis_comment(walker, contains_vendor=False)  # other tags
-                check_speex_second_packet = False
+                break  # audio packets follow
             else:
                 if DEBUG:
                     print('Unsupported Ogg page type: ', packet[:16], file=stderr)
                 break
+            if not self._parse_tags:
+                break  # the first packet has the stream info, comments are not needed
         self._tags_parsed = True
 
     def _parse_vorbis_comment(self, fh: BinaryIO, contains_vendor: bool = True) -> None:
@@ -1380,12 +1502,22 @@ class _Ogg(TinyTag):
         elements = struct.unpack('I', fh.read(4))[0]
         for _i in range(elements):
             length = struct.unpack('I', fh.read(4))[0]
-            keyvalpair = fh.read(length).decode('utf-8', 'replace')
-            if '=' in keyvalpair:
-                key, value = keyvalpair.split('=', 1)
+            key_bytes, separator, value_bytes = fh.read(length).partition(b'=')
+            if separator:
+                # '=' is never part of a multibyte UTF-8 sequence, the value is only
+                # decoded if its field is wanted
+                key = key_bytes.decode('utf-8', 'replace')
                 key_lowercase = key.lower()
+                fieldname = self._VORBIS_MAPPING.get(
+                    key_lowercase, self._EXTRA_PREFIX + key_lowercase)  # custom field
+                is_image = key_lowercase == "metadata_block_picture" and self._load_image
+                if not (is_image or self._wants_field(fieldname)
+                        or fieldname in {'track', 'disc'}
+                        and self._wants_field(f'{fieldname}_total')):
+                    continue
+                value = value_bytes.decode('utf-8', 'replace')
 
-                if key_lowercase == "metadata_block_picture" and self._load_image:
+                if is_image:
                     if DEBUG:
                         print('Found Vorbis Image', key, value[:64])
                     fieldname, fieldvalue = _Flac._parse_image(io.BytesIO(base64.b64decode(value)))
@@ -1393,8 +1525,6 @@ class _Ogg(TinyTag):
                 else:
                     if DEBUG:
                         print('Found Vorbis Comment', key, value[:64])
-                    fieldname = self._VORBIS_MAPPING.get(
-                        key_lowercase, self._EXTRA_PREFIX + key_lowercase)  # custom field
                     if fieldname in {'track', 'disc', 'track_total', 'disc_total'}:
                         if fieldname in {'track', 'disc'} and '/' in value:
                             value, total = value.split('/')[:2]
@@ -1407,7 +1537,9 @@ class _Ogg(TinyTag):
 
     def _parse_pages(self, fh: BinaryIO) -> Iterator[bytes]:
         # for the spec, see: https://wiki.xiph.org/Ogg
-        previous_page = b''  # contains data from previous (continuing) pages
+        # chunks of the current packet, joined once it ends, as a packet can continue
+        # over many pages (e.g. a comment header with a picture)
+        packet_chunks: list[bytes] = []
         header_data = fh.read(27)  # read ogg page header
         while len(header_data) == 27:
             header = struct.unpack('<4sBBqIIiB', header_data)
@@ -1420,16 +1552,14 @@ class _Ogg(TinyTag):
             total = 0
             for segsize in segsizes:  # read all segments
                 total += segsize
-                if total < 255:  # less than 255 bytes means end of page
-                    yield previous_page + fh.read(total)
-                    previous_page = b''
+                if segsize < 255:  # less than 255 bytes means end of packet
+                    packet_chunks.append(fh.read(total))
+                    packet = b''.join(packet_chunks)
+                    packet_chunks.clear()
                     total = 0
-            if total != 0:
-                if total % 255 == 0:
-                    previous_page += fh.read(total)
-                else:
-                    yield previous_page + fh.read(total)
-                    previous_page = b''
+                    yield packet  # read on only if more packets are needed
+            if total != 0:  # packet continues on the next page
+                packet_chunks.append(fh.read(total))
             header_data = fh.read(27)
 
 
@@ -1726,6 +1856,9 @@ class _Wma(TinyTag):
                         if name.startswith('WM/'):
                             name = name[3:]
                         field_name = self._EXTRA_PREFIX + name.lower()
+                    if not self._wants_field(field_name):
+                        fh.seek(value_len, os.SEEK_CUR)
+                        continue
                     field_value = self._decode_ext_desc(value_type, fh.read(value_len))
                     if field_value is not None:
                         if field_name in {'track', 'disc'}:
@@ -3,7 +3,10 @@ from pathlib import Path
 import pytest
 
 from genplis.db import (
+    create_directories_table,
+    create_failed_files_table,
     create_files_table,
+    create_tags_tables,
     setup_database_connection,
 )
 
@@ -23,4 +26,20 @@ def genplis_db(tmp_path):
     db_path = tmp_path / "genplis.db"
     conn, cursor = setup_database_connection(db_path)
     create_files_table(cursor)
+    create_directories_table(cursor)
+    create_failed_files_table(cursor)
+    create_tags_tables(cursor)
     return conn
+
+
+@pytest.fixture()
+def playlists(monkeypatch):
+    """Record the playlists that would be written as {path: [songs]}."""
+    written = {}
+
+    def create_m3u(playlist_path, entries, comment="", overwrite=False):
+        written[playlist_path] = list(entries)
+
+    monkeypatch.setattr("genplis.core.create_m3u", create_m3u)
+    monkeypatch.setattr("genplis.watch.create_m3u", create_m3u)
+    return written
@@ -0,0 +1,443 @@
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+
+import pytest
+
+from genplis.core import (
+    FAILED_RETRY_SECONDS,
+    PlaylistMatcher,
+    combine_regexes,
+    filter_songs,
+    gc_directory,
+    is_excluded,
+    parse_args,
+    process_directory,
+    setup_argparse,
+    should_retry,
+)
+from genplis.files import FileEntry
+from genplis.m3ug import parse_m3ug
+
+
+def make_args(*argv):
+    return setup_argparse().parse_args(argv)
+
+
+@pytest.fixture()
+def music_dir(tmp_path, file_mp3, file_ogg):
+    music_dir = tmp_path / "music"
+    for n in range(5):
+        album = music_dir / f"album{n}"
+        album.mkdir(parents=True)
+        shutil.copy(file_mp3, album / "song.mp3")
+        shutil.copy(file_ogg, album / "song.ogg")
+        (album / "cover.jpg").write_bytes(b"")
+    return music_dir
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_process_directory(genplis_db, music_dir, jobs):
+    args = make_args("--jobs", str(jobs), str(music_dir))
+    all_tags, all_filters = process_directory(
+        genplis_db, genplis_db.cursor(), music_dir, args
+    )
+    assert list(all_tags) == [
+        file for file in music_dir.rglob("*") if file.suffix in {".mp3", ".ogg"}
+    ]
+    assert all(tags["filename"] == str(file) for file, tags in all_tags.items())
+    assert all_filters == {}
+
+    # second run gets everything from cache
+    assert process_directory(genplis_db, genplis_db.cursor(), music_dir, args) == (
+        all_tags,
+        all_filters,
+    )
+
+
+def test_combine_regexes():
+    assert combine_regexes([]) is None
+    podcasts = re.compile("/Podcasts/")
+    assert combine_regexes([podcasts]) is podcasts
+
+    combined = combine_regexes([podcasts, re.compile(r"\.jpg$")])
+    assert combined.search("/music/Podcasts/1.mp3")
+    assert combined.search("/music/cover.jpg")
+    assert not combined.search("/music/1.mp3")
+
+    # global flags can't be combined, but still work
+    combined = combine_regexes([podcasts, re.compile(r"(?i)\.jpg$")])
+    assert combined.search("/music/Podcasts/1.mp3")
+    assert combined.search("/music/cover.JPG")
+    assert not combined.search("/music/1.mp3")
+
+    # numbered backreferences keep referring to their own pattern's groups
+    patterns = [re.compile("/(Podcasts)/"), re.compile(r"/(\w+)/\1/")]
+    combined = combine_regexes(patterns)
+    assert combined.search("/music/Podcasts/1.mp3")
+    assert combined.search("/music/a/a/1.mp3")
+    assert not combined.search("/music/a/b/1.mp3")
+
+
+def test_is_excluded():
+    exclude = combine_regexes([re.compile("/Podcasts/"), re.compile(r"\.jpg$")])
+    assert is_excluded(Path("/music/Podcasts/1.mp3"), exclude)
+    assert is_excluded(Path("/music/cover.jpg"), exclude)
+    assert not is_excluded(Path("/music/1.mp3"), exclude)
+    assert not is_excluded(Path("/music/1.mp3"), None)
+
+
+def test_process_directory_exclude(genplis_db, music_dir):
+    args = make_args("--exclude", "/album[0-3]/", str(music_dir))
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert sorted(all_tags) == [
+        music_dir / "album4" / "song.mp3",
+        music_dir / "album4" / "song.ogg",
+    ]
+
+
+@pytest.mark.parametrize("trust_dirs", [False, True])
+def test_process_directory_unchanged_directories(
+    genplis_db, music_dir, file_mp3, trust_dirs
+):
+    argv = ["--trust-dirs"] if trust_dirs else []
+    args = make_args(*argv, str(music_dir))
+    for directory in [music_dir, *music_dir.iterdir()]:
+        os.utime(directory, (time.time() - 60, time.time() - 60))
+    first_run = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    cached_directories = genplis_db.execute("SELECT COUNT(*) FROM directories")
+    assert cached_directories.fetchone() == (6,)
+
+    # adding a file changes the directory mtime so it's always detected
+    new_song = music_dir / "album2" / "new.mp3"
+    shutil.copy(file_mp3, new_song)
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert all_tags == first_run[0] | {new_song: all_tags[new_song]}
+
+
+def count_cached(conn):
+    files = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    directories = conn.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+    return files, directories
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_process_directory_gc(genplis_db, music_dir, jobs):
+    args = make_args("--gc", "--jobs", str(jobs), str(music_dir))
+    for directory in [music_dir, *music_dir.iterdir()]:
+        os.utime(directory, (time.time() - 60, time.time() - 60))
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert count_cached(genplis_db) == (10, 6)
+
+    shutil.rmtree(music_dir / "album1")
+    (music_dir / "album2" / "song.mp3").unlink()
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert len(all_tags) == 7
+    # music_dir and album2 changed recently so their listings are kept
+    assert count_cached(genplis_db) == (7, 5)
+
+
+def test_gc_directory(genplis_db, music_dir):
+    args = make_args(str(music_dir))
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    shutil.rmtree(music_dir / "album1")
+
+    gc_directory(genplis_db, music_dir, args)
+    assert count_cached(genplis_db)[0] == 8
+    # excluded files are removed too
+    gc_directory(genplis_db, music_dir, make_args("--exclude", "album2", "."))
+    assert count_cached(genplis_db)[0] == 6
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_process_directory_failed_files(genplis_db, music_dir, file_ogg, capsys, jobs):
+    broken = music_dir / "album0" / "broken.ogg"
+    broken.write_bytes(b"garbage" * 10)
+    args = make_args("--jobs", str(jobs), str(music_dir))
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert len(all_tags) == 10
+    assert broken not in all_tags
+    failures = genplis_db.execute("SELECT path, error, message FROM failed_files")
+    assert failures.fetchall() == [(str(broken), "ParseError", "Invalid OGG header")]
+
+    # not parsed again until it changes
+    capsys.readouterr()
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert "Skipped 1 files that failed to parse before" in capsys.readouterr().out
+
+    shutil.copy(file_ogg, broken)
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert broken in all_tags
+    failures = genplis_db.execute("SELECT COUNT(*) FROM failed_files")
+    assert failures.fetchone() == (0,)
+
+
+def test_should_retry():
+    entry = FileEntry(Path("/music/a.ogg").absolute(), False, 10, 1_000)
+    args = make_args(".")
+    now = time.time()
+    assert should_retry(entry, {}, args)
+    failed_files = {str(entry.path): (1_000, 10, now)}
+    assert not should_retry(entry, failed_files, args)
+    assert should_retry(entry, failed_files, make_args("--retry-failed", "."))
+    assert should_retry(entry._replace(size=11), failed_files, args)
+    assert should_retry(entry._replace(mtime_ns=2_000), failed_files, args)
+    failed_files = {str(entry.path): (1_000, 10, now - FAILED_RETRY_SECONDS)}
+    assert should_retry(entry, failed_files, args)
+
+
+def test_process_directory_detects_precise_changes(genplis_db, music_dir, file_mp3):
+    args = make_args(str(music_dir))
+    song = music_dir / "album0" / "song.mp3"
+    mtime_ns = 1_600_000_000 * 10**9
+    os.utime(song, ns=(mtime_ns, mtime_ns))
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+
+    # modified within the same second
+    with song.open("ab") as f:
+        f.write(b"\0" * 10)
+    os.utime(song, ns=(mtime_ns + 1, mtime_ns + 1))
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert all_tags[song]["filesize"] == file_mp3.stat().st_size + 10
+
+    # restored from an older backup
+    shutil.copy(file_mp3, song)
+    os.utime(song, ns=(mtime_ns - 10**10, mtime_ns - 10**10))
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert all_tags[song]["filesize"] == file_mp3.stat().st_size
+
+
+def test_process_directory_keys_legacy_entries(genplis_db, music_dir):
+    args = make_args(str(music_dir))
+    first_run = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    # as saved by older versions, without cache key
+    genplis_db.execute("UPDATE files SET mtime_ns=NULL, size=NULL")
+    genplis_db.commit()
+
+    assert (
+        process_directory(genplis_db, genplis_db.cursor(), music_dir, args) == first_run
+    )
+    unkeyed = genplis_db.execute("SELECT COUNT(*) FROM files WHERE mtime_ns IS NULL")
+    assert unkeyed.fetchone() == (0,)
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_process_directory_fingerprint(genplis_db, music_dir, capsys, jobs):
+    args = make_args("--fingerprint", "--jobs", str(jobs), str(music_dir))
+    first_run, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+
+    moved_dir = music_dir.parent / "moved"
+    music_dir.rename(moved_dir)
+    capsys.readouterr()
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), moved_dir, args)
+    output = capsys.readouterr().out
+    assert "Reused cached tags of 10 moved files" in output
+    assert "Parsed" not in output
+    assert list(all_tags) == [
+        moved_dir / file.relative_to(music_dir) for file in first_run
+    ]
+    assert all(tags["filename"] == str(file) for file, tags in all_tags.items())
+
+    # files don't match their own stale entry, they may have changed between
+    # the fingerprinted bytes
+    song = moved_dir / "album0" / "song.mp3"
+    with song.open("ab") as f:
+        f.write(bytes(200 * 1024))
+    process_directory(genplis_db, genplis_db.cursor(), moved_dir, args)
+    with song.open("r+b") as f:
+        f.seek(100 * 1024)
+        f.write(b"changed")
+    capsys.readouterr()
+    process_directory(genplis_db, genplis_db.cursor(), moved_dir, args)
+    output = capsys.readouterr().out
+    assert "Reused" not in output
+    assert f"Updated cache for file: {song}" in output
+
+
+def test_process_directory_fingerprint_swapped(genplis_db, tmp_path, file_mp3):
+    music_dir = tmp_path / "music"
+    music_dir.mkdir()
+    a, b = music_dir / "a.mp3", music_dir / "b.mp3"
+    shutil.copy(file_mp3, a)
+    b.write_bytes(file_mp3.read_bytes() + bytes(5000))
+    args = make_args("--fingerprint", str(music_dir))
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+
+    a.rename(tmp_path / "a.mp3")
+    b.rename(a)
+    (tmp_path / "a.mp3").rename(b)
+    # tags are right, and so are the ones saved in cache
+    for _ in range(2):
+        all_tags, _ = process_directory(
+            genplis_db, genplis_db.cursor(), music_dir, args
+        )
+        assert all_tags[a]["filesize"] == a.stat().st_size
+        assert all_tags[b]["filesize"] == b.stat().st_size
+
+
+def test_process_directory_sql_filters(genplis_db, music_dir, playlists):
+    (music_dir / "synthwave.m3ug").write_text("genre ~= Synthwave\n")
+    (music_dir / "album1" / "short.m3ug").write_text("duration < 2\n")
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, make_args("."))
+    expected = dict(playlists)
+    assert set(expected[music_dir / "album1" / "short.m3u"]) == {
+        music_dir / f"album{n}" / "song.ogg" for n in range(5)
+    }
+
+    playlists.clear()
+    args = make_args("--filter-backend", "sql", ".")
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert playlists == expected
+
+
+@pytest.mark.parametrize("option", ["--streaming", "--columnar"])
+def test_process_directory_low_memory(genplis_db, music_dir, playlists, option):
+    (music_dir / "synthwave.m3ug").write_text("genre ~= Synthwave\n")
+    (music_dir / "album4" / "short.m3ug").write_text("duration < 2\n")
+    all_tags, all_filters = process_directory(
+        genplis_db, genplis_db.cursor(), music_dir, make_args(".")
+    )
+    expected = dict(playlists)
+    assert len(expected) == 2
+
+    # first parsing all files again, then with all files cached
+    genplis_db.execute("DELETE FROM files")
+    for _ in range(2):
+        playlists.clear()
+        args = make_args(option, ".")
+        assert process_directory(genplis_db, genplis_db.cursor(), music_dir, args) == (
+            {},
+            all_filters,
+        )
+        assert playlists == expected
+
+
+@pytest.mark.parametrize("option", ["--streaming", "--columnar"])
+def test_process_directory_low_memory_batches(
+    genplis_db, music_dir, playlists, monkeypatch, option
+):
+    monkeypatch.setattr("genplis.core.LOW_MEMORY_BATCH_SIZE", 3)
+    (music_dir / "synthwave.m3ug").write_text("genre ~= Synthwave\n")
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, make_args("."))
+    expected = dict(playlists)
+
+    # cached tags and seen paths are handled in batches while walking
+    shutil.rmtree(music_dir / "album1")
+    expected = {
+        playlist: [file for file in files if file.parent.name != "album1"]
+        for playlist, files in expected.items()
+    }
+    playlists.clear()
+    args = make_args(option, "--gc", ".")
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert playlists == expected
+    assert count_cached(genplis_db)[0] == 8
+
+
+def test_parse_args_streaming():
+    with pytest.raises(SystemExit):
+        parse_args(["watch", "--streaming", "."])
+    with pytest.raises(SystemExit):
+        parse_args(["--streaming", "--filter-backend", "sql", "."])
+    assert parse_args(["--streaming", "."]).streaming
+
+
+@pytest.mark.parametrize("options", [[], ["--fingerprint"]])
+def test_process_directory_narrow_tags(
+    genplis_db, music_dir, capsys, playlists, options
+):
+    (music_dir / "synthwave.m3ug").write_text("genre ~= Synthwave\n")
+    args = make_args(*options, "--narrow-tags", "--keep-tag", "Title", str(music_dir))
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    song = music_dir / "album0" / "song.ogg"
+    assert "genre" in all_tags[song]
+    assert "title" in all_tags[song]
+    assert "artist" not in all_tags[song]
+    assert "duration" not in all_tags[song]
+
+    # cached tags are reused while they have the tags of all filters
+    capsys.readouterr()
+    process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert "Updated cache" not in capsys.readouterr().out
+    (music_dir / "artist.m3ug").write_text("artist = Test Artist\n")
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert all_tags[song]["artist"] == "Test Artist"
+    assert "Updated cache" in capsys.readouterr().out
+
+    # audio properties are parsed once a filter needs them
+    (music_dir / "short.m3ug").write_text("duration < 2\n")
+    all_tags, _ = process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+    assert all_tags[song]["duration"] == 1.0
+    assert "bitrate" in all_tags[song]
+
+    # and all tags are parsed again without --narrow-tags
+    all_tags, _ = process_directory(
+        genplis_db, genplis_db.cursor(), music_dir, make_args(*options, str(music_dir))
+    )
+    assert "Updated cache" in capsys.readouterr().out
+    assert all_tags[song]["encoder"]
+    projections = genplis_db.execute("SELECT DISTINCT projection FROM files")
+    assert projections.fetchall() == [(None,)]
+
+    if options:
+        # moved files only reuse entries saved with all the tags needed
+        for name in ["artist.m3ug", "short.m3ug"]:
+            (music_dir / name).unlink()
+        genplis_db.execute("DELETE FROM files")
+        process_directory(genplis_db, genplis_db.cursor(), music_dir, args)
+        (music_dir / "album0").rename(music_dir / "album9")
+        (music_dir / "artist.m3ug").write_text("artist = Test Artist\n")
+        capsys.readouterr()
+        all_tags, _ = process_directory(
+            genplis_db, genplis_db.cursor(), music_dir, args
+        )
+        assert "Reused" not in capsys.readouterr().out
+        assert all_tags[music_dir / "album9" / "song.ogg"]["artist"] == "Test Artist"
+
+
+def test_parse_args_narrow_tags():
+    with pytest.raises(SystemExit):
+        parse_args(["watch", "--narrow-tags", "."])
+    with pytest.raises(SystemExit):
+        parse_args(["--keep-tag", "title", "."])
+    args = parse_args(["--narrow-tags", "--keep-tag", "title", "."])
+    assert args.keep_tag == ["title"]
+
+
+def test_parse_args_columnar():
+    with pytest.raises(SystemExit):
+        parse_args(["watch", "--columnar", "."])
+    with pytest.raises(SystemExit):
+        parse_args(["--columnar", "--filter-backend", "sql", "."])
+    with pytest.raises(SystemExit):
+        parse_args(["--columnar", "--streaming", "."])
+    assert parse_args(["--columnar", "."]).columnar
+
+
+def test_playlist_matcher():
+    all_filters = {
+        Path("good.m3ug"): parse_m3ug("rating >= 4"),
+        Path("good_rock.m3ug"): parse_m3ug("Rating >= 4.0\ngenre ~= Rock"),
+        Path("rock.m3ug"): parse_m3ug("genre ~= Rock"),
+    }
+    all_tags = {
+        Path("1.mp3"): {"rating": 5, "genre": "Rock"},
+        Path("2.mp3"): {"rating": 3, "genre": "Rock"},
+        Path("3.mp3"): {"rating": 4, "genre": "Jazz"},
+    }
+    matcher = PlaylistMatcher(all_filters)
+    # songs can be added in any order
+    for position, (file, tags) in reversed(list(enumerate(all_tags.items()))):
+        matcher.add(position, file, tags)
+
+    for filter_file, rules in all_filters.items():
+        assert matcher.get_songs(filter_file) == filter_songs(
+            all_tags, filter_file, rules
+        )
+    assert matcher.files == 3
+    # rating and genre are applied once per song
+    assert matcher.evaluations == 6
+    # good_rock.m3ug stops at rating for 2.mp3, so genre is reused only once
+    assert matcher.deduplicated == 5
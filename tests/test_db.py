@@ -3,15 +3,39 @@ from pathlib import Path
 import pytest
 
 from genplis.db import (
+    SCHEMA_VERSION,
+    BatchWriter,
+    DirectoryCache,
+    cache_directory_listing,
+    cache_failure,
     cache_tags_for_file,
+    clear_seen_paths,
+    compact,
+    configure_connection,
+    copy_cache_entry,
+    create_directories_table,
     create_files_table,
+    delete_failure,
+    delete_stale_entries,
+    get_cached_keys,
     get_cached_tags,
     get_db_path,
+    get_db_size,
+    get_failed_files,
+    get_fingerprints,
+    get_path_range,
+    index_tags,
     is_cache_valid,
+    is_entry_valid,
+    is_projection_valid,
+    iter_cached_tags,
+    iter_tags_by_path,
+    migrate_db,
+    save_seen_paths,
     setup_database_connection,
 )
 from genplis.exceptions import GenplisDBError
-from genplis.files import get_last_modified
+from genplis.files import DirectoryListing, FileEntry, get_last_modified
 
 
 def test_get_db_path(monkeypatch):
@@ -33,9 +57,16 @@ def test_db_connection_and_create(tmp_path):
                 "files",
                 2,
                 "CREATE TABLE files (\n"
-                "            path TEXT PRIMARY KEY,\n"
+                "            id INTEGER PRIMARY KEY,\n"
+                "            path TEXT NOT NULL UNIQUE,\n"
                 "            last_modified TIMESTAMP,\n"
-                "            tags JSONB\n"
+                "            tags JSONB,\n"
+                "            mtime_ns INTEGER,\n"
+                "            size INTEGER,\n"
+                "            inode INTEGER,\n"
+                "            device INTEGER,\n"
+                "            fingerprint TEXT,\n"
+                "            projection TEXT\n"
                 "        )",
             ),
             (
@@ -69,11 +100,19 @@ def test_is_cache_valid(genplis_db, file_mp3):
     )
     assert is_cache_valid(genplis_db.cursor(), file_mp3) is False
 
+    # once saved with a cache key only the key is compared
+    cache_tags_for_file(genplis_db.cursor(), file_mp3, {})
+    assert is_cache_valid(genplis_db.cursor(), file_mp3) is True
+    genplis_db.execute("UPDATE files SET size=size+1")
+    assert is_cache_valid(genplis_db.cursor(), file_mp3) is False
+    genplis_db.execute("UPDATE files SET size=size-1, last_modified=0")
+    assert is_cache_valid(genplis_db.cursor(), file_mp3) is True
+
 
 def test_cache_tags_for_file(genplis_db, file_mp3):
     timestamp = get_last_modified(file_mp3)
     cache_tags_for_file(genplis_db.cursor(), file_mp3, {"a": "b"})
-    rows = genplis_db.execute("SELECT * from files").fetchall()
+    rows = genplis_db.execute("SELECT path, last_modified, tags from files").fetchall()
     assert rows == [
         ("/home/fidel/Code/genplis/tests/files/test.mp3", timestamp, '{"a": "b"}')
     ]
@@ -90,3 +129,333 @@ def test_get_cached_tags_success(genplis_db):
 def test_get_cached_tags_error_if_missing(genplis_db):
     with pytest.raises(GenplisDBError):
         get_cached_tags(genplis_db.cursor(), "/invalid/path/")
+
+
+def test_get_path_range():
+    lower, upper = get_path_range(Path("/music/"))
+    assert lower == "/music/"
+    assert lower <= "/music/a.mp3" < upper
+    assert lower <= "/music/\U0010ffff/a.mp3" < upper
+    assert not lower <= "/music" < upper
+    assert not lower <= "/music0/a.mp3" < upper
+    assert not lower <= "/musics/a.mp3" < upper
+
+
+def test_get_cached_keys(genplis_db):
+    genplis_db.executemany(
+        "INSERT INTO files(path, last_modified, tags) VALUES (?, ?, '{}')",
+        [("/music/a.mp3", 1), ("/music/b/c.mp3", 2), ("/musics/d.mp3", 3)],
+    )
+    genplis_db.execute(
+        "UPDATE files SET mtime_ns=2000000000, size=4, inode=5, device=6 "
+        "WHERE path='/music/b/c.mp3'"
+    )
+    assert get_cached_keys(genplis_db.cursor(), Path("/music")) == {
+        "/music/a.mp3": (1, None, None),
+        "/music/b/c.mp3": (2, (2_000_000_000, 4, 5, 6), None),
+    }
+
+    genplis_db.execute(
+        """UPDATE files SET projection='["genre", "year"]'"""
+        "WHERE path='/music/a.mp3'"
+    )
+    cached_keys = get_cached_keys(genplis_db.cursor(), Path("/music"))
+    assert cached_keys["/music/a.mp3"] == (1, None, frozenset({"genre", "year"}))
+
+
+def test_is_projection_valid():
+    assert is_projection_valid(None, None)
+    assert is_projection_valid(None, frozenset({"genre"}))
+    assert is_projection_valid(frozenset({"genre", "year"}), frozenset({"genre"}))
+    assert not is_projection_valid(frozenset({"genre"}), frozenset({"year"}))
+    # all tags are needed
+    assert not is_projection_valid(frozenset({"genre"}), None)
+
+
+def test_cache_tags_for_file_projection(genplis_db, file_mp3):
+    cursor = genplis_db.cursor()
+    projection = frozenset({"year", "genre"})
+    cache_tags_for_file(cursor, file_mp3, {"genre": "A"}, projection=projection)
+    cached_keys = get_cached_keys(cursor, file_mp3.parent)
+    assert cached_keys[str(file_mp3)][2] == projection
+    # process_file needs all tags
+    assert is_cache_valid(cursor, file_mp3) is False
+
+    # moved files keep their projection
+    cursor.execute("UPDATE files SET fingerprint='abc'")
+    entry = FileEntry(Path("moved/test.mp3"), False, 1, 2_000_000_000, 3, 4)
+    assert copy_cache_entry(cursor, str(file_mp3), entry, "abc")
+    assert get_cached_keys(cursor, Path("moved"))[str(entry.path.absolute())][2] == (
+        projection
+    )
+    assert get_fingerprints(cursor)[str(file_mp3)] == ("abc", projection)
+
+    cache_tags_for_file(cursor, file_mp3, {"genre": "A"})
+    assert is_cache_valid(cursor, file_mp3) is True
+
+
+def test_is_entry_valid():
+    entry = FileEntry(Path("/music/a.mp3"), False, 4, 2_000_000_000, 5, 6)
+    # saved without a key by an older version
+    assert is_entry_valid(entry, 2, None)
+    assert not is_entry_valid(entry, 1, None)
+
+    assert is_entry_valid(entry, 0, entry.cache_key)
+    assert not is_entry_valid(
+        entry._replace(mtime_ns=1_000_000_000), 2, entry.cache_key
+    )
+    assert not is_entry_valid(entry._replace(inode=7), 2, entry.cache_key)
+
+
+def get_normalized_tags(cursor):
+    cursor.execute("""
+        SELECT file_id, key, value, number FROM file_tags
+        JOIN tag_keys ON tag_keys.id = key_id ORDER BY file_id, key, value, number
+    """)
+    return cursor.fetchall()
+
+
+def test_index_tags(genplis_db, file_mp3):
+    cursor = genplis_db.cursor()
+    tags = {"artist": ["A", "B"], "duration": 3.5, "track": 2, "images": {}}
+    cache_tags_for_file(cursor, file_mp3, tags)
+    assert get_normalized_tags(cursor) == [
+        (1, "artist", "A", None),
+        (1, "artist", "B", None),
+        (1, "duration", None, 3.5),
+        (1, "track", None, 2),
+    ]
+
+    # updated tags replace the old ones, and keys are reused
+    cache_tags_for_file(cursor, file_mp3, {"artist": ["C"]})
+    assert get_normalized_tags(cursor) == [(1, "artist", "C", None)]
+    assert cursor.execute("SELECT COUNT(*) FROM tag_keys").fetchone() == (4,)
+
+    # indexes are used to query the whole collection
+    cursor.execute(
+        "EXPLAIN QUERY PLAN SELECT file_id FROM file_tags WHERE key_id = 1 AND value = 'C'"
+    )
+    assert "USING INDEX file_tags_value" in cursor.fetchone()[-1]
+
+    index_tags(cursor, 2, {"year": 2000})
+    delete_stale_entries(cursor, file_mp3.parent, set())
+    assert get_normalized_tags(cursor) == [(2, "year", None, 2000)]
+
+
+def test_migrate_db(tmp_path):
+    conn, cursor = setup_database_connection(tmp_path / "genplis.db")
+    # files table of schema version 0
+    cursor.execute(
+        "CREATE TABLE files (path TEXT PRIMARY KEY, last_modified TIMESTAMP, tags JSONB)"
+    )
+    cursor.execute(
+        """INSERT INTO files VALUES ('/music/a.mp3', 1, '{"artist": ["A", "B"]}')"""
+    )
+    create_directories_table(cursor)
+    cache_directory_listing(cursor, DirectoryListing(Path("/music"), 1, []))
+
+    migrate_db(cursor)
+    assert cursor.execute("PRAGMA user_version").fetchone() == (SCHEMA_VERSION,)
+    assert get_cached_keys(cursor, Path("/music")) == {"/music/a.mp3": (1, None, None)}
+    assert cursor.execute("SELECT * FROM directories").fetchall() == []
+    assert cursor.execute("SELECT id FROM files").fetchall() == [(1,)]
+    assert get_normalized_tags(cursor) == [
+        (1, "artist", "A", None),
+        (1, "artist", "B", None),
+    ]
+
+    cursor.execute("UPDATE files SET fingerprint='abc'")
+    assert get_fingerprints(cursor) == {"/music/a.mp3": ("abc", None)}
+
+    # migrating again does nothing
+    migrate_db(cursor)
+    assert get_cached_keys(cursor, Path("/music")) == {"/music/a.mp3": (1, None, None)}
+    assert len(get_normalized_tags(cursor)) == 2
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with pytest.raises(GenplisDBError):
+        migrate_db(cursor)
+
+
+def test_migrate_db_normalize_tags(genplis_db):
+    cursor = genplis_db.cursor()
+    cursor.execute(
+        """INSERT INTO files(path, tags)
+        VALUES ('/music/a.mp3', '{"artist": ["A"], "year": ["1990"], "fmps_rating": ["0.8"]}')"""
+    )
+    cursor.execute("PRAGMA user_version = 3")
+    migrate_db(cursor)
+    assert get_cached_tags(cursor, Path("/music/a.mp3")) == {
+        "artist": "A",
+        "year": 1990,
+        "fmps_rating": 0.8,
+        "rating": 4.0,
+    }
+    assert (1, "year", None, 1990) in get_normalized_tags(cursor)
+
+
+def test_configure_connection(tmp_path):
+    conn, cursor = setup_database_connection(tmp_path / "genplis.db")
+    configure_connection(conn)
+    assert cursor.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    assert cursor.execute("PRAGMA synchronous").fetchone() == (2,)  # FULL
+
+    configure_connection(conn, wal=True)
+    assert cursor.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert cursor.execute("PRAGMA synchronous").fetchone() == (1,)  # NORMAL
+
+
+def test_configure_connection_old_sqlite(tmp_path, monkeypatch):
+    monkeypatch.setattr("sqlite3.sqlite_version_info", (3, 31, 1))
+    conn, cursor = setup_database_connection(tmp_path / "genplis.db")
+    with pytest.raises(GenplisDBError, match="3.35.0 or newer"):
+        configure_connection(conn)
+
+
+def test_batch_writer_commits_every_batch_size(tmp_path, genplis_db):
+    files = [tmp_path / f"{n}.mp3" for n in range(5)]
+    for file in files:
+        file.touch()
+
+    def count_committed():
+        # a separate connection only sees committed rows
+        conn, cursor = setup_database_connection(tmp_path / "genplis.db")
+        return cursor.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    with BatchWriter(genplis_db, batch_size=2, batch_seconds=3600) as writer:
+        for file in files[:3]:
+            writer.add(file, {"a": "b"})
+        assert count_committed() == 2
+        writer.add(files[3], {"a": "b"})
+        assert count_committed() == 4
+        writer.add(files[4], {"a": "b"})
+        assert count_committed() == 4
+    assert count_committed() == 5
+
+
+def test_batch_writer_rolls_back_on_error(tmp_path, genplis_db, file_mp3):
+    with pytest.raises(RuntimeError):
+        with BatchWriter(genplis_db, batch_size=100) as writer:
+            writer.add(file_mp3, {"a": "b"})
+            raise RuntimeError
+    conn, cursor = setup_database_connection(tmp_path / "genplis.db")
+    assert cursor.execute("SELECT COUNT(*) FROM files").fetchone() == (0,)
+
+
+def test_batch_writer_commits_after_batch_seconds(tmp_path, genplis_db, file_mp3):
+    writer = BatchWriter(genplis_db, batch_size=100, batch_seconds=0)
+    writer.add(file_mp3, {"a": "b"})
+    assert writer.pending == 0
+
+
+def test_iter_cached_tags(genplis_db):
+    genplis_db.executemany(
+        "INSERT INTO files(path, last_modified, tags) VALUES (?, 1, ?)",
+        [
+            ("/music/a.mp3", '{"a": "1"}'),
+            ("/music/b.mp3", '{"b": "2"}'),
+            ("/music/c.mp3", "not decoded"),
+            ("/musics/a.mp3", '{"a": "3"}'),
+        ],
+    )
+    wanted = {"/music/a.mp3", "/music/b.mp3", "/musics/a.mp3"}
+    assert dict(iter_cached_tags(genplis_db.cursor(), Path("/music"), wanted)) == {
+        "/music/a.mp3": {"a": "1"},
+        "/music/b.mp3": {"b": "2"},
+    }
+    assert dict(iter_tags_by_path(genplis_db.cursor(), wanted)) == {
+        "/music/a.mp3": {"a": "1"},
+        "/music/b.mp3": {"b": "2"},
+        "/musics/a.mp3": {"a": "3"},
+    }
+    assert dict(iter_tags_by_path(genplis_db.cursor(), [])) == {}
+
+
+def test_directory_cache(genplis_db):
+    cursor = genplis_db.cursor()
+    entries = [("a", True, None, None, None, None), ("b.mp3", False, 1, 2, 3, 4)]
+    cache_directory_listing(cursor, DirectoryListing(Path("/music"), 1, entries))
+    cache_directory_listing(cursor, DirectoryListing(Path("/music/a"), 2, []))
+    cache_directory_listing(cursor, DirectoryListing(Path("/musics"), 3, []))
+
+    cache = DirectoryCache(cursor, Path("/music"))
+    assert set(cache.directories) == {"/music", "/music/a"}
+    assert cache.get_entries(Path("/music"), 1) == entries
+    assert cache.get_entries(Path("/music/a"), 2) == []
+    # mtime changed
+    assert cache.get_entries(Path("/music/a"), 3) is None
+    assert cache.get_entries(Path("/music/b"), 3) is None
+
+
+def test_delete_stale_entries(genplis_db):
+    genplis_db.executemany(
+        "INSERT INTO files(path, last_modified, tags) VALUES (?, 1, '{}')",
+        [("/music/a.mp3",), ("/music/b/c.mp3",), ("/music/d.mp3",), ("/musics/e.mp3",)],
+    )
+    genplis_db.executemany(
+        "INSERT INTO directories(path, mtime_ns, entries) VALUES (?, 1, '[]')",
+        [("/music",), ("/music/b",), ("/music/f",)],
+    )
+    cursor = genplis_db.cursor()
+    clear_seen_paths(cursor)
+    save_seen_paths(cursor, {"/music/a.mp3"})
+    seen_paths = {"/music/b", "/music/b/c.mp3"}
+    assert delete_stale_entries(cursor, Path("/music"), seen_paths) == (1, 1)
+    files = cursor.execute("SELECT path FROM files ORDER BY path").fetchall()
+    assert files == [("/music/a.mp3",), ("/music/b/c.mp3",), ("/musics/e.mp3",)]
+    directories = cursor.execute("SELECT path FROM directories ORDER BY path")
+    assert directories.fetchall() == [("/music",), ("/music/b",)]
+
+
+def test_compact(genplis_db):
+    genplis_db.executemany(
+        "INSERT INTO files(path, last_modified, tags) VALUES (?, 1, ?)",
+        [(f"/music/{n}.mp3", "x" * 1000) for n in range(100)],
+    )
+    genplis_db.commit()
+    size = get_db_size(genplis_db)
+    genplis_db.execute("DELETE FROM files")
+    assert get_db_size(genplis_db) == size
+    assert compact(genplis_db) > 0
+    assert get_db_size(genplis_db) < size
+
+
+def test_failed_files(genplis_db):
+    cursor = genplis_db.cursor()
+    entry = FileEntry(Path("/music/a.ogg"), False, 10, 1_000)
+    cache_failure(cursor, entry, ("ParseError", "Invalid OGG header"))
+    cache_failure(cursor, entry._replace(path=Path("/musics/b.ogg")), ("a", "b"))
+    failed_files = get_failed_files(cursor, Path("/music"))
+    assert list(failed_files) == ["/music/a.ogg"]
+    assert failed_files["/music/a.ogg"][:2] == (1_000, 10)
+
+    cache_failure(cursor, entry._replace(size=20), ("ParseError", "Invalid"))
+    assert get_failed_files(cursor, Path("/music"))["/music/a.ogg"][:2] == (1_000, 20)
+
+    delete_failure(cursor, entry.path)
+    assert get_failed_files(cursor, Path("/music")) == {}
+
+
+def test_copy_cache_entry(genplis_db, file_mp3):
+    cursor = genplis_db.cursor()
+    cache_tags_for_file(cursor, file_mp3, {"filename": str(file_mp3), "a": "b"})
+    cursor.execute("UPDATE files SET fingerprint='abc'")
+    entry = FileEntry(Path("moved/test.mp3"), False, 1, 2_000_000_000, 3, 4)
+
+    # not copied if the entry changed since its fingerprint was looked up
+    assert not copy_cache_entry(cursor, str(file_mp3), entry, "def")
+    assert get_cached_keys(cursor, Path("moved")) == {}
+
+    assert copy_cache_entry(cursor, str(file_mp3), entry, "abc")
+    new_path = str(entry.path.absolute())
+    assert get_cached_keys(cursor, Path("moved")) == {
+        new_path: (2, entry.cache_key, None)
+    }
+    assert get_cached_tags(cursor, new_path) == {
+        "filename": "moved/test.mp3",
+        "a": "b",
+    }
+    assert get_fingerprints(cursor) == {
+        str(file_mp3): ("abc", None),
+        new_path: ("abc", None),
+    }
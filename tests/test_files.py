@@ -0,0 +1,154 @@
+import os
+import re
+import time
+
+import pytest
+
+from genplis.files import (
+    FINGERPRINT_BLOCK_SIZE,
+    DirectoryListing,
+    FileEntry,
+    get_fingerprint,
+    get_last_modified,
+    get_stat_calls,
+    walk,
+)
+
+
+def test_walk(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "c").mkdir()
+    for path in ["1.mp3", "a/2.mp3", "a/b/3.mp3", "c/4.mp3"]:
+        (tmp_path / path).write_bytes(b"1234")
+    (tmp_path / "link").symlink_to(tmp_path / "a")
+    (tmp_path / "broken").symlink_to(tmp_path / "missing")
+
+    start_stat_calls = get_stat_calls()
+    entries = list(walk(tmp_path))
+    # one stat per non-directory entry
+    assert get_stat_calls() - start_stat_calls == 6
+
+    # same order as rglob, without symlinks to directories nor broken links
+    assert [entry.path for entry in entries] == [
+        path for path in tmp_path.rglob("*") if path.name not in {"link", "broken"}
+    ]
+    mp3 = tmp_path / "a" / "2.mp3"
+    assert FileEntry.from_stat(mp3, mp3.stat()) in entries
+    assert FileEntry(tmp_path / "a" / "b", True, None, None) in entries
+
+
+def test_file_entry_last_modified(file_mp3):
+    entry = next(entry for entry in walk(file_mp3.parent) if entry.path == file_mp3)
+    assert entry.last_modified == get_last_modified(file_mp3)
+
+
+def test_file_entry_cache_key(tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"1234")
+    entry = FileEntry.from_stat(song, song.stat())
+    assert entry.cache_key == FileEntry.from_stat(song, song.stat()).cache_key
+
+    # an older copy restored in place of the file
+    backup = tmp_path / "backup.mp3"
+    backup.write_bytes(b"4321")
+    os.utime(backup, ns=(entry.mtime_ns - 10**9, entry.mtime_ns - 10**9))
+    backup.replace(song)
+    restored = FileEntry.from_stat(song, song.stat())
+    assert restored.last_modified < entry.last_modified
+    assert restored.cache_key != entry.cache_key
+
+
+def test_walk_exclude(tmp_path):
+    (tmp_path / "Podcasts" / "show").mkdir(parents=True)
+    (tmp_path / "Music").mkdir()
+    for path in ["Podcasts/1.mp3", "Podcasts/show/2.mp3", "Music/3.mp3", "4.mp3"]:
+        (tmp_path / path).write_bytes(b"")
+
+    start_stat_calls = get_stat_calls()
+    entries = list(walk(tmp_path, re.compile(r"/Podcasts/|4\.mp3$")))
+    # excluded files are not even stat'ed
+    assert get_stat_calls() - start_stat_calls == 1
+    assert [entry.path for entry in entries] == [
+        tmp_path / "Music",
+        tmp_path / "Music" / "3.mp3",
+    ]
+
+
+def set_old_mtime(*paths):
+    for path in paths:
+        os.utime(path, (time.time() - 60, time.time() - 60))
+
+
+class DictDirectoryCache:
+    def __init__(self):
+        self.directories = {}
+
+    def get_entries(self, directory, mtime_ns):
+        cached = self.directories.get(directory)
+        if cached is None or cached.mtime_ns != mtime_ns:
+            return None
+        return cached.entries
+
+
+@pytest.mark.parametrize("trust_dirs", [False, True])
+def test_walk_directory_cache(tmp_path, trust_dirs):
+    (tmp_path / "a").mkdir()
+    for path in ["1.mp3", "a/2.mp3"]:
+        (tmp_path / path).write_bytes(b"")
+    set_old_mtime(tmp_path, tmp_path / "a")
+    cache = DictDirectoryCache()
+
+    def walk_and_cache():
+        entries = []
+        for entry in walk(tmp_path, directory_cache=cache, trust_dirs=trust_dirs):
+            if isinstance(entry, DirectoryListing):
+                cache.directories[entry.path] = entry
+            else:
+                entries.append(entry)
+        return entries
+
+    entries = walk_and_cache()
+    assert [entry.path for entry in entries] == list(tmp_path.rglob("*"))
+    assert set(cache.directories) == {tmp_path, tmp_path / "a"}
+
+    # nothing changed, directories are not listed again
+    start_stat_calls = get_stat_calls()
+    assert walk_and_cache() == entries
+    # root and "a" directories, plus the files if their stat is not trusted
+    assert get_stat_calls() - start_stat_calls == (2 if trust_dirs else 4)
+
+    # a new file changes the directory mtime
+    (tmp_path / "a" / "3.mp3").write_bytes(b"")
+    assert [entry.path for entry in walk_and_cache()] == list(tmp_path.rglob("*"))
+    # but the directory is not cached until its mtime is old enough
+    cached_entries = cache.directories[tmp_path / "a"].entries
+    assert [name for name, *_ in cached_entries] == ["2.mp3"]
+
+
+def test_walk_directory_cache_skips_recent_directories(tmp_path):
+    (tmp_path / "1.mp3").write_bytes(b"")
+    listings = [
+        entry
+        for entry in walk(tmp_path, directory_cache=DictDirectoryCache())
+        if isinstance(entry, DirectoryListing)
+    ]
+    assert listings == []
+
+
+@pytest.mark.parametrize("size", [10, FINGERPRINT_BLOCK_SIZE * 3])
+def test_get_fingerprint(tmp_path, size):
+    def fingerprint(path):
+        return get_fingerprint(FileEntry.from_stat(path, path.stat()))
+
+    song = tmp_path / "song.mp3"
+    song.write_bytes(bytes(range(256)) * (size // 256) + b"1" * (size % 256))
+    original = fingerprint(song)
+    moved = song.rename(tmp_path / "moved.mp3")
+    assert fingerprint(moved) == original
+
+    content = bytearray(moved.read_bytes())
+    content[-1] ^= 1
+    moved.write_bytes(content)
+    assert fingerprint(moved) != original
+
+    assert get_fingerprint(FileEntry(tmp_path / "missing.mp3", False, 1, 1)) is None
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import pytest
+
+from genplis.index import TagIndex
+from genplis.m3ug import parse_m3ug
+
+TAG_VALUES = [
+    None,
+    "",
+    0,
+    4,
+    4.0,
+    True,
+    [],
+    {},
+    "4",
+    "Metal",
+    "Heavy Metal",
+    "metal",
+    "Me",
+    ["Metal"],
+    ["Metal", "Rock"],
+    ["Heavy Metal", 4],
+    [["Metal"], "Rock"],
+    {"Metal": 1},
+]
+RULES = [
+    "genre = Metal",
+    "Genre = Metal",
+    "genre = 4",
+    "genre = 4.0",
+    "genre = 1",
+    "genre ~= Metal",
+    "genre ~= eta",
+    "genre ~= Me",
+    "genre ~= ",
+    "genre ~= Jazz",
+    "genre ~= Metal\ngenre = Heavy Metal",
+    "genre ~= Metal\nyear > 1990",
+    "year > 1990",
+    "rating = 4.0",
+    "rating ~= eta",
+]
+
+
+@pytest.fixture()
+def all_tags():
+    all_tags = {}
+    for n, value in enumerate(TAG_VALUES):
+        all_tags[Path(f"{n}.mp3")] = {"genre": value, "year": 1980 + n, "rating": value}
+    # the rating alias
+    all_tags[Path("fmps.mp3")] = {"genre": "Metal", "fmps_rating": "0.8"}
+    return all_tags
+
+
+def python_match(all_tags, rules):
+    return {
+        file
+        for file, tags in all_tags.items()
+        if all(rule.apply(tags) for rule in rules)
+    }
+
+
+@pytest.mark.parametrize("rule", RULES)
+def test_tag_index_match(all_tags, rule):
+    rules = parse_m3ug(rule)
+    assert TagIndex(all_tags).match(rules) == python_match(all_tags, rules)
+
+
+def test_tag_index_add_remove(all_tags):
+    index = TagIndex(all_tags)
+    rules = parse_m3ug("genre ~= Metal")
+    assert index.match(rules) == python_match(all_tags, rules)
+
+    # changed and removed songs
+    for n in range(0, len(TAG_VALUES), 2):
+        file = Path(f"{n}.mp3")
+        index.remove(file, all_tags.pop(file))
+    for n in range(1, len(TAG_VALUES), 4):
+        file = Path(f"{n}.mp3")
+        index.remove(file, all_tags[file])
+        all_tags[file] = {"genre": "Metalcore"}
+        index.add(file, all_tags[file])
+
+    assert index.match(rules) == python_match(all_tags, rules)
+    assert "Heavy Metal" not in index.keys["genre"].values
+    assert "Hea" not in index.keys["genre"].ngrams
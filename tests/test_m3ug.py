@@ -11,6 +11,7 @@ from genplis.m3ug import (
     NameNode,
     NotEqualRuleNode,
     ValueNode,
+    compile_rules,
     parse_m3ug,
 )
 
@@ -256,3 +257,68 @@ genre ~= Synthwave
         GreaterOrEqualRuleNode(NameNode("rating"), ValueNode(4)),
         ContainsRuleNode(NameNode("genre"), ValueNode("Synthwave")),
     ]
+
+
+def test_rule_key():
+    rules = parse_m3ug("rating >= 4\nRating >= 4.0\nrating > 4\nrating >= 3")
+    assert rules[0].key == rules[1].key
+    assert len({rule.key for rule in rules}) == 3
+    assert parse_m3ug("genre = 4")[0].key != parse_m3ug("genre ~= 4a")[0].key
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        "genre = Rock",
+        "genre = 3",
+        "genre != Rock",
+        "genre != 3.5",
+        "genre ~= Rock",
+        "genre < 3",
+        "genre <= 3.5",
+        "genre > 3",
+        "genre >= 3",
+        "rating >= 3",
+        "Rating = 4.0",
+    ],
+)
+def test_compile(rule):
+    values = [
+        None,
+        "",
+        0,
+        3,
+        3.5,
+        True,
+        [],
+        {},
+        "3",
+        "3.5",
+        "3\n",
+        "٣",
+        "²",
+        "Rock",
+        "Hard Rock",
+        ["3"],
+        ["Rock"],
+        ["Rock", "2", 4],
+        [["4"], "x"],
+        {"Rock": 1},
+    ]
+    (rule_node,) = parse_m3ug(rule)
+    check = rule_node.compile()
+    for value in values:
+        for tags in [{"genre": value, "rating": value}, {"fmps_rating": value}]:
+            if "fmps_rating" in tags and value not in [None, 0, 3, [], "3", ["3"]]:
+                # not a valid fmps_rating, apply raises too
+                continue
+            assert check(tags) == bool(rule_node.apply(tags)), tags
+
+
+def test_compile_rules():
+    rules = parse_m3ug("genre ~= Rock\nyear >= 1990")
+    predicate = compile_rules(rules)
+    assert predicate({"genre": "Rock", "year": "1991"})
+    assert not predicate({"genre": "Rock", "year": "1989"})
+    assert not predicate({"genre": "Jazz", "year": 1991})
+    assert compile_rules([])({})
@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from genplis.db import cache_tags_for_file
+from genplis.files import FileEntry
+from genplis.m3ug import parse_m3ug
+from genplis.sql import filter_paths
+
+# Values as tinytag returns them, and some it never should
+TAG_VALUES = [
+    None,
+    "",
+    0,
+    0.0,
+    True,
+    False,
+    [],
+    {},
+    3,
+    4.5,
+    "3",
+    "4.5",
+    "03",
+    "abc",
+    "Rock",
+    "Synthwave; Retrowave",
+    "3\n",
+    "٣",
+    "4.5.1",
+    "123456789012345678901234",
+    ["3"],
+    [4.5],
+    [""],
+    [None],
+    ["Synthwave", "Rock"],
+    ["Rock", 3],
+    ["x", "٣"],
+    [["3", "1"], "x"],
+    {"front_cover": [], "Rock": 1},
+]
+# Values of fmps_rating, the rating alias fails for values that are not numbers
+FMPS_RATINGS = [None, 0, 0.6, "0.8", "1", [], [0.9], ["0.7"]]
+RULES = [
+    "genre = Rock",
+    "genre = 3",
+    "genre = 4.5",
+    "genre != Rock",
+    "genre != 3",
+    "genre ~= Rock",
+    "genre ~= wave; R",
+    "Genre ~= front_cover",
+    "genre < 4",
+    "genre <= 4.5",
+    "genre > 3",
+    "genre >= 3.0",
+    "rating >= 3",
+    "rating = 4.5",
+    'ge"nre = Rock',
+]
+
+
+def cache_tags(cursor, path, tags):
+    cache_tags_for_file(cursor, path, tags, FileEntry(path, False, 1, 1))
+
+
+@pytest.fixture()
+def music_dir(genplis_db, tmp_path):
+    """Cache a file for each tag value, as genre and rating."""
+    music_dir = tmp_path / "music"
+    cursor = genplis_db.cursor()
+    for n, value in enumerate(TAG_VALUES):
+        path = music_dir / f"{n}_genre.mp3"
+        cache_tags(cursor, path, {"genre": value, 'ge"nre': value})
+        for m, fmps_rating in enumerate(FMPS_RATINGS):
+            path = music_dir / f"{n}_{m}_rating.mp3"
+            cache_tags(cursor, path, {"rating": value, "fmps_rating": fmps_rating})
+    # outside of music_dir
+    cache_tags(cursor, tmp_path / "other.mp3", {"genre": "Rock"})
+    genplis_db.commit()
+    return music_dir
+
+
+def python_filter(cursor, directory: Path, rules):
+    cursor.execute("SELECT path, tags FROM files")
+    return {
+        path
+        for path, tags in cursor.fetchall()
+        if Path(path).is_relative_to(directory)
+        and all(rule.apply(json.loads(tags)) for rule in rules)
+    }
+
+
+@pytest.mark.parametrize("rule", RULES)
+def test_filter_paths_matches_python(genplis_db, music_dir, rule):
+    rules = parse_m3ug(rule)
+    cursor = genplis_db.cursor()
+    expected = python_filter(cursor, music_dir, rules)
+    assert expected
+    assert filter_paths(cursor, music_dir, rules) == expected
+
+
+def test_filter_paths_several_rules(genplis_db, music_dir):
+    # lists never pass != rules
+    rules = parse_m3ug("genre ~= Rock\ngenre != Rock")
+    cursor = genplis_db.cursor()
+    assert filter_paths(cursor, music_dir, rules) == {
+        str(music_dir / "28_genre.mp3"),
+    }
+
+
+def test_filter_paths_no_rules(genplis_db, music_dir):
+    cursor = genplis_db.cursor()
+    assert filter_paths(cursor, music_dir, []) == python_filter(cursor, music_dir, [])
+    assert len(filter_paths(cursor, music_dir, [])) == len(TAG_VALUES) * (
+        1 + len(FMPS_RATINGS)
+    )
@@ -0,0 +1,141 @@
+from pathlib import Path
+
+import pytest
+
+from genplis.m3ug import parse_m3ug
+from genplis.store import (
+    INT_TYPECODES,
+    DictColumn,
+    NumberColumn,
+    TagStore,
+    get_tags_size,
+)
+
+TAG_VALUES = [
+    None,
+    "",
+    0,
+    4,
+    4.0,
+    2.5,
+    True,
+    2**70,
+    [],
+    {},
+    "4",
+    "Metal",
+    "Heavy Metal",
+    ["Metal"],
+    ["Metal", "Rock"],
+    ["Heavy Metal", 4],
+    {"Metal": 1},
+]
+RULES = [
+    "",
+    "genre = Metal",
+    "genre = 4",
+    "genre != Metal",
+    "genre ~= Metal",
+    "genre ~= eta",
+    "genre > 3",
+    "genre <= 4",
+    "year > 1990",
+    "year > 1990\ngenre ~= Metal",
+    "title = Song",
+    "title != Song",
+    "rating = 4.0",
+    "rating >= 4",
+    "rating ~= eta",
+]
+
+
+@pytest.fixture()
+def all_tags():
+    all_tags = {}
+    for n, value in enumerate(TAG_VALUES):
+        all_tags[Path(f"{n}.mp3")] = {"genre": value, "year": 1980 + n, "rating": value}
+    # the rating alias
+    all_tags[Path("fmps.mp3")] = {"genre": "Metal", "fmps_rating": 0.8}
+    return all_tags
+
+
+def make_store(all_tags):
+    store = TagStore()
+    for file, tags in all_tags.items():
+        store.add(file, tags)
+    return store
+
+
+def python_match(all_tags, rules):
+    return [
+        file
+        for file, tags in all_tags.items()
+        if all(rule.apply(tags) for rule in rules)
+    ]
+
+
+@pytest.mark.parametrize("rule", RULES)
+def test_tag_store_match(all_tags, rule):
+    rules = parse_m3ug(rule)
+    assert make_store(all_tags).match(rules) == python_match(all_tags, rules)
+
+
+def test_tag_store_get_tags(all_tags):
+    store = make_store(all_tags)
+    for file_id, tags in enumerate(all_tags.values()):
+        expected = {key: value for key, value in tags.items() if value is not None}
+        found = store.get_tags(file_id)
+        assert found == expected
+        # 4, 4.0 and True are equal, but keep their type
+        assert {key: type(value) for key, value in found.items()} == {
+            key: type(value) for key, value in expected.items()
+        }
+
+
+def test_tag_store_columns(all_tags):
+    store = make_store(all_tags)
+    assert isinstance(store.columns["year"], NumberColumn)
+    assert isinstance(store.columns["fmps_rating"], NumberColumn)
+    # converted when a value of another type is found
+    assert isinstance(store.columns["genre"], DictColumn)
+    # every distinct value is kept once
+    assert store.columns["genre"].values.count("Metal") == 1
+
+
+def test_number_column_widening():
+    column = NumberColumn(int)
+    column.set(0, 1)
+    assert column.numbers.typecode == INT_TYPECODES[0]
+    column.set(2, -40_000)
+    column.set(1, 2**40)
+    assert column.numbers.typecode == "q"
+    assert [column.get(file_id) for file_id in range(4)] == [1, 2**40, -40_000, None]
+
+
+def test_tag_store_reserve():
+    store = TagStore()
+    first = store.reserve()
+    store.add(Path("b.mp3"), {"genre": "Metal"})
+    empty = store.reserve()
+    store.set_tags(first, Path("a.mp3"), {"genre": "Heavy Metal"})
+    store.set_tags(empty, Path("c.mp3"), {})
+    assert len(store) == 2
+    assert store.match(parse_m3ug("genre ~= Metal")) == [Path("a.mp3"), Path("b.mp3")]
+
+
+def test_tag_store_shared_rules(all_tags):
+    store = make_store(all_tags)
+    store.match(parse_m3ug("genre ~= Metal\nyear > 1990"))
+    store.match(parse_m3ug("genre ~= Metal\nyear < 1990"))
+    assert store.deduplicated == 1
+    # cached results are dropped when tags change
+    store.add(Path("new.mp3"), {"genre": "Metal", "year": 1970})
+    assert store.match(parse_m3ug("genre ~= Metal\nyear < 1990"))[-1] == Path("new.mp3")
+
+
+def test_tag_store_size():
+    all_tags = {
+        Path(f"{n}.mp3"): {"artist": "Artist", "genre": "Synthwave", "year": 1980 + n}
+        for n in range(1000)
+    }
+    assert make_store(all_tags).get_size() * 5 < get_tags_size(all_tags)
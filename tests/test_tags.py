@@ -1,42 +1,56 @@
-from genplis.tags import get_tag_size, get_tags
+from genplis.m3ug import parse_m3ug
+from genplis.tags import AUDIO_TAGS, get_tag_size, get_tags, normalize_tags
 
 
 def test_get_tags_mp3(file_mp3):
     tags = get_tags(file_mp3)
     assert tags == {
-        "artist": ["Test Artist"],
+        "artist": "Test Artist",
         "bitrate": 127.488,
         "channels": 2,
         "duration": 3.2653061224489797,
-        "encoder_settings": ["Lavf57.83.100"],
+        "encoder_settings": "Lavf57.83.100",
         "filename": "/home/fidel/Code/genplis/tests/files/test.mp3",
         "filesize": 53235,
-        "genre": ["Synthwave; Retrowave; Electronic"],
+        "genre": "Synthwave; Retrowave; Electronic",
         "images": {},
         "samplerate": 44100,
-        "title": ["Test"],
+        "title": "Test",
     }
 
 
 def test_get_tags_ogg(file_ogg):
     tags = get_tags(file_ogg)
     assert tags == {
-        "artist": ["Test Artist"],
+        "artist": "Test Artist",
         "bitrate": 112.0,
         "channels": 2,
         "duration": 1.0,
-        "encoder": [
-            "Lavc58.35.100 libvorbis",
-        ],
+        "encoder": "Lavc58.35.100 libvorbis",
         "filename": str(file_ogg),
         "filesize": 5241,
         "genre": ["Synthwave", "Retrowave", "Electronic"],
         "images": {},
         "samplerate": 44100,
-        "title": ["Test"],
+        "title": "Test",
     }
 
 
+def test_get_tags_fields(file_mp3, file_ogg):
+    for file in (file_mp3, file_ogg):
+        tags = get_tags(file, fields=frozenset({"genre", "encoder"}))
+        assert "genre" in tags
+        assert "artist" not in tags
+        assert "title" not in tags
+        assert {"filesize", "filename"} <= tags.keys()
+        assert AUDIO_TAGS.isdisjoint(tags)
+        # all audio properties come together
+        tags = get_tags(file, fields=frozenset({"genre", "duration"}))
+        assert {"duration", "bitrate", "samplerate", "channels"} <= tags.keys()
+    assert get_tags(file_ogg, fields=frozenset({"encoder"}))["encoder"]
+    assert "encoder_settings" not in get_tags(file_mp3, fields=frozenset({"genre"}))
+
+
 def test_get_tag_size():
     assert get_tag_size(None) == 16
     assert get_tag_size(2) == 28
@@ -44,3 +58,46 @@ def test_get_tag_size():
     assert get_tag_size("") == 41
     assert get_tag_size("DANCE WITH THE DEAD") == 60
     assert get_tag_size(["Synthwave", "Retrowave", "Electronic"]) == 151
+
+
+def test_normalize_tags():
+    tags = {
+        "Artist": ["A"],
+        "genre": ["Rock", "Jazz"],
+        "title": [""],
+        "year": ["1990"],
+        "bpm": "120.5",
+        "track": 3,
+        "comment": ["1990"],
+        "fmps_rating": ["0.8"],
+    }
+    normalized = normalize_tags(tags)
+    assert normalized == {
+        "artist": "A",
+        "genre": ["Rock", "Jazz"],
+        "title": [""],
+        "year": 1990,
+        "bpm": 120.5,
+        "track": 3,
+        "comment": "1990",
+        "fmps_rating": 0.8,
+        "rating": 4.0,
+    }
+    assert normalize_tags(normalized) == normalized
+    # a tag with the lowercase name wins
+    assert normalize_tags({"ARTIST": "A", "artist": "B", "Artist": "C"}) == {
+        "artist": "B"
+    }
+    # invalid ratings are left for rules to fail on
+    assert normalize_tags({"fmps_rating": "high"}) == {"fmps_rating": "high"}
+
+
+def test_normalize_tags_rules():
+    tags = {"year": ["1990"], "fmps_rating": ["0.8"], "title": [""]}
+    for rule in ["year > 1989", "year < 1991", "rating >= 4", "title != x"]:
+        (rule_node,) = parse_m3ug(rule)
+        assert rule_node.apply(tags) == rule_node.apply(normalize_tags(tags))
+    # numeric tags are equal to numbers now
+    (rule_node,) = parse_m3ug("year = 1990")
+    assert not rule_node.apply(tags)
+    assert rule_node.apply(normalize_tags(tags))
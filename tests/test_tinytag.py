@@ -0,0 +1,323 @@
+import io
+import os
+import struct
+
+import pytest
+from tinytag import TinyTag
+from tinytag.tinytag import _ID3, _MappedFile
+
+SAMPLE_RATE = 44100
+TAGS = {"TITLE": "Song", "ARTIST": "Artist", "GENRE": "Synthwave"}
+
+
+def make_id3v2(tags: dict[str, str]) -> bytes:
+    frames = b""
+    for frame_id, text in tags.items():
+        content = b"\x00" + text.encode("latin1")
+        frames += frame_id.encode() + struct.pack(">I", len(content)) + b"\0\0"
+        frames += content
+    size = len(frames)
+    synchsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x03\x00\x00" + synchsafe + frames
+
+
+def make_mp3_frame(kbps: int, xing: tuple[int, int] | None = None) -> bytes:
+    """Return an MPEG-1 Layer III frame of 44.1 kHz joint stereo audio."""
+    bitrate_ids = {128: 9, 192: 11, 320: 14}
+    header = bytes((0xFF, 0xFB, bitrate_ids[kbps] << 4, 0x40))
+    body = bytearray(144000 * kbps // SAMPLE_RATE - len(header))
+    if xing is not None:
+        # frames and bytes flags, after the side information of a stereo frame
+        body[32:48] = b"Xing" + struct.pack(">III", 3, *xing)
+    return header + bytes(body)
+
+
+def make_mp3(audio: bytes) -> bytes:
+    tags = {"TIT2": "Song", "TPE1": "Artist", "TCON": "Synthwave"}
+    return make_id3v2(tags) + audio
+
+
+def make_vorbis_comment() -> bytes:
+    vendor = b"genplis"
+    comments = [f"{key}={value}".encode() for key, value in TAGS.items()]
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for comment in comments:
+        data += struct.pack("<I", len(comment)) + comment
+    return data
+
+
+def make_flac() -> bytes:
+    channels, bitdepth, samples = 2, 16, SAMPLE_RATE * 60
+    streaminfo = struct.pack(">HH3s3s", 4096, 4096, b"\0\0\0", b"\0\0\0")
+    packed = SAMPLE_RATE << 44 | (channels - 1) << 41 | (bitdepth - 1) << 36 | samples
+    streaminfo += packed.to_bytes(8, "big") + bytes(16)
+    blocks = b""
+    for block_type, data in ((0, streaminfo), (0x84, make_vorbis_comment())):
+        blocks += bytes([block_type]) + len(data).to_bytes(3, "big") + data
+    return b"fLaC" + blocks + bytes(10000)
+
+
+def make_wav() -> bytes:
+    fmt = struct.pack("<HHIIHH", 1, 2, SAMPLE_RATE, SAMPLE_RATE * 4, 4, 16)
+    info = b"INFO"
+    for field, value in ((b"INAM", "Song"), (b"IART", "Artist")):
+        data = value.encode() + b"\0"
+        data += b"\0" * (len(data) % 2)
+        info += field + struct.pack("<I", len(data)) + data
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    chunks += b"data" + struct.pack("<I", 10000) + bytes(10000)
+    chunks += b"LIST" + struct.pack("<I", len(info)) + info
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+
+
+@pytest.fixture()
+def data_file(tmp_path):
+    file = tmp_path / "data.bin"
+    file.write_bytes(bytes(range(256)) * 4)
+    return file
+
+
+@pytest.fixture()
+def samples(tmp_path, file_mp3, file_ogg):
+    vbr = [make_mp3_frame(kbps) for kbps in (128, 192, 320, 192)] * 100
+    generated = {
+        "vbr.mp3": make_mp3(b"".join(vbr)),
+        "test.flac": make_flac(),
+        "test.wav": make_wav(),
+    }
+    for name, data in generated.items():
+        (tmp_path / name).write_bytes(data)
+    return [file_mp3, file_ogg] + [tmp_path / name for name in generated]
+
+
+def test_mapped_file_matches_file(data_file):
+    operations = [
+        ("read", 10),
+        ("seek", 20, os.SEEK_CUR),
+        ("read", 5),
+        ("seek", -5, os.SEEK_CUR),
+        ("read", 10),
+        ("seek", -16, os.SEEK_END),
+        ("read", 100),
+        ("read", 10),
+        ("seek", 1000, os.SEEK_SET),
+        ("read", None),
+        ("seek", 2000, os.SEEK_SET),
+        ("read", 10),
+        ("read", -1),
+        ("seek", 10, os.SEEK_END),
+        ("read", 1),
+        ("seek", 0, os.SEEK_SET),
+        ("read", -1),
+    ]
+    with open(data_file, "rb") as file:
+        mapped = _MappedFile.open(file)
+        assert mapped is not None
+        for name, *arguments in operations:
+            assert getattr(mapped, name)(*arguments) == getattr(file, name)(*arguments)
+            assert mapped.tell() == file.tell()
+        mapped.close()
+
+
+@pytest.mark.parametrize(
+    "offset, whence", [(-1, os.SEEK_SET), (-11, os.SEEK_CUR), (-1025, os.SEEK_END)]
+)
+def test_mapped_file_negative_seek(data_file, offset, whence):
+    with open(data_file, "rb") as file:
+        mapped = _MappedFile.open(file)
+        mapped.seek(10)
+        with pytest.raises(OSError):
+            mapped.seek(offset, whence)
+        assert mapped.tell() == 10
+        mapped.close()
+
+
+def test_mapped_file_unmappable(tmp_path):
+    assert _MappedFile.open(io.BytesIO(b"data")) is None
+    empty = tmp_path / "empty.mp3"
+    empty.touch()
+    with open(empty, "rb") as file:
+        assert _MappedFile.open(file) is None
+    read_fd, write_fd = os.pipe()
+    with open(read_fd, "rb") as reader, open(write_fd, "wb"):
+        assert _MappedFile.open(reader) is None
+
+
+def test_get_memory_map(samples):
+    for file in samples:
+        assert (
+            TinyTag.get(file, memory_map=True).as_dict() == TinyTag.get(file).as_dict()
+        ), file
+
+
+def test_get_memory_map_file_objects(samples):
+    for file in samples:
+        expected = TinyTag.get(file).as_dict()
+        del expected["filename"]
+        file_objects = [io.BytesIO(file.read_bytes()), open(file, "rb")]
+        for file_obj in file_objects:
+            with file_obj:
+                tag = TinyTag.get(file_obj=file_obj, memory_map=True)
+                assert tag.as_dict() == expected, (file, file_obj)
+                assert not file_obj.closed
+
+
+def test_get_memory_map_not_seekable():
+    read_fd, write_fd = os.pipe()
+    with open(read_fd, "rb") as reader, open(write_fd, "wb"):
+        for memory_map in (False, True):
+            with pytest.raises(OSError):
+                TinyTag.get(file_obj=reader, memory_map=memory_map)
+
+
+def test_get_memory_map_empty_file(tmp_path):
+    empty = tmp_path / "empty.mp3"
+    empty.touch()
+    tag = TinyTag.get(empty, memory_map=True)
+    assert tag.filesize == 0
+    assert tag.duration is None
+    assert tag.as_dict() == TinyTag.get(empty).as_dict()
+
+
+def make_vbri_frame() -> bytes:
+    """Return a frame with a VBRI header, which tinytag walks over as audio."""
+    frame = bytearray(make_mp3_frame(128))
+    frame[36:58] = b"VBRI" + struct.pack(">HHIIHHH", 1, 0, 100000, 400, 0, 1, 2)
+    return bytes(frame)
+
+
+VBR_FRAMES = b"".join(make_mp3_frame(kbps) for kbps in (128, 192, 320, 192))
+# a frame header starting 1 to 3 bytes before the end of the first window
+STRADDLE_OFFSETS = [_ID3._WALKER_WINDOW_SIZE - offset for offset in (1, 2, 3)]
+# durations and bitrates as computed before the frames were walked in a window
+MP3_SAMPLES = [
+    ("cbr", make_mp3_frame(128) * 500, 13.053206088190672, 128.0),
+    ("vbr", VBR_FRAMES * 500, 52.23996810519269, 208.0),
+    (
+        "xing",
+        make_mp3_frame(128, (400, len(VBR_FRAMES) * 100)) + VBR_FRAMES * 100,
+        10.448979591836734,
+        207.71406250000004,
+    ),
+    (
+        "vbri",
+        make_vbri_frame() + VBR_FRAMES * 100,
+        10.475102040816326,
+        207.8004987531172,
+    ),
+    (
+        "junk",
+        b"\xff\xe0\x00\xffjunk\xff" + bytes(1001) + VBR_FRAMES * 100,
+        10.448979591836734,
+        208.0,
+    ),
+] + [
+    sample
+    for offset in STRADDLE_OFFSETS
+    for sample in (
+        (
+            f"straddle-{offset}",
+            bytes(offset - len(VBR_FRAMES)) + VBR_FRAMES * 100,
+            10.448979591836734,
+            208.0,
+        ),
+        (
+            f"xing-straddle-{offset}",
+            bytes(offset) + make_mp3_frame(128, (400, 1000000)) + VBR_FRAMES * 100,
+            10.448979591836734,
+            765.6250000000001,
+        ),
+    )
+]
+
+
+@pytest.mark.parametrize(
+    "audio, duration, bitrate",
+    [sample[1:] for sample in MP3_SAMPLES],
+    ids=[sample[0] for sample in MP3_SAMPLES],
+)
+def test_mp3_duration(tmp_path, audio, duration, bitrate):
+    file = tmp_path / "test.mp3"
+    file.write_bytes(make_mp3(audio))
+    for tag in (
+        TinyTag.get(file),
+        TinyTag.get(file, memory_map=True),
+        TinyTag.get(file_obj=io.BytesIO(file.read_bytes())),
+    ):
+        assert tag.duration == duration
+        assert tag.bitrate == bitrate
+
+
+def make_ogg_pages(packets, position: int, sequence: int) -> list[bytes]:
+    """Return pages with the packets one after another, as encoders lay them out."""
+    segments = []
+    for packet in packets:
+        laces = [255] * (len(packet) // 255) + [len(packet) % 255]
+        offset = 0
+        for lace in laces:
+            segments.append(packet[offset : offset + lace])
+            offset += lace
+    pages = []
+    continued = False
+    for start in range(0, len(segments), 255):
+        page_segments = segments[start : start + 255]
+        header = struct.pack(
+            "<4sBBqIIiB",
+            b"OggS",
+            0,
+            int(continued),
+            position,
+            1,
+            sequence + len(pages),
+            0,
+            len(page_segments),
+        )
+        laces = bytes(len(segment) for segment in page_segments)
+        pages.append(header + laces + b"".join(page_segments))
+        continued = len(page_segments[-1]) == 255
+    return pages
+
+
+def make_ogg(comment_size: int, audio: bool = True) -> bytes:
+    """Return an Ogg Vorbis file with a comment packet of comment_size bytes.
+
+    The comment packet is padded after its framing bit, and followed by the
+    setup packet on the same page. Without audio, the file ends with garbage
+    instead of audio pages.
+    """
+    ident = b"\x01vorbis" + struct.pack("<IBIiiiB", 0, 2, SAMPLE_RATE, 0, 128000, 0, 0)
+    ident += b"\x01"
+    comment = b"\x03vorbis" + make_vorbis_comment() + b"\x01"
+    comment += bytes(comment_size - len(comment))
+    setup = b"\x05vorbis" + bytes(1000)
+    pages = make_ogg_pages([ident], 0, 0)
+    pages += make_ogg_pages([comment, setup], 0, len(pages))
+    if audio:
+        pages += make_ogg_pages([bytes(400)] * 10, SAMPLE_RATE * 60, len(pages))
+    else:
+        pages.append(b"not an Ogg page, tags are parsed before it")
+    return b"".join(pages)
+
+
+@pytest.mark.parametrize(
+    "comment_size",
+    [
+        100,
+        255 * 10,  # ends with an empty lace
+        255 * 255,  # ends with an empty lace, alone on the next page
+        255 * 255 * 3 + 1000,  # continues over four pages
+    ],
+)
+def test_ogg_comment_packet(comment_size):
+    tag = TinyTag.get(file_obj=io.BytesIO(make_ogg(comment_size)))
+    assert tag.title == "Song"
+    assert tag.artist == "Artist"
+    assert tag.genre == "Synthwave"
+    assert tag.duration == 60
+    assert tag.samplerate == SAMPLE_RATE
+    # pages after the comment packet are not read for tags only
+    tag = TinyTag.get(
+        file_obj=io.BytesIO(make_ogg(comment_size, audio=False)), duration=False
+    )
+    assert tag.title == "Song"
+    assert tag.genre == "Synthwave"
@@ -0,0 +1,125 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from genplis.core import parse_args
+from genplis.files import walk
+from genplis.watch import InotifyMonitor, PollingMonitor, Watcher, path_entry
+
+
+@pytest.fixture()
+def watcher(genplis_db, tmp_path, file_mp3, playlists):
+    (tmp_path / "album").mkdir()
+    shutil.copy(file_mp3, tmp_path / "album" / "song.mp3")
+    (tmp_path / "synthwave.m3ug").write_text("genre ~= Synthwave\n")
+    args = parse_args(["watch", str(tmp_path)])
+    return Watcher(genplis_db, tmp_path, args, PollingMonitor(tmp_path, 0))
+
+
+def test_watcher(watcher, tmp_path, file_mp3, file_ogg, playlists):
+    playlist = tmp_path / "synthwave.m3u"
+    song = tmp_path / "album" / "song.mp3"
+    assert playlists == {playlist: [song]}
+
+    # new songs in a new directory
+    (tmp_path / "new").mkdir()
+    new_song = tmp_path / "new" / "song.ogg"
+    shutil.copy(file_ogg, new_song)
+    assert watcher.process_changes({tmp_path / "new"}) == [playlist]
+    assert playlists[playlist] == [song, new_song]
+
+    # changes not affecting any playlist
+    (tmp_path / "album" / "cover.jpg").write_bytes(b"")
+    assert watcher.process_changes({tmp_path / "album" / "cover.jpg"}) == []
+
+    # deleted songs
+    new_song.unlink()
+    assert watcher.process_changes({new_song}) == [playlist]
+    assert playlists[playlist] == [song]
+
+    # modified filters, empty playlists are not written
+    (tmp_path / "synthwave.m3ug").write_text("genre ~= Metal\n")
+    assert watcher.process_changes({tmp_path / "synthwave.m3ug"}) == []
+    assert watcher.playlists[tmp_path / "synthwave.m3ug"] == set()
+    assert playlists[playlist] == [song]
+
+
+def test_watcher_modified_songs(watcher, tmp_path, file_mp3, file_ogg, playlists):
+    playlist = tmp_path / "synthwave.m3u"
+    shutil.copy(file_ogg, tmp_path / "album" / "song.ogg")
+    watcher.process_changes({tmp_path / "album"})
+    songs = list(watcher.all_tags)
+    assert playlists[playlist] == songs
+
+    # modified songs keep their place, like in a full scan
+    os.utime(songs[0], ns=(0, 0))
+    new_song = tmp_path / "album" / "new.mp3"
+    shutil.copy(file_mp3, new_song)
+    assert watcher.process_changes({tmp_path / "album"}) == [playlist]
+    assert playlists[playlist] == songs + [new_song]
+
+
+def test_watcher_polling(watcher, tmp_path, file_ogg, playlists):
+    shutil.copy(file_ogg, tmp_path / "album" / "song.ogg")
+    assert watcher.monitor.wait_changes() == {tmp_path}
+    assert watcher.process_changes({tmp_path}) == [tmp_path / "synthwave.m3u"]
+    # nothing changed since last check
+    assert watcher.process_changes({tmp_path}) == []
+
+
+def test_watcher_known_files(genplis_db, tmp_path, file_mp3, playlists, monkeypatch):
+    song = tmp_path / "song.mp3"
+    shutil.copy(file_mp3, song)
+    broken = tmp_path / "broken.ogg"
+    broken.write_bytes(b"garbage" * 10)
+    (tmp_path / "synthwave.m3ug").write_text("genre ~= Synthwave\n")
+    (tmp_path / "cover.jpg").write_bytes(b"")
+    # the initial scan walks the directory once
+    monkeypatch.setattr("genplis.watch.walk", None)
+    args = parse_args(["watch", str(tmp_path)])
+    watcher = Watcher(genplis_db, tmp_path, args, PollingMonitor(tmp_path, 0))
+    assert watcher.known == {
+        song: path_entry(song).cache_key,
+        broken: path_entry(broken).cache_key,
+        tmp_path / "synthwave.m3ug": path_entry(tmp_path / "synthwave.m3ug").cache_key,
+    }
+    monkeypatch.setattr("genplis.watch.walk", walk)
+    # files that failed to parse are not parsed again until they change
+    monkeypatch.setattr("genplis.watch.parse_music_file", None)
+    assert watcher.process_changes({tmp_path}) == []
+
+    # files that are no longer music files lose their tags
+    monkeypatch.setattr(
+        "genplis.watch.parse_music_file", lambda *args: (None, None, 0, 0.0)
+    )
+    os.utime(song, ns=(0, 0))
+    assert watcher.process_changes({song}) == []
+    assert song not in watcher.all_tags
+    assert watcher.playlists[tmp_path / "synthwave.m3ug"] == set()
+
+
+def test_inotify_monitor(tmp_path):
+    try:
+        monitor = InotifyMonitor(tmp_path)
+    except OSError:
+        pytest.skip("inotify not available")
+    (tmp_path / "album").mkdir()
+    monitor.add_watch(tmp_path / "album")
+
+    def change_files():
+        time.sleep(0.1)
+        (tmp_path / "album" / "song.mp3").write_bytes(b"")
+        (tmp_path / "other.mp3").write_bytes(b"")
+
+    try:
+        threading.Thread(target=change_files).start()
+        assert monitor.wait_changes(timeout=5) == {
+            tmp_path / "album",
+            tmp_path / "album" / "song.mp3",
+            tmp_path / "other.mp3",
+        }
+    finally:
+        monitor.close()